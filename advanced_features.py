@@ -3,10 +3,16 @@ Advanced Features for MedCore AI Platform
 Add these routes to your Flask application for enhanced functionality
 """
 from flask import jsonify, request, send_file
-from models import Patient, Vitals, LabResult, ChatSession, ChatMessage
-from database import db, get_patient_by_id, get_all_patients
+from models import Patient, PatientLatest, Vitals, LabResult, ChatSession, ChatMessage
+from database import (db, get_patient_by_id, get_patients_with_latest, get_latest_metrics, patient_text_search,
+                      fuzzy_patient_matches, get_dashboard_counters)
+from clinical_rules import (METRICS, RULES_BY_NAME, evaluate_cohort, cohort_alerting, cohort_alerts,
+                            evaluate_patient, patient_metrics, patient_status, rule_clause, status_clause, status_of)
+from sqlalchemy.orm import contains_eager
 from datetime import datetime, timedelta
 import io
+import json
+import numpy as np
 from reportlab.lib.pagesizes import letter
 from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
@@ -15,121 +21,47 @@ from reportlab.lib.units import inch
 
 # ==================== FEATURE 1: REAL-TIME DASHBOARD ====================
 
+DASHBOARD_LIST_SIZE = 50  # patients listed per status; counts cover everyone
+
 def get_patient_dashboard():
-    """Real-time dashboard with all patients and their health status"""
-    patients = get_all_patients()
+    """
+    Real-time dashboard with patient counts and health status
+    Totals and statistics come from the incrementally maintained dashboard counters
+    (see database.py); each status lists its first DASHBOARD_LIST_SIZE patients.
+    """
+    counters = get_dashboard_counters()
     
     dashboard = {
-        "total_patients": len(patients),
+        "total_patients": counters.get('total_patients', 0),
+        "counts": {status: counters.get(f'{status}_count', 0) for status in ('critical', 'warning', 'stable')},
         "critical": [],
         "warning": [],
         "stable": [],
         "statistics": {
             "avg_age": 0,
-            "high_bp_count": 0,
-            "low_spo2_count": 0,
-            "high_hr_count": 0,
-            "male_count": 0,
-            "female_count": 0
+            "high_bp_count": counters.get('high_bp_count', 0),
+            "low_spo2_count": counters.get('low_spo2_count', 0),
+            "high_hr_count": counters.get('high_hr_count', 0),
+            "male_count": counters.get('male_count', 0),
+            "female_count": counters.get('female_count', 0)
         }
     }
     
-    ages = []
-    for patient in patients:
-        vitals = patient.get('vitals', {})
-        
-        # Age statistics
-        if patient.get('age'):
-            ages.append(int(patient['age']))
-        
-        # Gender statistics
-        gender = patient.get('gender', '').lower()
-        if 'male' in gender and 'female' not in gender:
-            dashboard['statistics']['male_count'] += 1
-        elif 'female' in gender:
-            dashboard['statistics']['female_count'] += 1
-        
-        # Vitals statistics
-        bp = vitals.get('bp', '')
-        hr = vitals.get('hr', 0)
-        spo2 = vitals.get('spo2', 100)
-        
-        try:
-            if bp and '/' in str(bp):
-                systolic = int(str(bp).split('/')[0])
-                if systolic >= 140:
-                    dashboard['statistics']['high_bp_count'] += 1
-        except:
-            pass
-        
-        try:
-            if hr and int(hr) > 100:
-                dashboard['statistics']['high_hr_count'] += 1
-        except:
-            pass
-        
-        try:
-            if spo2 and int(spo2) < 95:
-                dashboard['statistics']['low_spo2_count'] += 1
-        except:
-            pass
-        
-        # Classify patient status
-        status = classify_patient_status(vitals)
-        patient['status'] = status
-        patient['status_color'] = get_status_color(status)
-        
-        if status == 'critical':
-            dashboard['critical'].append(patient)
-        elif status == 'warning':
-            dashboard['warning'].append(patient)
-        else:
-            dashboard['stable'].append(patient)
-    
     # Calculate average age
-    if ages:
-        dashboard['statistics']['avg_age'] = round(sum(ages) / len(ages), 1)
+    if counters.get('age_count'):
+        dashboard['statistics']['avg_age'] = round(counters['age_sum'] / counters['age_count'], 1)
+    
+    for status in ('critical', 'warning', 'stable'):
+        patients = advanced_patient_search('', {'status': status}, limit=DASHBOARD_LIST_SIZE)
+        for patient in patients:
+            patient['status_color'] = get_status_color(status)
+        dashboard[status] = patients
     
     return dashboard
 
 def classify_patient_status(vitals):
-    """Classify patient as critical, warning, or stable based on vitals"""
-    bp = vitals.get('bp', '')
-    hr = vitals.get('hr', 0)
-    spo2 = vitals.get('spo2', 100)
-    
-    try:
-        # Check blood pressure
-        if bp and '/' in str(bp):
-            systolic = int(str(bp).split('/')[0])
-            diastolic = int(str(bp).split('/')[1])
-            
-            # Critical BP
-            if systolic >= 180 or systolic < 90 or diastolic >= 120 or diastolic < 60:
-                return 'critical'
-            # Warning BP
-            if systolic >= 140 or systolic < 100 or diastolic >= 90 or diastolic < 70:
-                return 'warning'
-        
-        # Check heart rate
-        hr_val = int(hr) if hr else 0
-        if hr_val >= 120 or hr_val < 50:
-            return 'critical'
-        if hr_val >= 100 or hr_val < 60:
-            return 'warning'
-        
-        # Check SpO2
-        spo2_val = int(spo2) if spo2 else 100
-        if spo2_val < 90:
-            return 'critical'
-        if spo2_val < 95:
-            return 'warning'
-            
-    except Exception as e:
-        print(f"Error classifying patient status: {e}")
-        return 'stable'
-    
-    return 'stable'
+    """Classify patient as critical, warning, or stable based on vitals (see clinical_rules.RULES)"""
+    return patient_status(patient_metrics({'vitals': vitals or {}}))
 
 def get_status_color(status):
     """Get color code for patient status"""
@@ -223,29 +155,45 @@ def get_patient_trends(patient_id):
 
 # ==================== FEATURE 3: ADVANCED SEARCH ====================
 
-def advanced_patient_search(query, filters=None):
-    """Advanced search for patients with multiple filters"""
+SEARCH_PAGE_SIZE = 100
+SEARCH_MAX_PAGE_SIZE = 500
+
+def _int_filter(filters, name):
+    try:
+        return int(filters[name])
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an integer, got {filters[name]!r}")
+
+def advanced_patient_search(query, filters=None, after=None, limit=None, fuzzy=False):
+    """
+    Advanced search for patients with multiple filters
+    Status ('critical' / 'warning' / 'stable') and alert (rule name, e.g. 'spo2_low')
+    filters run in SQL over the patient_latest snapshot (init_db creates any missing
+    ones, see database._backfill_patient_latest). Results are in registration
+    order; pass the last patient_id of a page as `after` for the next one.
+    fuzzy=True tolerates typos in the query and orders results by similarity
+    instead (each with a 'score'); it returns a single page.
+    Invalid filters and unknown cursors raise ValueError.
+    """
     filters = filters or {}
     
     # Base query
     query_obj = Patient.query
     
-    # Text search in name, patient_id, symptoms
-    if query:
-        search_term = f"%{query}%"
-        query_obj = query_obj.filter(
-            db.or_(
-                Patient.name.like(search_term),
-                Patient.patient_id.like(search_term),
-                Patient.symptoms.like(search_term)
-            )
-        )
+    # Text search in name, patient_id, symptoms (trigram index, see database.py)
+    scores = None
+    page_key = Patient.id
+    if query and fuzzy:
+        scores = dict(fuzzy_patient_matches(query))
+        query_obj = query_obj.filter(Patient.patient_id.in_(list(scores)))
+    elif query:
+        query_obj, page_key = patient_text_search(query_obj, query)
     
     # Age filter
     if filters.get('min_age'):
-        query_obj = query_obj.filter(Patient.age >= int(filters['min_age']))
+        query_obj = query_obj.filter(Patient.age >= _int_filter(filters, 'min_age'))
     if filters.get('max_age'):
-        query_obj = query_obj.filter(Patient.age <= int(filters['max_age']))
+        query_obj = query_obj.filter(Patient.age <= _int_filter(filters, 'max_age'))
     
     # Gender filter
     if filters.get('gender'):
@@ -259,120 +207,73 @@ def advanced_patient_search(query, filters=None):
         end_date = datetime.fromisoformat(filters['end_date'])
         query_obj = query_obj.filter(Patient.timestamp <= end_date)
     
-    patients = query_obj.all()
-    
-    # Apply vitals filters (requires join)
+    # Vitals filters on the latest readings (see clinical_rules.RULES)
+    if filters.get('status') or filters.get('alert'):
+        columns = {metric: getattr(PatientLatest, metric) for metric in METRICS}
+        query_obj = query_obj.outerjoin(Patient.latest).options(contains_eager(Patient.latest))
+        if filters.get('status'):
+            query_obj = query_obj.filter(status_clause(filters['status'], columns))
+        if filters.get('alert'):
+            rule = RULES_BY_NAME.get(filters['alert'])
+            if rule is None:
+                raise ValueError(f"Unknown alert rule: {filters['alert']}")
+            query_obj = query_obj.filter(rule_clause(rule, columns))
+    
+    if scores is not None:
+        patients = get_patients_with_latest(query_obj)
+        for patient_dict in patients:
+            patient_dict['score'] = round(scores[patient_dict['patient_id']], 3)
+            if filters.get('status'):
+                patient_dict['status'] = filters['status']
+        patients.sort(key=lambda patient_dict: -patient_dict['score'])
+        return patients[:limit] if limit else patients
+    
+    # Keyset pagination in registration order; the cursor is the last patient_id
+    query_obj = query_obj.order_by(page_key)
+    if after:
+        after_id = db.session.execute(db.select(Patient.id).where(Patient.patient_id == after)).scalar()
+        if after_id is None:
+            raise ValueError(f"Unknown cursor: no patient {after}")
+        query_obj = query_obj.filter(page_key > after_id)
+    if limit:
+        query_obj = query_obj.limit(limit)
+    
+    patients = get_patients_with_latest(query_obj)
     if filters.get('status'):
-        filtered_patients = []
-        for patient in patients:
-            patient_dict = patient.to_dict()
-            status = classify_patient_status(patient_dict.get('vitals', {}))
-            if status == filters['status']:
-                patient_dict['status'] = status
-                filtered_patients.append(patient_dict)
-        return filtered_patients
-    
-    return [p.to_dict() for p in patients]
+        for patient_dict in patients:
+            patient_dict['status'] = filters['status']
+    
+    return patients
 
 
 # ==================== FEATURE 4: PATIENT ALERTS ====================
 
 def get_patient_alerts():
-    """Get all critical alerts for patients"""
+    """
+    Get all critical alerts for patients
+    The rules run over the numeric patient_latest columns; only the patients that
+    alert have their snapshot JSON parsed for the alert messages.
+    """
     alerts = []
-    patients = get_all_patients()
+    rows, frame = get_latest_metrics(Patient.patient_id, Patient.name, PatientLatest.vitals_json,
+                                     PatientLatest.labs_json)
+    masks = evaluate_cohort(frame)
+    patients = {}
+    for i in np.flatnonzero(cohort_alerting(masks)).tolist():
+        patient_id, _, vitals_json, labs_json = rows[i]
+        if vitals_json is None and labs_json is None:
+            patients[i] = get_patient_by_id(patient_id)  # No snapshot yet
+        else:
+            patients[i] = {'vitals': json.loads(vitals_json or '{}'), 'lab_results': json.loads(labs_json or '{}')}
     
-    for patient in patients:
-        vitals = patient.get('vitals', {})
-        labs = patient.get('lab_results', {})
-        patient_alerts = []
-        
-        # Check vitals
-        bp = vitals.get('bp', '')
-        hr = vitals.get('hr', 0)
-        spo2 = vitals.get('spo2', 100)
-        
-        try:
-            if bp and '/' in str(bp):
-                systolic = int(str(bp).split('/')[0])
-                if systolic >= 180:
-                    patient_alerts.append({
-                        "type": "critical",
-                        "category": "Blood Pressure",
-                        "message": f"Critical high BP: {bp} mmHg",
-                        "recommendation": "Immediate medical attention required"
-                    })
-                elif systolic >= 140:
-                    patient_alerts.append({
-                        "type": "warning",
-                        "category": "Blood Pressure",
-                        "message": f"Elevated BP: {bp} mmHg",
-                        "recommendation": "Monitor closely and consider medication adjustment"
-                    })
-        except:
-            pass
-        
-        try:
-            hr_val = int(hr) if hr else 0
-            if hr_val >= 120:
-                patient_alerts.append({
-                    "type": "critical",
-                    "category": "Heart Rate",
-                    "message": f"Critical tachycardia: {hr} bpm",
-                    "recommendation": "ECG and cardiac evaluation needed"
-                })
-            elif hr_val >= 100:
-                patient_alerts.append({
-                    "type": "warning",
-                    "category": "Heart Rate",
-                    "message": f"Elevated heart rate: {hr} bpm",
-                    "recommendation": "Monitor and assess for underlying causes"
-                })
-        except:
-            pass
-        
-        try:
-            spo2_val = int(spo2) if spo2 else 100
-            if spo2_val < 90:
-                patient_alerts.append({
-                    "type": "critical",
-                    "category": "Oxygen Saturation",
-                    "message": f"Critical low SpO2: {spo2}%",
-                    "recommendation": "Oxygen therapy required immediately"
-                })
-            elif spo2_val < 95:
-                patient_alerts.append({
-                    "type": "warning",
-                    "category": "Oxygen Saturation",
-                    "message": f"Low SpO2: {spo2}%",
-                    "recommendation": "Respiratory assessment needed"
-                })
-        except:
-            pass
-        
-        # Check labs
-        try:
-            troponin = labs.get('troponin')
-            if troponin:
-                troponin_val = float(troponin)
-                if troponin_val > 0.04:
-                    patient_alerts.append({
-                        "type": "critical",
-                        "category": "Cardiac Markers",
-                        "message": f"Elevated troponin: {troponin} ng/mL",
-                        "recommendation": "Rule out acute coronary syndrome"
-                    })
-        except:
-            pass
-        
-        if patient_alerts:
-            alerts.append({
-                "patient_id": patient.get('patient_id'),
-                "patient_name": patient.get('name'),
-                "alerts": patient_alerts,
-                "alert_count": len(patient_alerts),
-                "highest_severity": "critical" if any(a['type'] == 'critical' for a in patient_alerts) else "warning"
-            })
+    for i, patient_alerts in cohort_alerts(patients, masks).items():
+        alerts.append({
+            "patient_id": rows[i][0],
+            "patient_name": rows[i][1],
+            "alerts": patient_alerts,
+            "alert_count": len(patient_alerts),
+            "highest_severity": "critical" if any(a['type'] == 'critical' for a in patient_alerts) else "warning"
+        })
     
     # Sort by severity (critical first)
     alerts.sort(key=lambda x: (x['highest_severity'] != 'critical', x['alert_count']), reverse=False)
@@ -502,42 +403,21 @@ def generate_patient_report_pdf(patient_id):
     buffer.seek(0)
     return buffer
 
+# PDF labels for the statuses of a single vital
+VITAL_STATUS_LABELS = {'critical': 'CRITICAL', 'warning': 'WARNING', 'stable': 'Normal'}
+VITAL_CATEGORIES = {'bp': 'Blood Pressure', 'hr': 'Heart Rate', 'spo2': 'Oxygen Saturation'}
+
 def classify_vital_status(vital_type, value):
     """Classify vital sign as Normal, Warning, or Critical"""
     if not value:
         return 'Not recorded'
+    if vital_type not in VITAL_CATEGORIES:
+        return 'Normal'
     
-    try:
-        if vital_type == 'bp':
-            systolic = int(str(value).split('/')[0])
-            if systolic >= 180:
-                return 'CRITICAL'
-            elif systolic >= 140:
-                return 'WARNING'
-            else:
-                return 'Normal'
-        
-        elif vital_type == 'hr':
-            hr_val = int(value)
-            if hr_val >= 120 or hr_val < 50:
-                return 'CRITICAL'
-            elif hr_val >= 100 or hr_val < 60:
-                return 'WARNING'
-            else:
-                return 'Normal'
-        
-        elif vital_type == 'spo2':
-            spo2_val = int(value)
-            if spo2_val < 90:
-                return 'CRITICAL'
-            elif spo2_val < 95:
-                return 'WARNING'
-            else:
-                return 'Normal'
-    except:
+    metrics = patient_metrics({'vitals': {vital_type: value}})
+    if all(v is None for v in metrics.values()):
         return 'Unknown'
-    
-    return 'Normal'
+    return VITAL_STATUS_LABELS[status_of(evaluate_patient(metrics=metrics), (VITAL_CATEGORIES[vital_type],))]
 
 
 # ==================== FEATURE 6: APPOINTMENT SYSTEM ====================
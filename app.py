@@ -1,25 +1,34 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for
+from flask import Flask, request, jsonify, render_template, redirect, url_for, Response, stream_with_context
 import json
 import os
 import io
 import base64
 import pandas as pd
 import matplotlib.pyplot as plt
-from datetime import datetime
+from datetime import datetime, timedelta
 import requests
 from dotenv import load_dotenv
 import google.generativeai as genai
+from llm_cache import fingerprint
+from llm_executor import get_llm_executor
+from sse import SSE_HEADERS, format_sse, wants_event_stream
+from event_bus import publish, register_event_routes
 
 # Database imports
-from models import db
-from database import (init_db, save_patient_data, get_patient_by_id, get_all_patients,
-                      get_patient_comparison_data)
+from models import db, Appointment, Prescription, VideoCallRequest, PharmacyMessage, User, EmergencyAlert
+from database import (init_db, save_patient_data, get_patient_by_id,
+                      get_patient_comparison_data, allocate_id, bump_collection_version)
+from http_cache import conditional_get
+from patient_listing import LISTING_VARY, patient_list_response
+from intents import patient_health_matcher, assistant_matcher
+from clinical_rules import evaluate_patient, patient_metrics
 
 load_dotenv()
 app = Flask(__name__, template_folder="templates", static_folder="frontend/static")
 
 # Initialize database
 init_db(app)
+register_event_routes(app)
 
 # Resolve data file paths relative to this script's directory
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -98,9 +107,12 @@ def get_patient_data(patient_id):
     return jsonify([patient_data])  # Return as array for backwards compatibility
 
 @app.route("/get_all_patients")
+@conditional_get('patients', vary=LISTING_VARY)
 def get_all_patients_route():
-    all_patients = get_all_patients()
-    return jsonify(all_patients)
+    try:
+        return patient_list_response()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
 @app.route("/patient_compare_plot/<patient_id>")
 def patient_compare_plot(patient_id):
@@ -320,10 +332,10 @@ def api_patient_inference():
 
 def generate_patient_health_response(message):
     """Generate basic health information responses for patients"""
-    message = message.lower()
+    intents = patient_health_matcher.match(message)
     
     # General health tips
-    if any(word in message for word in ["health tips", "healthy", "wellness", "general health"]):
+    if "health_tips" in intents:
         return """Here are some general health tips:
 
 🥗 **Nutrition:**
@@ -354,7 +366,7 @@ def generate_patient_health_response(message):
 Remember: This is general information. Always consult your doctor for personalized medical advice."""
 
     # Symptoms inquiry
-    if any(word in message for word in ["symptoms", "feeling sick", "not well", "pain"]):
+    if "symptoms" in intents:
         return """I understand you're experiencing symptoms. Here's what you should know:
 
 ⚠️ **When to See a Doctor:**
@@ -382,7 +394,7 @@ Remember: This is general information. Always consult your doctor for personaliz
 Please consult a healthcare provider for proper diagnosis and treatment. This chat is for information only."""
 
     # When to see doctor
-    if any(word in message for word in ["see a doctor", "doctor", "medical help", "appointment"]):
+    if "see_doctor" in intents:
         return """You should see a doctor if you experience:
 
 🔴 **Urgent (Within 24 hours):**
@@ -414,7 +426,7 @@ Please consult a healthcare provider for proper diagnosis and treatment. This ch
 You can also use our video consultation feature to connect with a doctor remotely!"""
 
     # Medication questions
-    if any(word in message for word in ["medication", "medicine", "pills", "drugs"]):
+    if "medication" in intents:
         return """Important information about medications:
 
 💊 **Taking Medications Safely:**
@@ -444,7 +456,7 @@ You can also use our video consultation feature to connect with a doctor remotel
 For specific medication questions, please consult your doctor or pharmacist."""
 
     # Diet and nutrition
-    if any(word in message for word in ["diet", "nutrition", "food", "eating"]):
+    if "diet" in intents:
         return """Nutrition guidelines for better health:
 
 🥗 **Balanced Diet Includes:**
@@ -476,7 +488,7 @@ For specific medication questions, please consult your doctor or pharmacist."""
 For personalized nutrition advice, consider consulting a registered dietitian."""
 
     # Exercise and fitness
-    if any(word in message for word in ["exercise", "workout", "fitness", "physical activity"]):
+    if "exercise" in intents:
         return """Exercise recommendations for adults:
 
 🏃 **Cardio (Aerobic):**
@@ -513,7 +525,7 @@ For personalized nutrition advice, consider consulting a registered dietitian.""
 Remember: Any movement is better than none!"""
 
     # Mental health
-    if any(word in message for word in ["stress", "anxiety", "depression", "mental health", "mood"]):
+    if "mental_health" in intents:
         return """Mental health is just as important as physical health:
 
 🧠 **Signs to Watch For:**
@@ -578,14 +590,14 @@ How can I help you today?"""
 
 def generate_ai_response(message, patient_data, patient_id):
     """Generate a response based on the user's message and patient data"""
-    message = message.lower()
+    intents = assistant_matcher.match(message)
     
     # Greeting
-    if any(word in message for word in ["hello", "hi", "hey"]):
+    if "greeting" in intents:
         return "Hello! I'm your AI medical assistant. How can I help you with this patient today?"
     
     # Patient information
-    if any(word in message for word in ["patient info", "patient details", "patient data"]):
+    if "patient_info" in intents:
         if not patient_data:
             return "I don't have any patient data to analyze. Please load a patient's data first."
         
@@ -614,7 +626,7 @@ def generate_ai_response(message, patient_data, patient_id):
         return "\n".join(response)
     
     # Medical advice (very basic - in a real app, this would use a proper medical AI)
-    if any(word in message for word in ["diagnose", "what's wrong", "analysis"]):
+    if "assessment" in intents:
         if not patient_data:
             return "I need to see the patient's data first. Please load the patient's information."
             
@@ -661,57 +673,42 @@ def clinical_insights(patient_id):
     # Generate clinical insights based on data
     insights = []
     
+    metrics = patient_metrics(latest_current)
+    fired = evaluate_patient(metrics=metrics)
+    
     # Blood Pressure Analysis
-    if latest_current.get('vitals', {}).get('bp'):
-        try:
-            bp = latest_current['vitals']['bp']
-            if '/' in str(bp):
-                systolic, diastolic = map(int, str(bp).split('/'))
-                if systolic >= 140 or diastolic >= 90:
-                    insights.append("⚠️ High blood pressure detected. Consider lifestyle changes and medication review.")
-                elif systolic >= 130 or diastolic >= 80:
-                    insights.append("⚠️ Elevated blood pressure. Monitor closely and consider dietary modifications.")
-                else:
-                    insights.append("✅ Blood pressure within normal range.")
-        except:
-            pass
+    if metrics['systolic'] is not None and metrics['diastolic'] is not None:
+        if 'bp_high' in fired:
+            insights.append("⚠️ High blood pressure detected. Consider lifestyle changes and medication review.")
+        elif 'bp_elevated' in fired:
+            insights.append("⚠️ Elevated blood pressure. Monitor closely and consider dietary modifications.")
+        else:
+            insights.append("✅ Blood pressure within normal range.")
     
     # Heart Rate Analysis
-    if latest_current.get('vitals', {}).get('hr'):
-        try:
-            hr = int(latest_current['vitals']['hr'])
-            if hr > 100:
-                insights.append("⚠️ Elevated heart rate. Consider stress management and physical activity assessment.")
-            elif hr < 60:
-                insights.append("⚠️ Low heart rate. Monitor for symptoms and consider cardiac evaluation.")
-            else:
-                insights.append("✅ Heart rate within normal range.")
-        except:
-            pass
+    if metrics['hr'] is not None:
+        if 'hr_high' in fired:
+            insights.append("⚠️ Elevated heart rate. Consider stress management and physical activity assessment.")
+        elif 'hr_low' in fired:
+            insights.append("⚠️ Low heart rate. Monitor for symptoms and consider cardiac evaluation.")
+        else:
+            insights.append("✅ Heart rate within normal range.")
     
     # Oxygen Saturation Analysis
-    if latest_current.get('vitals', {}).get('spo2'):
-        try:
-            spo2 = int(latest_current['vitals']['spo2'])
-            if spo2 < 95:
-                insights.append("⚠️ Low oxygen saturation. Consider respiratory evaluation and oxygen therapy.")
-            else:
-                insights.append("✅ Oxygen saturation normal.")
-        except:
-            pass
+    if metrics['spo2'] is not None:
+        if 'spo2_low' in fired:
+            insights.append("⚠️ Low oxygen saturation. Consider respiratory evaluation and oxygen therapy.")
+        else:
+            insights.append("✅ Oxygen saturation normal.")
     
     # Cholesterol Analysis
-    if latest_current.get('lab_results', {}).get('cholesterol'):
-        try:
-            cholesterol = int(latest_current['lab_results']['cholesterol'])
-            if cholesterol > 200:
-                insights.append("⚠️ High cholesterol levels. Consider statin therapy and dietary modifications.")
-            elif cholesterol > 180:
-                insights.append("⚠️ Borderline high cholesterol. Monitor and consider lifestyle changes.")
-            else:
-                insights.append("✅ Cholesterol levels within target range.")
-        except:
-            pass
+    if metrics['cholesterol'] is not None:
+        if 'cholesterol_high' in fired:
+            insights.append("⚠️ High cholesterol levels. Consider statin therapy and dietary modifications.")
+        elif 'cholesterol_borderline' in fired:
+            insights.append("⚠️ Borderline high cholesterol. Monitor and consider lifestyle changes.")
+        else:
+            insights.append("✅ Cholesterol levels within target range.")
     
     # Symptoms Analysis
     if latest_current.get('symptoms'):
@@ -757,6 +754,16 @@ def clinical_insights(patient_id):
     })
 
 # ------------------- Video Call & Appointment Routes -------------------
+def _count_by(query, column):
+    """Return {value: row count} for column over query, grouped in SQL"""
+    rows = query.order_by(None).with_entities(column, db.func.count()).group_by(column).all()
+    return {value: count for value, count in rows}
+
+def _today_bounds():
+    """Return (start, end) datetimes for the current local day"""
+    start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return start, start + timedelta(days=1)
+
 @app.route("/api/request_video_call", methods=["POST"])
 def request_video_call():
     """Patient requests a video call with doctor"""
@@ -769,54 +776,40 @@ def request_video_call():
         if not patient_id:
             return jsonify({"status": "error", "message": "Patient ID required"}), 400
         
-        # Load existing video call requests
-        video_calls_file = _data_path("video_calls.json")
-        try:
-            with open(video_calls_file, "r") as f:
-                video_calls = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            video_calls = []
-        
         # Create new video call request
-        new_request = {
-            "id": f"VC{len(video_calls) + 1:04d}",
-            "patient_id": patient_id,
-            "patient_name": patient_name,
-            "reason": reason,
-            "status": "pending",
-            "requested_at": datetime.now().isoformat(),
-            "read": False
-        }
-        
-        video_calls.append(new_request)
-        
-        # Save updated video calls
-        with open(video_calls_file, "w") as f:
-            json.dump(video_calls, f, indent=2)
+        new_request = VideoCallRequest(
+            request_id=allocate_id('VC'),
+            patient_id=patient_id,
+            patient_name=patient_name,
+            reason=reason,
+            status="pending",
+            created_at=datetime.now(),
+            read=False
+        )
+        db.session.add(new_request)
+        bump_collection_version('video_calls')
+        db.session.commit()
+        publish("video_calls", "video_call_requested", new_request.to_dict())
         
         return jsonify({
             "status": "success",
             "message": "Video call request sent to doctor",
-            "request_id": new_request["id"]
+            "request_id": new_request.request_id
         })
     except Exception as e:
+        db.session.rollback()
         print(f"Error in request_video_call: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route("/api/get_video_call_requests", methods=["GET"])
+@conditional_get('video_calls')
 def get_video_call_requests():
     """Doctor gets all pending video call requests"""
     try:
-        video_calls_file = _data_path("video_calls.json")
-        try:
-            with open(video_calls_file, "r") as f:
-                video_calls = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            video_calls = []
-        
         # Filter pending requests
-        pending_requests = [vc for vc in video_calls if vc.get('status') == 'pending']
-        unread_count = len([vc for vc in pending_requests if not vc.get('read', False)])
+        pending_query = VideoCallRequest.query.filter_by(status='pending')
+        pending_requests = [vc.to_dict() for vc in pending_query.order_by(VideoCallRequest.id).all()]
+        unread_count = pending_query.filter_by(read=False).count()
         
         return jsonify({
             "status": "success",
@@ -832,20 +825,14 @@ def get_video_call_requests():
 def mark_request_read(request_id):
     """Mark a video call request as read"""
     try:
-        video_calls_file = _data_path("video_calls.json")
-        with open(video_calls_file, "r") as f:
-            video_calls = json.load(f)
-        
-        for vc in video_calls:
-            if vc.get('id') == request_id:
-                vc['read'] = True
-                break
-        
-        with open(video_calls_file, "w") as f:
-            json.dump(video_calls, f, indent=2)
+        VideoCallRequest.query.filter_by(request_id=request_id).update({'read': True})
+        bump_collection_version('video_calls')
+        db.session.commit()
+        publish("video_calls", "video_call_read", {"id": request_id})
         
         return jsonify({"status": "success"})
     except Exception as e:
+        db.session.rollback()
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route("/api/schedule_appointment", methods=["POST"])
@@ -864,64 +851,47 @@ def schedule_appointment():
         if not patient_id or not appointment_date or not appointment_time:
             return jsonify({"status": "error", "message": "Missing required fields"}), 400
         
-        # Load existing appointments
-        appointments_file = _data_path("appointments.json")
-        try:
-            with open(appointments_file, "r") as f:
-                appointments = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            appointments = []
-        
         # Create new appointment
-        new_appointment = {
-            "id": f"APT{len(appointments) + 1:04d}",
-            "patient_id": patient_id,
-            "patient_name": patient_name,
-            "doctor_name": doctor_name,
-            "appointment_date": appointment_date,
-            "appointment_time": appointment_time,
-            "duration": duration,
-            "notes": notes,
-            "status": "scheduled",
-            "created_at": datetime.now().isoformat(),
-            "patient_notified": False
-        }
-        
-        appointments.append(new_appointment)
-        
-        # Save updated appointments
-        with open(appointments_file, "w") as f:
-            json.dump(appointments, f, indent=2)
+        new_appointment = Appointment(
+            appointment_id=allocate_id('APT'),
+            patient_id=patient_id,
+            patient_name=patient_name,
+            doctor_name=doctor_name,
+            appointment_date=appointment_date,
+            appointment_time=appointment_time,
+            duration=str(duration),
+            notes=notes,
+            status="scheduled",
+            created_at=datetime.now(),
+            patient_notified=False
+        )
+        db.session.add(new_appointment)
+        bump_collection_version('appointments')
+        db.session.commit()
         
         return jsonify({
             "status": "success",
             "message": "Appointment scheduled successfully",
-            "appointment": new_appointment
+            "appointment": new_appointment.to_dict()
         })
     except Exception as e:
+        db.session.rollback()
         print(f"Error in schedule_appointment: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route("/api/get_patient_appointments/<patient_id>", methods=["GET"])
+@conditional_get('appointments')
 def get_patient_appointments(patient_id):
     """Get all appointments for a specific patient"""
     try:
-        appointments_file = _data_path("appointments.json")
-        try:
-            with open(appointments_file, "r") as f:
-                appointments = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            appointments = []
-        
-        # Filter appointments for this patient
-        patient_appointments = [apt for apt in appointments if apt.get('patient_id') == patient_id]
-        
-        # Sort by date and time
-        patient_appointments.sort(key=lambda x: (x.get('appointment_date', ''), x.get('appointment_time', '')), reverse=True)
+        # Filter appointments for this patient, sorted by date and time
+        patient_appointments = Appointment.query.filter_by(patient_id=patient_id).order_by(
+            Appointment.appointment_date.desc(), Appointment.appointment_time.desc()
+        ).all()
         
         return jsonify({
             "status": "success",
-            "appointments": patient_appointments,
+            "appointments": [apt.to_dict() for apt in patient_appointments],
             "total_count": len(patient_appointments)
         })
     except Exception as e:
@@ -929,22 +899,18 @@ def get_patient_appointments(patient_id):
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route("/api/get_all_appointments", methods=["GET"])
+@conditional_get('appointments')
 def get_all_appointments():
     """Doctor gets all appointments"""
     try:
-        appointments_file = _data_path("appointments.json")
-        try:
-            with open(appointments_file, "r") as f:
-                appointments = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            appointments = []
-        
         # Sort by date and time
-        appointments.sort(key=lambda x: (x.get('appointment_date', ''), x.get('appointment_time', '')), reverse=True)
+        appointments = Appointment.query.order_by(
+            Appointment.appointment_date.desc(), Appointment.appointment_time.desc()
+        ).all()
         
         return jsonify({
             "status": "success",
-            "appointments": appointments,
+            "appointments": [apt.to_dict() for apt in appointments],
             "total_count": len(appointments)
         })
     except Exception as e:
@@ -962,21 +928,16 @@ def update_appointment_status():
         if not appointment_id or not new_status:
             return jsonify({"status": "error", "message": "Missing required fields"}), 400
         
-        appointments_file = _data_path("appointments.json")
-        with open(appointments_file, "r") as f:
-            appointments = json.load(f)
-        
-        for apt in appointments:
-            if apt.get('id') == appointment_id:
-                apt['status'] = new_status
-                apt['updated_at'] = datetime.now().isoformat()
-                break
-        
-        with open(appointments_file, "w") as f:
-            json.dump(appointments, f, indent=2)
+        Appointment.query.filter_by(appointment_id=appointment_id).update({
+            'status': new_status,
+            'updated_at': datetime.now()
+        })
+        bump_collection_version('appointments')
+        db.session.commit()
         
         return jsonify({"status": "success", "message": "Appointment updated"})
     except Exception as e:
+        db.session.rollback()
         return jsonify({"status": "error", "message": str(e)}), 500
 
 # ------------------- Pharmacy Routes -------------------
@@ -999,78 +960,63 @@ def send_prescription():
         if not patient_id or not medicines:
             return jsonify({"status": "error", "message": "Patient ID and medicines required"}), 400
         
-        # Load existing prescriptions
-        prescriptions_file = _data_path("prescriptions.json")
-        try:
-            with open(prescriptions_file, "r") as f:
-                prescriptions = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            prescriptions = []
-        
         # Create new prescription
-        new_prescription = {
-            "id": f"RX{len(prescriptions) + 1:04d}",
-            "patient_id": patient_id,
-            "patient_name": patient_name,
-            "doctor_name": doctor_name,
-            "medicines": medicines,
-            "notes": notes,
-            "priority": priority,
-            "status": "pending",
-            "created_at": datetime.now().isoformat(),
-            "prepared_at": None,
-            "delivered_at": None,
-            "pharmacist_name": None
-        }
-        
-        prescriptions.append(new_prescription)
-        
-        # Save updated prescriptions
-        with open(prescriptions_file, "w") as f:
-            json.dump(prescriptions, f, indent=2)
+        new_prescription = Prescription(
+            prescription_id=allocate_id('RX'),
+            patient_id=patient_id,
+            patient_name=patient_name,
+            doctor_name=doctor_name,
+            medicines_json=json.dumps(medicines),
+            notes=notes,
+            priority=priority,
+            status="pending",
+            created_at=datetime.now()
+        )
+        db.session.add(new_prescription)
+        bump_collection_version('prescriptions')
+        db.session.commit()
+        publish("prescriptions", "prescription_created", new_prescription.to_dict())
         
         return jsonify({
             "status": "success",
             "message": "Prescription sent to pharmacy",
-            "prescription_id": new_prescription["id"]
+            "prescription_id": new_prescription.prescription_id
         })
     except Exception as e:
+        db.session.rollback()
         print(f"Error in send_prescription: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+# Sort rank used by the pharmacy queue (matches the previous in-memory sort)
+PRESCRIPTION_PRIORITY_ORDER = {'urgent': 0, 'high': 1, 'normal': 2, 'low': 3}
+
 @app.route("/api/get_prescriptions", methods=["GET"])
+@conditional_get('prescriptions')
 def get_prescriptions():
     """Pharmacy gets all prescriptions"""
     try:
         status_filter = request.args.get('status', None)
         
-        prescriptions_file = _data_path("prescriptions.json")
-        try:
-            with open(prescriptions_file, "r") as f:
-                prescriptions = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            prescriptions = []
+        query = Prescription.query
         
         # Filter by status if provided
         if status_filter:
-            prescriptions = [p for p in prescriptions if p.get('status') == status_filter]
+            query = query.filter_by(status=status_filter)
         
         # Sort by priority and date
-        priority_order = {'urgent': 0, 'high': 1, 'normal': 2, 'low': 3}
-        prescriptions.sort(key=lambda x: (priority_order.get(x.get('priority', 'normal'), 2), x.get('created_at', '')), reverse=True)
+        priority_rank = db.case(PRESCRIPTION_PRIORITY_ORDER, value=Prescription.priority, else_=2)
+        prescriptions = query.order_by(priority_rank.desc(), Prescription.created_at.desc()).all()
         
         # Count by status
-        pending_count = len([p for p in prescriptions if p.get('status') == 'pending'])
-        preparing_count = len([p for p in prescriptions if p.get('status') == 'preparing'])
-        ready_count = len([p for p in prescriptions if p.get('status') == 'ready'])
+        status_counts = _count_by(query, Prescription.status)
         
         return jsonify({
             "status": "success",
-            "prescriptions": prescriptions,
+            "prescriptions": [p.to_dict() for p in prescriptions],
             "total_count": len(prescriptions),
-            "pending_count": pending_count,
-            "preparing_count": preparing_count,
-            "ready_count": ready_count
+            "pending_count": status_counts.get('pending', 0),
+            "preparing_count": status_counts.get('preparing', 0),
+            "ready_count": status_counts.get('ready', 0)
         })
     except Exception as e:
         print(f"Error in get_prescriptions: {str(e)}")
@@ -1088,52 +1034,47 @@ def update_prescription_status():
         if not prescription_id or not new_status:
             return jsonify({"status": "error", "message": "Missing required fields"}), 400
         
-        prescriptions_file = _data_path("prescriptions.json")
-        with open(prescriptions_file, "r") as f:
-            prescriptions = json.load(f)
-        
-        for prescription in prescriptions:
-            if prescription.get('id') == prescription_id:
-                prescription['status'] = new_status
-                prescription['pharmacist_name'] = pharmacist_name
-                prescription['updated_at'] = datetime.now().isoformat()
-                
-                if new_status == 'preparing':
-                    prescription['preparing_at'] = datetime.now().isoformat()
-                elif new_status == 'ready':
-                    prescription['prepared_at'] = datetime.now().isoformat()
-                elif new_status == 'delivered':
-                    prescription['delivered_at'] = datetime.now().isoformat()
-                
-                break
-        
-        with open(prescriptions_file, "w") as f:
-            json.dump(prescriptions, f, indent=2)
+        now = datetime.now()
+        changes = {
+            'status': new_status,
+            'pharmacist_name': pharmacist_name,
+            'updated_at': now
+        }
+        if new_status == 'preparing':
+            changes['preparing_at'] = now
+        elif new_status == 'ready':
+            changes['prepared_at'] = now
+        elif new_status == 'delivered':
+            changes['delivered_at'] = now
+        
+        Prescription.query.filter_by(prescription_id=prescription_id).update(changes)
+        bump_collection_version('prescriptions')
+        db.session.commit()
+        publish("prescriptions", "prescription_updated", {
+            "id": prescription_id,
+            "status": new_status,
+            "pharmacist_name": pharmacist_name,
+            "updated_at": now.isoformat()
+        })
         
         return jsonify({"status": "success", "message": "Prescription status updated"})
     except Exception as e:
+        db.session.rollback()
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route("/api/get_patient_prescriptions/<patient_id>", methods=["GET"])
+@conditional_get('prescriptions')
 def get_patient_prescriptions(patient_id):
     """Get all prescriptions for a specific patient"""
     try:
-        prescriptions_file = _data_path("prescriptions.json")
-        try:
-            with open(prescriptions_file, "r") as f:
-                prescriptions = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            prescriptions = []
-        
-        # Filter prescriptions for this patient
-        patient_prescriptions = [p for p in prescriptions if p.get('patient_id') == patient_id]
-        
-        # Sort by date
-        patient_prescriptions.sort(key=lambda x: x.get('created_at', ''), reverse=True)
+        # Filter prescriptions for this patient, newest first
+        patient_prescriptions = Prescription.query.filter_by(patient_id=patient_id).order_by(
+            Prescription.created_at.desc()
+        ).all()
         
         return jsonify({
             "status": "success",
-            "prescriptions": patient_prescriptions,
+            "prescriptions": [p.to_dict() for p in patient_prescriptions],
             "total_count": len(patient_prescriptions)
         })
     except Exception as e:
@@ -1152,58 +1093,43 @@ def send_pharmacy_message():
         if not message:
             return jsonify({"status": "error", "message": "Message required"}), 400
         
-        # Load existing messages
-        messages_file = _data_path("pharmacy_messages.json")
-        try:
-            with open(messages_file, "r") as f:
-                messages = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            messages = []
-        
         # Create new message
-        new_message = {
-            "id": f"MSG{len(messages) + 1:04d}",
-            "from_name": from_name,
-            "message": message,
-            "prescription_id": prescription_id,
-            "created_at": datetime.now().isoformat(),
-            "read": False
-        }
-        
-        messages.append(new_message)
-        
-        # Save updated messages
-        with open(messages_file, "w") as f:
-            json.dump(messages, f, indent=2)
+        new_message = PharmacyMessage(
+            message_id=allocate_id('MSG'),
+            from_name=from_name,
+            message=message,
+            prescription_id=prescription_id,
+            created_at=datetime.now(),
+            read=False
+        )
+        db.session.add(new_message)
+        bump_collection_version('pharmacy_messages')
+        db.session.commit()
+        publish("pharmacy_messages", "pharmacy_message_created", new_message.to_dict())
         
         return jsonify({
             "status": "success",
             "message": "Message sent to pharmacy",
-            "message_id": new_message["id"]
+            "message_id": new_message.message_id
         })
     except Exception as e:
+        db.session.rollback()
         print(f"Error in send_pharmacy_message: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route("/api/get_pharmacy_messages", methods=["GET"])
+@conditional_get('pharmacy_messages')
 def get_pharmacy_messages():
     """Pharmacy gets all messages"""
     try:
-        messages_file = _data_path("pharmacy_messages.json")
-        try:
-            with open(messages_file, "r") as f:
-                messages = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            messages = []
-        
         # Sort by date
-        messages.sort(key=lambda x: x.get('created_at', ''), reverse=True)
+        messages = PharmacyMessage.query.order_by(PharmacyMessage.created_at.desc()).all()
         
-        unread_count = len([m for m in messages if not m.get('read', False)])
+        unread_count = PharmacyMessage.query.filter_by(read=False).count()
         
         return jsonify({
             "status": "success",
-            "messages": messages,
+            "messages": [m.to_dict() for m in messages],
             "total_count": len(messages),
             "unread_count": unread_count
         })
@@ -1215,20 +1141,14 @@ def get_pharmacy_messages():
 def mark_message_read(message_id):
     """Mark a pharmacy message as read"""
     try:
-        messages_file = _data_path("pharmacy_messages.json")
-        with open(messages_file, "r") as f:
-            messages = json.load(f)
-        
-        for msg in messages:
-            if msg.get('id') == message_id:
-                msg['read'] = True
-                break
-        
-        with open(messages_file, "w") as f:
-            json.dump(messages, f, indent=2)
+        PharmacyMessage.query.filter_by(message_id=message_id).update({'read': True})
+        bump_collection_version('pharmacy_messages')
+        db.session.commit()
+        publish("pharmacy_messages", "pharmacy_message_read", {"id": message_id})
         
         return jsonify({"status": "success"})
     except Exception as e:
+        db.session.rollback()
         return jsonify({"status": "error", "message": str(e)}), 500
 
 # ------------------- AI Chat for Patients -------------------
@@ -1276,8 +1196,17 @@ def patient_chat():
         # Send message directly to Gemini (no need to combine prompts)
         full_prompt = f"{system_prompt}\n\nUser: {message}\n\nAssistant:"
         
-        # Generate response using Gemini
-        response = patient_chat_model.generate_content(full_prompt)
+        executor = get_llm_executor()
+        if wants_event_stream(data):
+            return _stream_patient_chat(full_prompt, executor.default_timeout)
+        
+        # Generate response using Gemini on the bounded LLM executor
+        response = executor.run(
+            fingerprint("patient_chat", full_prompt),
+            patient_chat_model.generate_content,
+            full_prompt,
+            request_options={"timeout": executor.default_timeout}
+        )
         
         # Extract text from response
         ai_response = response.text if hasattr(response, 'text') else str(response)
@@ -1294,6 +1223,32 @@ def patient_chat():
             "response": "I'm sorry, I encountered an error. Please try again or contact support if the problem persists."
         }), 500
 
+def _stream_patient_chat(full_prompt, timeout):
+    """Stream the patient chat reply as Server-Sent Events ('delta' chunks, then 'done')"""
+    def generate():
+        parts = []
+        try:
+            # Hold an executor slot for the stream so it counts against the LLM concurrency cap
+            with get_llm_executor().slot(timeout):
+                stream = patient_chat_model.generate_content(full_prompt, stream=True, request_options={"timeout": timeout})
+                for chunk in stream:
+                    try:
+                        text = chunk.text
+                    except ValueError:
+                        continue
+                    if text:
+                        parts.append(text)
+                        yield format_sse({"delta": text}, event="delta")
+            yield format_sse({"response": "".join(parts), "status": "success"}, event="done")
+        except Exception as e:
+            print(f"Error in patient chat stream: {str(e)}")
+            yield format_sse({
+                "error": str(e),
+                "response": "I'm sorry, I encountered an error. Please try again or contact support if the problem persists."
+            }, event="error")
+    
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers=SSE_HEADERS)
+
 # ------------------- Admin Portal Routes -------------------
 @app.route("/admin")
 def admin():
@@ -1303,37 +1258,36 @@ def admin():
 def get_all_users():
     """Get all registered users (patients, doctors, pharmacists)"""
     try:
-        users_file = _data_path("users.json")
-        try:
-            with open(users_file, "r") as f:
-                users = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            users = []
+        query = User.query
         
         # Filter by role if specified
         role_filter = request.args.get('role', None)
         if role_filter:
-            users = [u for u in users if u.get('role') == role_filter]
+            query = query.filter_by(role=role_filter)
+        
+        users = query.order_by(User.id).all()
         
         # Count by role
-        patients_count = len([u for u in users if u.get('role') == 'patient'])
-        doctors_count = len([u for u in users if u.get('role') == 'doctor'])
-        pharmacists_count = len([u for u in users if u.get('role') == 'pharmacist'])
-        active_count = len([u for u in users if u.get('status') == 'active'])
+        role_counts = _count_by(query, User.role)
+        status_counts = _count_by(query, User.status)
         
         return jsonify({
             "status": "success",
-            "users": users,
+            "users": [u.to_dict() for u in users],
             "total_count": len(users),
-            "patients_count": patients_count,
-            "doctors_count": doctors_count,
-            "pharmacists_count": pharmacists_count,
-            "active_count": active_count
+            "patients_count": role_counts.get('patient', 0),
+            "doctors_count": role_counts.get('doctor', 0),
+            "pharmacists_count": role_counts.get('pharmacist', 0),
+            "active_count": status_counts.get('active', 0)
         })
     except Exception as e:
         print(f"Error in get_all_users: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+def _user_lookup(user_id):
+    """Match a user by account ID ("U0001") or role-specific user_id"""
+    return User.query.filter(db.or_(User.account_id == user_id, User.user_id == user_id))
+
 @app.route("/api/admin/user/<user_id>/status", methods=["POST"])
 def update_user_status(user_id):
     """Activate or deactivate a user account"""
@@ -1341,73 +1295,57 @@ def update_user_status(user_id):
         data = request.get_json()
         new_status = data.get('status', 'active')
         
-        users_file = _data_path("users.json")
-        with open(users_file, "r") as f:
-            users = json.load(f)
-        
-        for user in users:
-            if user.get('id') == user_id or user.get('user_id') == user_id:
-                user['status'] = new_status
-                user['updated_at'] = datetime.now().isoformat()
-                break
-        
-        with open(users_file, "w") as f:
-            json.dump(users, f, indent=2)
+        user = _user_lookup(user_id).order_by(User.id).first()
+        if user:
+            user.status = new_status
+            user.updated_at = datetime.now()
+            db.session.commit()
         
         return jsonify({"status": "success", "message": f"User status updated to {new_status}"})
     except Exception as e:
+        db.session.rollback()
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route("/api/admin/user/<user_id>", methods=["DELETE"])
 def delete_user(user_id):
     """Remove a user account"""
     try:
-        users_file = _data_path("users.json")
-        with open(users_file, "r") as f:
-            users = json.load(f)
-        
-        users = [u for u in users if u.get('id') != user_id and u.get('user_id') != user_id]
-        
-        with open(users_file, "w") as f:
-            json.dump(users, f, indent=2)
+        _user_lookup(user_id).delete(synchronize_session=False)
+        db.session.commit()
         
         return jsonify({"status": "success", "message": "User removed successfully"})
     except Exception as e:
+        db.session.rollback()
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route("/api/admin/appointments", methods=["GET"])
 def admin_get_appointments():
     """Get all appointments with filtering"""
     try:
-        appointments_file = _data_path("appointments.json")
-        try:
-            with open(appointments_file, "r") as f:
-                appointments = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            appointments = []
+        query = Appointment.query
         
         # Filter by status if specified
         status_filter = request.args.get('status', None)
         if status_filter:
-            appointments = [a for a in appointments if a.get('status') == status_filter]
+            query = query.filter_by(status=status_filter)
+        
+        appointments = query.order_by(Appointment.id).all()
         
         # Count by status
-        scheduled_count = len([a for a in appointments if a.get('status') == 'scheduled'])
-        completed_count = len([a for a in appointments if a.get('status') == 'completed'])
-        cancelled_count = len([a for a in appointments if a.get('status') == 'cancelled'])
+        status_counts = _count_by(query, Appointment.status)
         
         # Get today's appointments
         today = datetime.now().date().isoformat()
-        today_appointments = [a for a in appointments if a.get('appointment_date') == today]
+        today_count = query.filter(Appointment.appointment_date == today).count()
         
         return jsonify({
             "status": "success",
-            "appointments": appointments,
+            "appointments": [a.to_dict() for a in appointments],
             "total_count": len(appointments),
-            "scheduled_count": scheduled_count,
-            "completed_count": completed_count,
-            "cancelled_count": cancelled_count,
-            "today_count": len(today_appointments)
+            "scheduled_count": status_counts.get('scheduled', 0),
+            "completed_count": status_counts.get('completed', 0),
+            "cancelled_count": status_counts.get('cancelled', 0),
+            "today_count": today_count
         })
     except Exception as e:
         print(f"Error in admin_get_appointments: {str(e)}")
@@ -1423,54 +1361,43 @@ def reassign_appointment(appointment_id):
         if not new_doctor:
             return jsonify({"status": "error", "message": "Doctor name required"}), 400
         
-        appointments_file = _data_path("appointments.json")
-        with open(appointments_file, "r") as f:
-            appointments = json.load(f)
-        
-        for apt in appointments:
-            if apt.get('id') == appointment_id:
-                apt['doctor_name'] = new_doctor
-                apt['reassigned_at'] = datetime.now().isoformat()
-                apt['reassigned'] = True
-                break
-        
-        with open(appointments_file, "w") as f:
-            json.dump(appointments, f, indent=2)
+        Appointment.query.filter_by(appointment_id=appointment_id).update({
+            'doctor_name': new_doctor,
+            'reassigned_at': datetime.now(),
+            'reassigned': True
+        })
+        bump_collection_version('appointments')
+        db.session.commit()
         
         return jsonify({"status": "success", "message": f"Appointment reassigned to {new_doctor}"})
     except Exception as e:
+        db.session.rollback()
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route("/api/admin/prescriptions/stats", methods=["GET"])
 def get_prescription_stats():
     """Get pharmacy/prescription statistics"""
     try:
-        prescriptions_file = _data_path("prescriptions.json")
-        try:
-            with open(prescriptions_file, "r") as f:
-                prescriptions = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            prescriptions = []
+        prescriptions = Prescription.query.order_by(Prescription.id).all()
         
         # Count by status
-        pending_count = len([p for p in prescriptions if p.get('status') == 'pending'])
-        preparing_count = len([p for p in prescriptions if p.get('status') == 'preparing'])
-        ready_count = len([p for p in prescriptions if p.get('status') == 'ready'])
-        delivered_count = len([p for p in prescriptions if p.get('status') == 'delivered'])
+        status_counts = _count_by(Prescription.query, Prescription.status)
         
         # Get today's prescriptions
-        today = datetime.now().date().isoformat()
-        today_prescriptions = [p for p in prescriptions if p.get('created_at', '').startswith(today)]
+        today_start, today_end = _today_bounds()
+        today_count = Prescription.query.filter(
+            Prescription.created_at >= today_start, Prescription.created_at < today_end
+        ).count()
         
         return jsonify({
             "status": "success",
             "total_count": len(prescriptions),
-            "pending_count": pending_count,
-            "preparing_count": preparing_count,
-            "ready_count": ready_count,
-            "delivered_count": delivered_count,
-            "today_count": len(today_prescriptions),
-            "prescriptions": prescriptions
+            "pending_count": status_counts.get('pending', 0),
+            "preparing_count": status_counts.get('preparing', 0),
+            "ready_count": status_counts.get('ready', 0),
+            "delivered_count": status_counts.get('delivered', 0),
+            "today_count": today_count,
+            "prescriptions": [p.to_dict() for p in prescriptions]
         })
     except Exception as e:
         print(f"Error in get_prescription_stats: {str(e)}")
@@ -1480,58 +1407,40 @@ def get_prescription_stats():
 def get_admin_analytics():
     """Get comprehensive analytics for admin dashboard"""
     try:
-        # Load all data files
-        users_file = _data_path("users.json")
-        appointments_file = _data_path("appointments.json")
-        prescriptions_file = _data_path("prescriptions.json")
+        # Aggregate counts in SQL instead of loading every record
+        user_roles = _count_by(User.query, User.role)
+        user_statuses = _count_by(User.query, User.status)
+        appointment_statuses = _count_by(Appointment.query, Appointment.status)
+        prescription_statuses = _count_by(Prescription.query, Prescription.status)
         
-        # Users data
-        try:
-            with open(users_file, "r") as f:
-                users = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            users = []
-        
-        # Appointments data
-        try:
-            with open(appointments_file, "r") as f:
-                appointments = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            appointments = []
-        
-        # Prescriptions data
-        try:
-            with open(prescriptions_file, "r") as f:
-                prescriptions = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            prescriptions = []
-        
-        # Calculate analytics
         today = datetime.now().date().isoformat()
+        today_start, today_end = _today_bounds()
         
         analytics = {
             "users": {
-                "total": len(users),
-                "patients": len([u for u in users if u.get('role') == 'patient']),
-                "doctors": len([u for u in users if u.get('role') == 'doctor']),
-                "pharmacists": len([u for u in users if u.get('role') == 'pharmacist']),
-                "active": len([u for u in users if u.get('status') == 'active']),
-                "inactive": len([u for u in users if u.get('status') == 'inactive'])
+                "total": sum(user_roles.values()),
+                "patients": user_roles.get('patient', 0),
+                "doctors": user_roles.get('doctor', 0),
+                "pharmacists": user_roles.get('pharmacist', 0),
+                "active": user_statuses.get('active', 0),
+                "inactive": user_statuses.get('inactive', 0)
             },
             "appointments": {
-                "total": len(appointments),
-                "today": len([a for a in appointments if a.get('appointment_date') == today]),
-                "scheduled": len([a for a in appointments if a.get('status') == 'scheduled']),
-                "completed": len([a for a in appointments if a.get('status') == 'completed']),
-                "cancelled": len([a for a in appointments if a.get('status') == 'cancelled'])
+                "total": sum(appointment_statuses.values()),
+                "today": Appointment.query.filter(Appointment.appointment_date == today).count(),
+                "scheduled": appointment_statuses.get('scheduled', 0),
+                "completed": appointment_statuses.get('completed', 0),
+                "cancelled": appointment_statuses.get('cancelled', 0)
             },
             "prescriptions": {
-                "total": len(prescriptions),
-                "today": len([p for p in prescriptions if p.get('created_at', '').startswith(today)]),
-                "pending": len([p for p in prescriptions if p.get('status') == 'pending']),
-                "preparing": len([p for p in prescriptions if p.get('status') == 'preparing']),
-                "ready": len([p for p in prescriptions if p.get('status') == 'ready']),
-                "delivered": len([p for p in prescriptions if p.get('status') == 'delivered'])
+                "total": sum(prescription_statuses.values()),
+                "today": Prescription.query.filter(
+                    Prescription.created_at >= today_start, Prescription.created_at < today_end
+                ).count(),
+                "pending": prescription_statuses.get('pending', 0),
+                "preparing": prescription_statuses.get('preparing', 0),
+                "ready": prescription_statuses.get('ready', 0),
+                "delivered": prescription_statuses.get('delivered', 0)
             }
         }
         
@@ -1543,33 +1452,31 @@ def get_admin_analytics():
         print(f"Error in get_admin_analytics: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+# Sort rank used by the emergency alert list (matches the previous in-memory sort)
+ALERT_SEVERITY_ORDER = {'critical': 0, 'high': 1, 'medium': 2, 'low': 3}
+
 @app.route("/api/admin/emergency-alerts", methods=["GET"])
 def get_emergency_alerts():
     """Get all emergency alerts"""
     try:
-        alerts_file = _data_path("emergency_alerts.json")
-        try:
-            with open(alerts_file, "r") as f:
-                alerts = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            alerts = []
+        query = EmergencyAlert.query
         
         # Filter by status if specified
         status_filter = request.args.get('status', None)
         if status_filter:
-            alerts = [a for a in alerts if a.get('status') == status_filter]
+            query = query.filter_by(status=status_filter)
         
         # Sort by severity and date
-        severity_order = {'critical': 0, 'high': 1, 'medium': 2, 'low': 3}
-        alerts.sort(key=lambda x: (severity_order.get(x.get('severity', 'low'), 3), x.get('created_at', '')), reverse=True)
+        severity_rank = db.case(ALERT_SEVERITY_ORDER, value=EmergencyAlert.severity, else_=3)
+        alerts = query.order_by(severity_rank.desc(), EmergencyAlert.created_at.desc()).all()
         
         # Count by status
-        pending_count = len([a for a in alerts if a.get('status') == 'pending'])
-        forwarded_count = len([a for a in alerts if a.get('forwarded_to_hospital')])
+        pending_count = query.filter(EmergencyAlert.status == 'pending').count()
+        forwarded_count = query.filter(EmergencyAlert.forwarded_to_hospital.is_(True)).count()
         
         return jsonify({
             "status": "success",
-            "alerts": alerts,
+            "alerts": [a.to_dict() for a in alerts],
             "total_count": len(alerts),
             "pending_count": pending_count,
             "forwarded_count": forwarded_count
@@ -1588,44 +1495,32 @@ def forward_emergency_alert(alert_id):
         if not hospital_name:
             return jsonify({"status": "error", "message": "Hospital name required"}), 400
         
-        alerts_file = _data_path("emergency_alerts.json")
-        with open(alerts_file, "r") as f:
-            alerts = json.load(f)
-        
-        for alert in alerts:
-            if alert.get('id') == alert_id:
-                alert['forwarded_to_hospital'] = True
-                alert['hospital_name'] = hospital_name
-                alert['forwarded_at'] = datetime.now().isoformat()
-                alert['status'] = 'forwarded'
-                break
-        
-        with open(alerts_file, "w") as f:
-            json.dump(alerts, f, indent=2)
+        EmergencyAlert.query.filter_by(alert_id=alert_id).update({
+            'forwarded_to_hospital': True,
+            'hospital_name': hospital_name,
+            'forwarded_at': datetime.now(),
+            'status': 'forwarded'
+        })
+        db.session.commit()
         
         return jsonify({"status": "success", "message": f"Alert forwarded to {hospital_name}"})
     except Exception as e:
+        db.session.rollback()
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route("/api/admin/emergency-alert/<alert_id>/resolve", methods=["POST"])
 def resolve_emergency_alert(alert_id):
     """Mark emergency alert as resolved"""
     try:
-        alerts_file = _data_path("emergency_alerts.json")
-        with open(alerts_file, "r") as f:
-            alerts = json.load(f)
-        
-        for alert in alerts:
-            if alert.get('id') == alert_id:
-                alert['status'] = 'resolved'
-                alert['resolved_at'] = datetime.now().isoformat()
-                break
-        
-        with open(alerts_file, "w") as f:
-            json.dump(alerts, f, indent=2)
+        EmergencyAlert.query.filter_by(alert_id=alert_id).update({
+            'status': 'resolved',
+            'resolved_at': datetime.now()
+        })
+        db.session.commit()
         
         return jsonify({"status": "success", "message": "Alert marked as resolved"})
     except Exception as e:
+        db.session.rollback()
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route("/api/admin/patient-analytics/<patient_id>", methods=["GET"])
@@ -1635,39 +1530,23 @@ def get_patient_analytics(patient_id):
         # Get patient data
         patient_data = get_patient_by_id(patient_id)
         
-        # Get appointments
-        appointments_file = _data_path("appointments.json")
-        try:
-            with open(appointments_file, "r") as f:
-                appointments = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            appointments = []
-        
-        patient_appointments = [a for a in appointments if a.get('patient_id') == patient_id]
-        
-        # Get prescriptions
-        prescriptions_file = _data_path("prescriptions.json")
-        try:
-            with open(prescriptions_file, "r") as f:
-                prescriptions = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            prescriptions = []
-        
-        patient_prescriptions = [p for p in prescriptions if p.get('patient_id') == patient_id]
+        # Get appointment and prescription counts for this patient
+        appointment_statuses = _count_by(Appointment.query.filter_by(patient_id=patient_id), Appointment.status)
+        prescription_statuses = _count_by(Prescription.query.filter_by(patient_id=patient_id), Prescription.status)
         
         analytics = {
             "patient_id": patient_id,
             "patient_data": patient_data,
             "appointments": {
-                "total": len(patient_appointments),
-                "completed": len([a for a in patient_appointments if a.get('status') == 'completed']),
-                "scheduled": len([a for a in patient_appointments if a.get('status') == 'scheduled']),
-                "cancelled": len([a for a in patient_appointments if a.get('status') == 'cancelled'])
+                "total": sum(appointment_statuses.values()),
+                "completed": appointment_statuses.get('completed', 0),
+                "scheduled": appointment_statuses.get('scheduled', 0),
+                "cancelled": appointment_statuses.get('cancelled', 0)
             },
             "prescriptions": {
-                "total": len(patient_prescriptions),
-                "delivered": len([p for p in patient_prescriptions if p.get('status') == 'delivered']),
-                "pending": len([p for p in patient_prescriptions if p.get('status') == 'pending'])
+                "total": sum(prescription_statuses.values()),
+                "delivered": prescription_statuses.get('delivered', 0),
+                "pending": prescription_statuses.get('pending', 0)
             }
         }
         
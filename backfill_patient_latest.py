@@ -0,0 +1,28 @@
+"""
+Backfill script for the patient_latest snapshot table
+Run this once on existing databases (e.g. medcore.db) so patient reads use the
+denormalized latest vitals/labs instead of sorting the vitals and lab_results tables.
+Running it again rewrites snapshots saved with raw request values (e.g. "hr": "130")
+with the column-typed values read back from the tables.
+"""
+from flask import Flask
+from database import init_db, rebuild_patient_latest
+
+def backfill_patient_latest():
+    """Rebuild patient_latest from the vitals and lab_results tables"""
+    app = Flask(__name__)
+    init_db(app)
+    
+    with app.app_context():
+        print("=" * 60)
+        print("MedCore AI - patient_latest Backfill")
+        print("=" * 60)
+        
+        count = rebuild_patient_latest()
+        
+        print(f"\nSnapshots written: {count}")
+        print("=" * 60)
+        return count
+
+if __name__ == "__main__":
+    backfill_patient_latest()
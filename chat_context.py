@@ -0,0 +1,101 @@
+"""
+Prompt context for the Gemini chat
+Older turns are folded into a running summary kept on the chat session, so each
+turn only sends that summary plus the last few messages verbatim. Patient JSON is
+serialized compactly, and every part is held to a budget measured with
+estimate_tokens() instead of growing with the length of the session.
+"""
+import json
+import os
+import re
+
+CHAT_VERBATIM_MESSAGES = int(os.getenv("CHAT_VERBATIM_MESSAGES", "6"))  # last 3 exchanges
+CHAT_SUMMARY_TOKENS = int(os.getenv("CHAT_SUMMARY_TOKENS", "600"))
+CHAT_PATIENT_TOKENS = int(os.getenv("CHAT_PATIENT_TOKENS", "1500"))
+CHAT_PROMPT_TOKENS = int(os.getenv("CHAT_PROMPT_TOKENS", "4000"))
+# Messages folded into the summary per turn; a longer unsummarized backlog is skipped
+CHAT_SUMMARY_MAX_FOLD = 20
+SUMMARY_GIST_CHARS = 200
+
+# Kept when the patient JSON has to be cut down to its budget
+PATIENT_IDENTITY_KEYS = ("patient_id", "name", "age", "gender")
+
+_SPACE_RE = re.compile(r"\s+")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s")
+
+
+def estimate_tokens(text):
+    """Rough token count (~4 characters per token), close enough for budgeting"""
+    return len(text or "") // 4 + 1
+
+
+def _is_empty(value):
+    return value is None or value == "" or value == [] or value == {}
+
+
+def compact_patient_json(patient, max_tokens=CHAT_PATIENT_TOKENS):
+    """
+    Serialize patient data without indentation or empty fields. Over the budget,
+    the largest fields are dropped first (identity fields are always kept) and
+    listed under '_omitted'.
+    """
+    data = {key: value for key, value in (patient or {}).items() if not _is_empty(value)}
+    text = json.dumps(data, separators=(",", ":"), default=str)
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    sizes = sorted(((len(json.dumps(value, default=str)), key) for key, value in data.items()
+                    if key not in PATIENT_IDENTITY_KEYS), reverse=True)
+    omitted = []
+    for _, key in sizes:
+        omitted.append(key)
+        del data[key]
+        text = json.dumps({**data, "_omitted": omitted}, separators=(",", ":"), default=str)
+        if estimate_tokens(text) <= max_tokens:
+            break
+    return text
+
+
+def _gist(text):
+    """First sentence(s) of a message, up to SUMMARY_GIST_CHARS"""
+    text = _SPACE_RE.sub(" ", text or "").strip()
+    if len(text) <= SUMMARY_GIST_CHARS:
+        return text
+    gist = ""
+    for sentence in _SENTENCE_END_RE.split(text):
+        if gist and len(gist) + len(sentence) + 1 > SUMMARY_GIST_CHARS:
+            break
+        gist = f"{gist} {sentence}".strip()
+    return gist[:SUMMARY_GIST_CHARS].rstrip() + "…"
+
+
+def fold_into_summary(summary, messages, max_tokens=CHAT_SUMMARY_TOKENS):
+    """
+    Append one line per message to the running summary; the oldest lines are
+    dropped once it exceeds max_tokens
+    """
+    lines = summary.splitlines() if summary else []
+    for message in messages:
+        speaker = "Assistant" if message.get("role") == "assistant" else "User"
+        lines.append(f"- {speaker}: {_gist(message.get('content'))}")
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+def split_history(messages, verbatim=CHAT_VERBATIM_MESSAGES):
+    """(messages to fold into the summary, messages to send verbatim)"""
+    if len(messages) <= verbatim:
+        return [], messages
+    return messages[:len(messages) - verbatim], messages[len(messages) - verbatim:]
+
+
+def trim_history(messages, max_tokens):
+    """Newest messages whose estimated size fits in max_tokens, oldest first"""
+    kept = []
+    for message in reversed(messages):
+        max_tokens -= estimate_tokens(message.get("content"))
+        if max_tokens < 0:
+            break
+        kept.append(message)
+    kept.reverse()
+    return kept
@@ -0,0 +1,37 @@
+"""
+Consistency check for the incrementally maintained dashboard counters
+Recomputes every /api/dashboard aggregate from the patient tables and reports
+counters that drifted; pass --repair to overwrite them with the recomputed values
+"""
+import argparse
+from flask import Flask
+from database import init_db, check_dashboard_counters
+
+def run_check(repair=False):
+    """Compare the stored dashboard counters with a full recomputation"""
+    app = Flask(__name__)
+    init_db(app)
+
+    with app.app_context():
+        print("=" * 60)
+        print("MedCore AI - Dashboard Counter Check")
+        print("=" * 60)
+
+        drift = check_dashboard_counters(repair=repair)
+        for name, values in drift.items():
+            print(f"{name}: stored {values['stored']}, expected {values['expected']}")
+
+        if not drift:
+            print("\nAll counters match")
+        elif repair:
+            print(f"\nRepaired {len(drift)} counters")
+        else:
+            print(f"\n{len(drift)} counters drifted; run with --repair to fix them")
+        print("=" * 60)
+        return drift
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the dashboard counters against the patient tables")
+    parser.add_argument("--repair", action="store_true", help="overwrite drifted counters")
+    args = parser.parse_args()
+    run_check(args.repair)
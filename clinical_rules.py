@@ -0,0 +1,517 @@
+"""
+Clinical threshold rules for vitals and labs
+One declarative table (RULES) drives the dashboard status, alerts, the search
+status filter, the PDF vital status and the chat / insight heuristics. A cohort is
+loaded into NumPy columns (metrics_frame() from the numeric patient_latest columns,
+cohort_frame() from patient dicts) and every rule is evaluated as a vectorized mask;
+evaluate_patient() / patient_status() apply the same table to a single patient, and
+rule_clause() / status_clause() compile it to SQL over the patient_latest columns.
+
+Benchmark against the per-patient code this replaced (_baseline_status /
+_baseline_alerts) and against evaluating RULES one patient dict at a time:
+    python clinical_rules.py --patients 100000
+"""
+import argparse
+import json
+import operator
+import time
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from sqlalchemy import and_, false, not_, or_
+
+# Numeric readings the rules are written against
+METRICS = ("systolic", "diastolic", "hr", "spo2", "troponin", "cholesterol")
+
+# A rule fires when any of its (metric, op, threshold) conditions holds; missing or
+# unparseable readings never fire. Severity: critical / warning raise alerts and set the
+# patient status (vital categories only); info rules are findings for the insight texts.
+Rule = namedtuple("Rule", "name category severity conditions message recommendation")
+
+RULES = (
+    Rule("bp_critical_high", "Blood Pressure", "critical", (("systolic", ">=", 180), ("diastolic", ">=", 120)),
+         "Critical high BP: {bp} mmHg", "Immediate medical attention required"),
+    Rule("bp_critical_low", "Blood Pressure", "critical", (("systolic", "<", 90), ("diastolic", "<", 60)),
+         "Critical low BP: {bp} mmHg", "Assess for hypotension and hypoperfusion immediately"),
+    Rule("bp_high", "Blood Pressure", "warning", (("systolic", ">=", 140), ("diastolic", ">=", 90)),
+         "Elevated BP: {bp} mmHg", "Monitor closely and consider medication adjustment"),
+    Rule("bp_low", "Blood Pressure", "warning", (("systolic", "<", 100), ("diastolic", "<", 70)),
+         "Low BP: {bp} mmHg", "Recheck and assess for symptoms of hypotension"),
+    Rule("bp_elevated", "Blood Pressure", "info", (("systolic", ">=", 130), ("diastolic", ">=", 80)),
+         "Elevated BP: {bp} mmHg", "Monitor closely and consider dietary modifications"),
+    Rule("hr_critical_high", "Heart Rate", "critical", (("hr", ">=", 120),),
+         "Critical tachycardia: {hr} bpm", "ECG and cardiac evaluation needed"),
+    Rule("hr_critical_low", "Heart Rate", "critical", (("hr", "<", 50),),
+         "Critical bradycardia: {hr} bpm", "ECG and cardiac evaluation needed"),
+    Rule("hr_high", "Heart Rate", "warning", (("hr", ">=", 100),),
+         "Elevated heart rate: {hr} bpm", "Monitor and assess for underlying causes"),
+    Rule("hr_low", "Heart Rate", "warning", (("hr", "<", 60),),
+         "Low heart rate: {hr} bpm", "Monitor for symptoms and consider cardiac evaluation"),
+    Rule("spo2_critical", "Oxygen Saturation", "critical", (("spo2", "<", 90),),
+         "Critical low SpO2: {spo2}%", "Oxygen therapy required immediately"),
+    Rule("spo2_low", "Oxygen Saturation", "warning", (("spo2", "<", 95),),
+         "Low SpO2: {spo2}%", "Respiratory assessment needed"),
+    Rule("troponin_high", "Cardiac Markers", "critical", (("troponin", ">", 0.04),),
+         "Elevated troponin: {troponin} ng/mL", "Rule out acute coronary syndrome"),
+    Rule("cholesterol_high", "Cholesterol", "info", (("cholesterol", ">", 200),),
+         "High cholesterol: {cholesterol} mg/dL", "Consider statin therapy and dietary modifications"),
+    Rule("cholesterol_borderline", "Cholesterol", "info", (("cholesterol", ">", 180),),
+         "Borderline high cholesterol: {cholesterol} mg/dL", "Monitor and consider lifestyle changes"),
+)
+
+RULES_BY_NAME = {rule.name: rule for rule in RULES}
+
+# Categories whose critical / warning rules decide the patient status
+VITAL_CATEGORIES = ("Blood Pressure", "Heart Rate", "Oxygen Saturation")
+STATUSES = ("stable", "warning", "critical")  # index = severity rank
+SEVERITY_RANK = {"info": 0, "warning": 1, "critical": 2}
+
+# Dashboard counters (single thresholds, not statuses)
+STATISTICS = {
+    "high_bp_count": ("systolic", ">=", 140),
+    "high_hr_count": ("hr", ">", 100),
+    "low_spo2_count": ("spo2", "<", 95),
+}
+
+_OPS = {">=": operator.ge, ">": operator.gt, "<=": operator.le, "<": operator.lt}
+
+# Rules that raise alerts per category (in table order), most severe first: a patient
+# gets one alert per category, from the first of its rules that fires
+_ALERT_RULES = {}
+for _rule in RULES:
+    if _rule.severity != "info":
+        _ALERT_RULES.setdefault(_rule.category, []).append(_rule)
+for _rules in _ALERT_RULES.values():
+    _rules.sort(key=lambda rule: -SEVERITY_RANK[rule.severity])
+_STATUS_RULES = [rule for category in VITAL_CATEGORIES for rule in _ALERT_RULES.get(category, ())]
+_STATUS_RANKS = {rule.name: SEVERITY_RANK[rule.severity] for rule in _STATUS_RULES}
+
+# evaluate_patient() checks each reading once against its own conditions, skipping
+# missing readings: metric -> ((rule name, comparison, threshold), ...)
+_CONDITIONS_BY_METRIC = {}
+for _rule in RULES:
+    for _metric, _op, _threshold in _rule.conditions:
+        _CONDITIONS_BY_METRIC.setdefault(_metric, []).append((_rule.name, _OPS[_op], _threshold))
+_CONDITIONS_BY_METRIC = {metric: tuple(conditions) for metric, conditions in _CONDITIONS_BY_METRIC.items()}
+
+# patient_status() checks the status rules' conditions worst status first and stops at
+# the first that holds: ((status, ((metric, comparison, threshold), ...)), ...)
+_STATUS_CHECKS = tuple(
+    (status, tuple((metric, _OPS[op], threshold) for rule in _STATUS_RULES if SEVERITY_RANK[rule.severity] == rank
+                   for metric, op, threshold in rule.conditions))
+    for rank, status in reversed(tuple(enumerate(STATUSES))) if rank
+)
+
+
+# ----- parsing -----
+
+def to_float(value):
+    """Parse a numeric reading that may be stored as text; None if not numeric"""
+    if value is None or value is True or value is False:
+        return None
+    try:
+        return float(value)  # float() accepts surrounding whitespace in strings
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_bp(bp):
+    """Split a "120/80" reading into (systolic, diastolic) floats"""
+    if not bp or '/' not in str(bp):
+        return None, None
+    systolic, _, diastolic = str(bp).partition('/')
+    return to_float(systolic), to_float(diastolic)
+
+
+def patient_metrics(patient):
+    """{metric: float or None} from a patient dict (Patient.to_dict() format)"""
+    vitals = patient.get("vitals") or {}
+    labs = patient.get("lab_results") or {}
+    systolic, diastolic = parse_bp(vitals.get("bp"))
+    return {
+        "systolic": systolic,
+        "diastolic": diastolic,
+        "hr": to_float(vitals.get("hr")),
+        "spo2": to_float(vitals.get("spo2")),
+        "troponin": to_float(labs.get("troponin")),
+        "cholesterol": to_float(labs.get("cholesterol")),
+    }
+
+
+def _float_or_nan(value):
+    if value is None or value == '':
+        return np.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _numeric_column(values, count):
+    # fromiter over plain float() is several times faster than pd.to_numeric on object data
+    return np.fromiter(map(_float_or_nan, values), dtype=float, count=count)
+
+
+def cohort_frame(patients):
+    """Parse a list of patient dicts into a DataFrame of METRICS (NaN when missing)"""
+    count = len(patients)
+    vitals = [p.get("vitals") or {} for p in patients]
+    labs = [p.get("lab_results") or {} for p in patients]
+    bp_parts = [str(v.get("bp") or "").partition("/") for v in vitals]
+    return pd.DataFrame({
+        "systolic": _numeric_column((part[0] if part[1] else None for part in bp_parts), count),
+        "diastolic": _numeric_column((part[2] if part[1] else None for part in bp_parts), count),
+        "hr": _numeric_column((v.get("hr") for v in vitals), count),
+        "spo2": _numeric_column((v.get("spo2") for v in vitals), count),
+        "troponin": _numeric_column((lab.get("troponin") for lab in labs), count),
+        "cholesterol": _numeric_column((lab.get("cholesterol") for lab in labs), count),
+    })
+
+
+def metrics_frame(rows):
+    """DataFrame of METRICS from rows of numeric readings in METRICS order (None when missing)"""
+    values = np.array(rows, dtype=float).reshape(len(rows), len(METRICS))
+    return pd.DataFrame(values, columns=list(METRICS))
+
+
+# ----- evaluation -----
+
+def _condition_mask(frame, condition):
+    metric, op, threshold = condition
+    # Comparisons with NaN are False, so missing readings never fire
+    return _OPS[op](frame[metric].to_numpy(), threshold)
+
+
+def evaluate_cohort(frame):
+    """{rule name: boolean mask over the frame's rows}"""
+    masks = {}
+    for rule in RULES:
+        mask = np.zeros(len(frame), dtype=bool)
+        for condition in rule.conditions:
+            mask |= _condition_mask(frame, condition)
+        masks[rule.name] = mask
+    return masks
+
+
+def cohort_statuses(masks, size):
+    """Array of 'stable' / 'warning' / 'critical', the worst status rule fired per patient"""
+    rank = np.zeros(size, dtype=np.int8)
+    for rule in _STATUS_RULES:
+        np.maximum(rank, np.where(masks[rule.name], SEVERITY_RANK[rule.severity], 0), out=rank)
+    return np.asarray(STATUSES, dtype=object)[rank]
+
+
+def cohort_statistics(frame):
+    """{counter name: number of patients} for the STATISTICS thresholds"""
+    return {name: int(_condition_mask(frame, condition).sum()) for name, condition in STATISTICS.items()}
+
+
+def patient_statistics(metrics):
+    """{counter name: True if the patient counts towards it}, cohort_statistics() for one patient"""
+    return {name: metrics.get(metric) is not None and _OPS[op](metrics[metric], threshold)
+            for name, (metric, op, threshold) in STATISTICS.items()}
+
+
+def rule_clause(rule, columns):
+    """SQL expression for a rule over {metric: column}; NULL readings never fire"""
+    return or_(*(and_(columns[metric].is_not(None), _OPS[op](columns[metric], threshold))
+                 for metric, op, threshold in rule.conditions))
+
+
+def status_clause(status, columns):
+    """SQL expression matching rows whose status_of() is status"""
+    if status not in STATUSES:
+        return false()
+    # Non-NULL by construction, so NOT() below is a plain negation
+    by_severity = {severity: or_(false(), *(rule_clause(rule, columns) for rule in _STATUS_RULES
+                                            if rule.severity == severity))
+                   for severity in ("critical", "warning")}
+    if status == "critical":
+        return by_severity["critical"]
+    if status == "warning":
+        return and_(by_severity["warning"], not_(by_severity["critical"]))
+    return and_(not_(by_severity["warning"]), not_(by_severity["critical"]))
+
+
+def _display_values(patient):
+    vitals = patient.get("vitals") or {}
+    labs = patient.get("lab_results") or {}
+    return {"bp": vitals.get("bp"), "hr": vitals.get("hr"), "spo2": vitals.get("spo2"),
+            "troponin": labs.get("troponin"), "cholesterol": labs.get("cholesterol")}
+
+
+def _alert(rule, values):
+    return {
+        "type": rule.severity,
+        "category": rule.category,
+        "message": rule.message.format(**values),
+        "recommendation": rule.recommendation,
+    }
+
+
+def _alerts_for(fired, patient):
+    """One alert per category, from the most severe fired rule"""
+    alerts = []
+    values = None
+    for rules in _ALERT_RULES.values():
+        for rule in rules:
+            if rule.name in fired:
+                values = values or _display_values(patient)
+                alerts.append(_alert(rule, values))
+                break
+    return alerts
+
+
+def cohort_alerting(masks):
+    """Boolean mask of the rows cohort_alerts() returns alerts for"""
+    return np.logical_or.reduce([masks[rule.name] for rules in _ALERT_RULES.values() for rule in rules])
+
+
+def cohort_alerts(patients, masks):
+    """
+    {row index: [alert, ...]} for the patients with at least one alert. patients is
+    indexed by row: a list, or a dict of only the rows in cohort_alerting(masks)
+    """
+    result = {}
+    values = {}
+    size = len(next(iter(masks.values())))
+    for rules in _ALERT_RULES.values():
+        # Index into rules of the most severe fired rule per patient (-1: none)
+        winner = np.full(size, -1, dtype=np.int8)
+        for position in range(len(rules) - 1, -1, -1):
+            winner[masks[rules[position].name]] = position
+        for i in np.flatnonzero(winner >= 0).tolist():
+            patient_values = values.get(i)
+            if patient_values is None:
+                patient_values = values[i] = _display_values(patients[i])
+                result[i] = []
+            result[i].append(_alert(rules[winner[i]], patient_values))
+    return result
+
+
+def evaluate_patient(patient=None, metrics=None):
+    """Names of the rules that fire for one patient dict (or precomputed metrics)"""
+    metrics = metrics if metrics is not None else patient_metrics(patient)
+    fired = set()
+    for metric, conditions in _CONDITIONS_BY_METRIC.items():
+        value = metrics.get(metric)
+        if value is None:
+            continue
+        for name, compare, threshold in conditions:
+            if compare(value, threshold):
+                fired.add(name)
+    return fired
+
+
+def status_of(fired, categories=VITAL_CATEGORIES):
+    """Worst status among fired critical / warning rules in categories"""
+    if categories is VITAL_CATEGORIES:
+        return STATUSES[max((_STATUS_RANKS.get(name, 0) for name in fired), default=0)]
+    rank = max((SEVERITY_RANK[rule.severity] for rule in _STATUS_RULES
+                if rule.name in fired and rule.category in categories), default=0)
+    return STATUSES[rank]
+
+
+def patient_status(metrics):
+    """status_of(evaluate_patient(metrics=metrics)) without evaluating the other rules"""
+    for status, conditions in _STATUS_CHECKS:
+        for metric, compare, threshold in conditions:
+            value = metrics.get(metric)
+            if value is not None and compare(value, threshold):
+                return status
+    return STATUSES[0]
+
+
+def patient_alerts(patient, fired=None):
+    """Alerts for one patient dict, in the same format as cohort_alerts()"""
+    return _alerts_for(fired if fired is not None else evaluate_patient(patient), patient)
+
+
+# ----- benchmark -----
+
+def synthetic_patients(count, seed=0):
+    """Patient dicts with realistic readings, some missing or malformed"""
+    rng = np.random.default_rng(seed)
+    systolic = rng.normal(125, 16, count).round().astype(int)
+    diastolic = rng.normal(80, 8, count).round().astype(int)
+    hr = rng.normal(76, 12, count).round().astype(int)
+    spo2 = np.clip(rng.normal(97, 1.8, count).round(), 70, 100).astype(int)
+    troponin = np.abs(rng.normal(0.02, 0.03, count)).round(3)
+    cholesterol = rng.normal(195, 35, count).round().astype(int)
+    gaps = rng.random((count, 4))
+    patients = []
+    for i in range(count):
+        bp = f"{systolic[i]}/{diastolic[i]}"
+        if gaps[i, 0] < 0.03:
+            bp = "n/a"
+        patients.append({
+            "patient_id": f"P{i:06d}",
+            "vitals": {
+                "bp": None if gaps[i, 0] > 0.97 else bp,
+                "hr": None if gaps[i, 1] < 0.05 else str(hr[i]),
+                "spo2": None if gaps[i, 2] < 0.05 else int(spo2[i]),
+            },
+            "lab_results": {} if gaps[i, 3] < 0.3 else {"troponin": float(troponin[i]),
+                                                         "cholesterol": int(cholesterol[i])},
+        })
+    return patients
+
+
+# Baseline for the benchmark: advanced_features.classify_patient_status and the body of
+# get_patient_alerts' per-patient loop as they were before RULES, kept verbatim (their
+# results differ from RULES where the thresholds were unified, so they are only timed)
+def _baseline_status(vitals):
+    bp = vitals.get('bp', '')
+    hr = vitals.get('hr', 0)
+    spo2 = vitals.get('spo2', 100)
+    try:
+        if bp and '/' in str(bp):
+            systolic = int(str(bp).split('/')[0])
+            diastolic = int(str(bp).split('/')[1])
+            if systolic >= 180 or systolic < 90 or diastolic >= 120 or diastolic < 60:
+                return 'critical'
+            if systolic >= 140 or systolic < 100 or diastolic >= 90 or diastolic < 70:
+                return 'warning'
+        hr_val = int(hr) if hr else 0
+        if hr_val >= 120 or hr_val < 50:
+            return 'critical'
+        if hr_val >= 100 or hr_val < 60:
+            return 'warning'
+        spo2_val = int(spo2) if spo2 else 100
+        if spo2_val < 90:
+            return 'critical'
+        if spo2_val < 95:
+            return 'warning'
+    except Exception:
+        return 'stable'
+    return 'stable'
+
+
+def _baseline_alerts(patient):
+    vitals = patient.get('vitals', {})
+    labs = patient.get('lab_results', {})
+    alerts = []
+    bp = vitals.get('bp', '')
+    hr = vitals.get('hr', 0)
+    spo2 = vitals.get('spo2', 100)
+    try:
+        if bp and '/' in str(bp):
+            systolic = int(str(bp).split('/')[0])
+            if systolic >= 180:
+                alerts.append({"type": "critical", "category": "Blood Pressure",
+                               "message": f"Critical high BP: {bp} mmHg",
+                               "recommendation": "Immediate medical attention required"})
+            elif systolic >= 140:
+                alerts.append({"type": "warning", "category": "Blood Pressure",
+                               "message": f"Elevated BP: {bp} mmHg",
+                               "recommendation": "Monitor closely and consider medication adjustment"})
+    except Exception:
+        pass
+    try:
+        hr_val = int(hr) if hr else 0
+        if hr_val >= 120:
+            alerts.append({"type": "critical", "category": "Heart Rate",
+                           "message": f"Critical tachycardia: {hr} bpm",
+                           "recommendation": "ECG and cardiac evaluation needed"})
+        elif hr_val >= 100:
+            alerts.append({"type": "warning", "category": "Heart Rate",
+                           "message": f"Elevated heart rate: {hr} bpm",
+                           "recommendation": "Monitor and assess for underlying causes"})
+    except Exception:
+        pass
+    try:
+        spo2_val = int(spo2) if spo2 else 100
+        if spo2_val < 90:
+            alerts.append({"type": "critical", "category": "Oxygen Saturation",
+                           "message": f"Critical low SpO2: {spo2}%",
+                           "recommendation": "Oxygen therapy required immediately"})
+        elif spo2_val < 95:
+            alerts.append({"type": "warning", "category": "Oxygen Saturation",
+                           "message": f"Low SpO2: {spo2}%",
+                           "recommendation": "Respiratory assessment needed"})
+    except Exception:
+        pass
+    try:
+        troponin = labs.get('troponin')
+        if troponin and float(troponin) > 0.04:
+            alerts.append({"type": "critical", "category": "Cardiac Markers",
+                           "message": f"Elevated troponin: {troponin} ng/mL",
+                           "recommendation": "Rule out acute coronary syndrome"})
+    except Exception:
+        pass
+    return alerts
+
+
+def benchmark(count=100000):
+    """
+    The original per-patient code (_baseline_*) against the rule engine, for a
+    synthetic cohort: per-patient statuses (from dicts as chat / PDF do, and from
+    snapshot columns as save_patient_data does), then cohort statuses and alerts
+    (from dicts, and from the numeric patient_latest columns as the dashboard
+    counters and /api/alerts do)
+    """
+    patients = synthetic_patients(count)
+    # Stand-ins for what the database returns: numeric snapshot columns and the JSON
+    # the alert messages are formatted from (built outside the timings, like the SELECT)
+    metric_rows = [tuple(patient_metrics(patient).values()) for patient in patients]
+    snapshot_metrics = [dict(zip(METRICS, row)) for row in metric_rows]
+    snapshot_json = [(json.dumps(patient["vitals"]), json.dumps(patient["lab_results"])) for patient in patients]
+
+    def timed(fn):
+        started = time.perf_counter()
+        result = fn()
+        return result, (time.perf_counter() - started) * 1000
+
+    baseline_statuses, baseline_status_ms = timed(
+        lambda: [_baseline_status(patient.get('vitals', {})) for patient in patients])
+    _, baseline_alerts_ms = timed(lambda: [_baseline_alerts(patient) for patient in patients])
+    baseline_ms = baseline_status_ms + baseline_alerts_ms
+
+    dict_statuses, dict_status_ms = timed(lambda: [patient_status(patient_metrics(patient)) for patient in patients])
+    snapshot_statuses, snapshot_status_ms = timed(lambda: [patient_status(metrics) for metrics in snapshot_metrics])
+
+    def loop():
+        fired = [evaluate_patient(patient) for patient in patients]
+        alerts = {}
+        for i, patient in enumerate(patients):
+            patient_alerts_ = patient_alerts(patient, fired[i])
+            if patient_alerts_:
+                alerts[i] = patient_alerts_
+        return [status_of(names) for names in fired], alerts
+    (loop_statuses, loop_alerts), loop_ms = timed(loop)
+
+    def from_dicts():
+        masks = evaluate_cohort(cohort_frame(patients))
+        return cohort_statuses(masks, count), cohort_alerts(patients, masks)
+    (frame_statuses, frame_alerts), frame_ms = timed(from_dicts)
+
+    def from_columns():
+        masks = evaluate_cohort(metrics_frame(metric_rows))
+        statuses = cohort_statuses(masks, count)
+        alerting = {i: {"vitals": json.loads(snapshot_json[i][0]), "lab_results": json.loads(snapshot_json[i][1])}
+                    for i in np.flatnonzero(cohort_alerting(masks)).tolist()}
+        return statuses, cohort_alerts(alerting, masks)
+    (column_statuses, column_alerts), column_ms = timed(from_columns)
+    _, column_status_ms = timed(lambda: cohort_statuses(evaluate_cohort(metrics_frame(metric_rows)), count))
+
+    assert dict_statuses == snapshot_statuses == loop_statuses == list(frame_statuses) == list(column_statuses), \
+        "statuses differ"
+    assert loop_alerts == frame_alerts == column_alerts, "alerts differ"
+    counts = dict(zip(*np.unique(column_statuses, return_counts=True)))
+    changed = sum(old != new for old, new in zip(baseline_statuses, loop_statuses))
+    print(f"patients={count} statuses={ {k: int(v) for k, v in counts.items()} } with_alerts={len(column_alerts)} "
+          f"status_changed_vs_baseline={changed}")
+    print(f"per-patient status: baseline {baseline_status_ms:.0f} ms, patient_status from dicts {dict_status_ms:.0f} ms "
+          f"({baseline_status_ms / dict_status_ms:.1f}x), from snapshot columns {snapshot_status_ms:.0f} ms "
+          f"({baseline_status_ms / snapshot_status_ms:.1f}x)")
+    print(f"cohort statuses:    baseline {baseline_status_ms:.0f} ms, vectorized from snapshot columns "
+          f"{column_status_ms:.0f} ms ({baseline_status_ms / column_status_ms:.1f}x)")
+    print(f"statuses + alerts:  baseline {baseline_ms:.0f} ms, rules loop {loop_ms:.0f} ms "
+          f"({baseline_ms / loop_ms:.1f}x), vectorized from dicts {frame_ms:.0f} ms ({baseline_ms / frame_ms:.1f}x), "
+          f"from snapshot columns {column_ms:.0f} ms ({baseline_ms / column_ms:.1f}x)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the vectorized clinical rule engine")
+    parser.add_argument("--patients", type=int, default=100000)
+    args = parser.parse_args()
+    benchmark(args.patients)
@@ -0,0 +1,36 @@
+"""
+Deduplicate rag_documents and add the unique (doc_type, patient, source_key) indexes
+Run once on databases that accumulated one patient document per submission
+"""
+from flask import Flask
+from models import db, RAGDocument
+from database import init_db, compact_rag_documents
+
+def compact():
+    """Keep only the current RAG document per patient"""
+    app = Flask(__name__)
+    init_db(app)
+    
+    with app.app_context():
+        print("=" * 60)
+        print("MedCore AI - RAG Document Compaction")
+        print("=" * 60)
+        
+        before = RAGDocument.query.count()
+        stats = compact_rag_documents()
+        after = RAGDocument.query.count()
+        
+        if db.engine.dialect.name == 'sqlite':
+            # Return the freed pages to the filesystem
+            with db.engine.connect() as conn:
+                conn.exec_driver_sql('VACUUM')
+        
+        print(f"\nDocuments before: {before}")
+        print(f"Legacy documents keyed: {stats['keyed']}")
+        print(f"Duplicates removed: {stats['deleted']}")
+        print(f"Documents after: {after}")
+        print("=" * 60)
+        return stats
+
+if __name__ == "__main__":
+    compact()
@@ -1,9 +1,23 @@
 """
 Database configuration and helper functions for MedCore AI Platform
 """
+import itertools
 import os
-from models import db, Patient, Vitals, LabResult, PatientHistory, ChatSession, ChatMessage, RAGDocument
-from datetime import datetime
+import re
+import threading
+import time
+from collections import OrderedDict
+from models import (db, Patient, Vitals, LabResult, PatientLatest, PatientHistory, ChatSession, ChatMessage,
+                    RAGDocument, RAGIndexJob, IdSequence, CollectionVersion, DashboardCounter, Appointment, Prescription, VideoCallRequest,
+                    PharmacyMessage, BusEvent)
+from sqlalchemy.exc import IntegrityError
+from embeddings import get_embedder, pack_embedding
+from chat_context import estimate_tokens
+from clinical_rules import (METRICS, cohort_statistics, cohort_statuses, evaluate_cohort, metrics_frame,
+                            patient_metrics, patient_statistics, patient_status, to_float as _to_float,
+                            parse_bp as _parse_bp)
+from rag_vectors import get_rag_vector_index
+from datetime import datetime, timedelta
 import json
 
 def init_db(app):
@@ -20,30 +34,285 @@ def init_db(app):
     
     with app.app_context():
         db.create_all()
+        _ensure_rag_document_schema()
+        _ensure_chat_schema()
+        _ensure_rag_fulltext()
+        _ensure_patient_search()
+        _ensure_bus_event_schema()
+        _backfill_patient_latest()
+        _seed_collection_versions()
+        _seed_dashboard_counters()
         print(f"Database initialized at: {database_path}")
 
+# ------------------- Collection Versions -------------------
+# Collections whose list endpoints answer conditional GETs (see http_cache.py)
+COLLECTIONS = ('patients', 'prescriptions', 'pharmacy_messages', 'video_calls', 'appointments')
+
+def _seed_collection_versions():
+    """
+    Create missing version rows. Counters start from the current time so a
+    recreated table never repeats a version a client may still hold in an ETag.
+    """
+    seed = int(time.time())
+    existing = {name for (name,) in db.session.query(CollectionVersion.name).all()}
+    for name in COLLECTIONS:
+        if name not in existing:
+            db.session.add(CollectionVersion(name=name, version=seed))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()  # Another process seeded them first
+
+def bump_collection_version(*names):
+    """Mark collections as changed; runs in the caller's transaction, so commit afterwards"""
+    table = CollectionVersion.__table__
+    for name in names:
+        updated = db.session.execute(
+            table.update().where(table.c.name == name).values(version=table.c.version + 1)
+        ).rowcount
+        if not updated:
+            db.session.add(CollectionVersion(name=name, version=int(time.time())))
+
+def get_collection_versions(*names):
+    """Return {name: version} in a single primary-key lookup"""
+    rows = db.session.execute(
+        db.select(CollectionVersion.name, CollectionVersion.version).where(CollectionVersion.name.in_(names))
+    ).all()
+    return {name: version for name, version in rows}
+
+# ------------------- Dashboard Counters -------------------
+# /api/dashboard totals kept up to date on write: each patient write moves that
+# patient's old contribution out of the counters and the new one in, so reading
+# the dashboard does not touch the patients table. check_dashboard_counters()
+# recomputes them from scratch to detect drift.
+DASHBOARD_COUNTERS = ('total_patients', 'age_sum', 'age_count', 'male_count', 'female_count',
+                      'high_bp_count', 'low_spo2_count', 'high_hr_count',
+                      'critical_count', 'warning_count', 'stable_count')
+
+def _age_value(age):
+    value = _to_float(age)
+    return int(value) if value else None
+
+def _gender_counter(gender):
+    gender = (gender or '').lower()
+    if 'male' in gender and 'female' not in gender:
+        return 'male_count'
+    if 'female' in gender:
+        return 'female_count'
+    return None
+
+def _dashboard_contribution(patient):
+    """
+    {counter: amount} one patient adds, from its row and patient_latest snapshot.
+    Without a snapshot the newest vitals/lab rows are used, as Patient.to_dict()
+    (and so compute_dashboard_counters(), over the backfilled snapshots) does.
+    """
+    snapshot = patient.latest
+    if snapshot is not None:
+        metrics = {metric: getattr(snapshot, metric) for metric in METRICS}
+    elif patient.id is not None:
+        metrics = patient_metrics(patient.to_dict())
+    else:
+        metrics = dict.fromkeys(METRICS)
+    contribution = {'total_patients': 1, f'{patient_status(metrics)}_count': 1}
+    age = _age_value(patient.age)
+    if age:
+        contribution['age_sum'] = age
+        contribution['age_count'] = 1
+    gender = _gender_counter(patient.gender)
+    if gender:
+        contribution[gender] = 1
+    for name, counts in patient_statistics(metrics).items():
+        if counts:
+            contribution[name] = 1
+    return contribution
+
+def _begin_write_transaction():
+    """
+    On SQLite, take the database write lock (BEGIN IMMEDIATE) before reading rows
+    a write depends on; other databases lock the rows with SELECT ... FOR UPDATE
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return
+    connection = db.session.connection().connection.driver_connection
+    if not connection.in_transaction:
+        connection.execute("BEGIN IMMEDIATE")
+
+def _apply_dashboard_delta(before, after):
+    """Move a patient's contribution from before to after; runs in the caller's transaction"""
+    table = DashboardCounter.__table__
+    for name in DASHBOARD_COUNTERS:
+        delta = (after or {}).get(name, 0) - (before or {}).get(name, 0)
+        if delta:
+            db.session.execute(table.update().where(table.c.name == name).values(value=table.c.value + delta))
+
+def get_latest_metrics(*columns):
+    """
+    (rows, frame) for every patient in registration order: tuples of the given
+    columns, and a DataFrame of METRICS read from the numeric patient_latest columns
+    in the same SELECT, so cohort views never parse Patient.to_dict() readings.
+    Patients without a snapshot use their newest vitals/lab rows, as to_dict() does.
+    """
+    metric_columns = [getattr(PatientLatest, metric) for metric in METRICS]
+    statement = (db.select(*columns, Patient.id, PatientLatest.patient_db_id, *metric_columns)
+                 .select_from(Patient)
+                 .outerjoin(PatientLatest, PatientLatest.patient_db_id == Patient.id)
+                 .order_by(Patient.id))
+    result = db.session.execute(statement).all()
+    width = len(columns)
+    metric_rows = [row[width + 2:] for row in result]
+    missing = {row[width]: i for i, row in enumerate(result) if row[width + 1] is None}
+    if missing:
+        latest_vitals = _latest_rows_by_patient(Vitals, list(missing))
+        latest_labs = _latest_rows_by_patient(LabResult, list(missing))
+        for patient_db_id, i in missing.items():
+            vitals, labs = latest_vitals.get(patient_db_id), latest_labs.get(patient_db_id)
+            metrics = patient_metrics({'vitals': vitals.to_dict() if vitals else {},
+                                       'lab_results': labs.to_dict() if labs else {}})
+            metric_rows[i] = tuple(metrics[metric] for metric in METRICS)
+    return [tuple(row[:width]) for row in result], metrics_frame(metric_rows)
+
+def compute_dashboard_counters():
+    """Dashboard counters recomputed from scratch from the patient rows and snapshots"""
+    rows, frame = get_latest_metrics(Patient.age, Patient.gender)
+    counters = dict.fromkeys(DASHBOARD_COUNTERS, 0)
+    counters['total_patients'] = len(rows)
+    counters.update(cohort_statistics(frame))
+    for status in cohort_statuses(evaluate_cohort(frame), len(rows)):
+        counters[f'{status}_count'] += 1
+    for age, gender in rows:
+        age = _age_value(age)
+        if age:
+            counters['age_sum'] += age
+            counters['age_count'] += 1
+        gender = _gender_counter(gender)
+        if gender:
+            counters[gender] += 1
+    return counters
+
+def get_dashboard_counters():
+    """{counter: value} in a single query"""
+    rows = db.session.execute(db.select(DashboardCounter.name, DashboardCounter.value)).all()
+    return {name: value for name, value in rows}
+
+def _write_dashboard_counters(counters):
+    DashboardCounter.query.delete()
+    db.session.add_all(DashboardCounter(name=name, value=value) for name, value in counters.items())
+    db.session.commit()
+
+def _seed_dashboard_counters():
+    """
+    Compute the counters once for databases that do not have them yet; init_db
+    runs this after _backfill_patient_latest(), so every patient has a snapshot
+    """
+    if DashboardCounter.query.first() is not None:
+        return
+    try:
+        _write_dashboard_counters(compute_dashboard_counters())
+    except IntegrityError:
+        db.session.rollback()  # Another process seeded them first
+
+def check_dashboard_counters(repair=False):
+    """
+    Recompute the dashboard counters from the patient tables and return the drift
+    as {counter: {'stored': value, 'expected': value}}; with repair, overwrite them
+    """
+    expected = compute_dashboard_counters()
+    stored = get_dashboard_counters()
+    drift = {name: {'stored': stored.get(name), 'expected': value}
+             for name, value in expected.items() if stored.get(name) != value}
+    if drift and repair:
+        _write_dashboard_counters(expected)
+    return drift
+
+# Callbacks run with the patient_id after save_patient_data/save_patient_history commit
+_patient_write_listeners = []
+
+def register_patient_write_listener(callback):
+    """Register callback(patient_id) to run after a patient's data is written"""
+    _patient_write_listeners.append(callback)
+    return callback
+
+def _notify_patient_write(patient_id):
+    for callback in _patient_write_listeners:
+        try:
+            callback(patient_id)
+        except Exception as e:
+            print(f"Patient write listener failed for {patient_id}: {e}")
+
 def get_or_create_patient(patient_id, **kwargs):
     """Get existing patient or create new one"""
     patient = Patient.query.filter_by(patient_id=patient_id).first()
     
     if not patient:
         patient = Patient(patient_id=patient_id, **kwargs)
+        patient.latest = PatientLatest()  # Empty until vitals or labs are saved
         db.session.add(patient)
+        _apply_dashboard_delta(None, _dashboard_contribution(patient))
+        bump_collection_version('patients')
         db.session.commit()
     
     return patient
 
-def save_patient_data(patient_data):
+def _apply_latest_snapshot(patient, vitals=None, lab_result=None):
+    """
+    Write the given Vitals/LabResult rows into the patient's patient_latest
+    snapshot. Does not commit; callers include it in their own transaction.
+    """
+    _as_stored(vitals, lab_result)
+    snapshot = patient.latest
+    if snapshot is None:
+        snapshot = PatientLatest(patient_db_id=patient.id)
+        patient.latest = snapshot
+        # Seed the half that is not being written from existing rows
+        if vitals is None:
+            vitals = patient.vitals.order_by(Vitals.timestamp.desc()).first()
+        if lab_result is None:
+            lab_result = patient.lab_results.order_by(LabResult.timestamp.desc()).first()
+    
+    if vitals is not None:
+        snapshot.vitals_json = json.dumps(vitals.to_dict())
+        snapshot.systolic, snapshot.diastolic = _parse_bp(vitals.bp)
+        snapshot.hr = _to_float(vitals.hr)
+        snapshot.spo2 = _to_float(vitals.spo2)
+        snapshot.vitals_timestamp = vitals.timestamp
+    
+    if lab_result is not None:
+        snapshot.labs_json = json.dumps(lab_result.to_dict())
+        snapshot.troponin = _to_float(lab_result.troponin)
+        snapshot.cholesterol = _to_float(lab_result.cholesterol)
+        snapshot.labs_timestamp = lab_result.timestamp
+    
+    snapshot.updated_at = datetime.utcnow()
+    return snapshot
+
+def _as_stored(*rows):
+    """
+    Flush and reload rows written in this transaction, so their to_dict() has the
+    values a later read returns (column types applied: "130" in an Integer column
+    reads back as 130) rather than the raw request values
+    """
+    unsaved = [row for row in rows if row is not None and (db.inspect(row).pending or db.inspect(row).modified)]
+    if unsaved:
+        db.session.flush()
+        for row in unsaved:
+            db.session.refresh(row)
+
+def save_patient_data(patient_data, index_for_rag=False):
     """
     Save patient data from JSON format to SQL database
     Expected format: {patient_id, name, age, gender, symptoms, vitals{}, lab_results{}}
+    With index_for_rag, a RAG reindex job is queued in the same transaction.
     """
     patient_id = patient_data.get('patient_id')
     if not patient_id:
         raise ValueError("patient_id is required")
     
-    # Get or create patient
-    patient = Patient.query.filter_by(patient_id=patient_id).first()
+    # Get or create patient; locked, so concurrent writes to it move its
+    # dashboard contribution one after another
+    _begin_write_transaction()
+    patient = Patient.query.filter_by(patient_id=patient_id).with_for_update(of=Patient).first()
+    before = _dashboard_contribution(patient) if patient else None
     
     if patient:
         # Update existing patient
@@ -66,6 +335,7 @@ def save_patient_data(patient_data):
         db.session.flush()  # Get patient.id without committing
     
     # Save vitals if present
+    vitals = None
     vitals_data = patient_data.get('vitals')
     if vitals_data:
         vitals = Vitals(
@@ -80,6 +350,7 @@ def save_patient_data(patient_data):
         db.session.add(vitals)
     
     # Save lab results if present
+    lab_result = None
     labs_data = patient_data.get('lab_results')
     if labs_data:
         lab_result = LabResult(
@@ -97,7 +368,19 @@ def save_patient_data(patient_data):
         )
         db.session.add(lab_result)
     
+    # Keep the latest snapshot in the same transaction
+    if vitals is not None or lab_result is not None or patient.latest is None:
+        _apply_latest_snapshot(patient, vitals, lab_result)
+    _apply_dashboard_delta(before, _dashboard_contribution(patient))
+    
+    if index_for_rag:
+        enqueue_rag_index(patient.patient_id)
+    
+    bump_collection_version('patients')
     db.session.commit()
+    _notify_patient_write(patient.patient_id)
+    if index_for_rag:
+        _notify_rag_index_enqueued()
     return patient
 
 def get_patient_by_id(patient_id):
@@ -107,8 +390,193 @@ def get_patient_by_id(patient_id):
 
 def get_all_patients():
     """Get all patients"""
-    patients = Patient.query.all()
-    return [patient.to_dict() for patient in patients]
+    return get_patients_with_latest()
+
+def _latest_rows_by_patient(model, patient_ids):
+    """
+    Return {patient_db_id: newest row} of model (Vitals or LabResult) for the
+    given patient id subquery, using a single windowed query
+    """
+    ranked = db.session.query(
+        model.id.label('id'),
+        db.func.row_number().over(
+            partition_by=model.patient_db_id,
+            order_by=(model.timestamp.desc(), model.id.desc())
+        ).label('rn')
+    ).filter(model.patient_db_id.in_(patient_ids)).subquery()
+    
+    rows = model.query.join(ranked, model.id == ranked.c.id).filter(ranked.c.rn == 1).all()
+    return {row.patient_db_id: row for row in rows}
+
+def get_patients_with_latest(patient_query=None):
+    """
+    Load patients together with their latest vitals and lab results
+    Runs three queries in total regardless of how many patients match,
+    instead of two extra queries per patient in Patient.to_dict()
+    """
+    if patient_query is None:
+        patient_query = Patient.query
+    
+    patients = patient_query.all()
+    if not patients:
+        return []
+    
+    # Patients carry their patient_latest snapshot (joined load); only
+    # databases that have not been backfilled need the windowed fallback
+    if all(patient.latest is not None for patient in patients):
+        return [patient.to_dict() for patient in patients]
+    
+    # Keeps the query's ordering so a LIMITed page selects the same patients
+    patient_ids = patient_query.with_entities(Patient.id).subquery()
+    patient_ids = db.select(patient_ids.c.id)
+    latest_vitals = _latest_rows_by_patient(Vitals, patient_ids)
+    latest_labs = _latest_rows_by_patient(LabResult, patient_ids)
+    
+    return [
+        patient.to_dict(latest_vitals.get(patient.id), latest_labs.get(patient.id), preloaded=True)
+        for patient in patients
+    ]
+
+# Patient.to_dict() keys that iter_patients() can project
+PATIENT_FIELDS = ('patient_id', 'name', 'age', 'gender', 'symptoms', 'vitals', 'lab_results', 'timestamp', 'updated_at')
+PATIENT_STREAM_BATCH = 1000
+
+def iter_patients(fields=None, after=None, limit=None, batch_size=PATIENT_STREAM_BATCH):
+    """
+    Iterator of patient dicts in Patient.to_dict() format, in registration order.
+    Only the columns behind `fields` are selected (patient_id is always included,
+    it is the cursor), and rows are fetched batch_size at a time by short keyset
+    queries (id > last id), so memory stays flat however many patients there are and
+    no read stays open (holding SQLite's shared lock) while a slow client downloads.
+    `after` is the last patient_id of the previous page. Fields and the cursor are
+    validated (ValueError) and the first batch is read before the iterator is returned.
+    """
+    fields = list(fields or PATIENT_FIELDS)
+    unknown = set(fields) - set(PATIENT_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown patient fields: {', '.join(sorted(unknown))}")
+    if 'patient_id' not in fields:
+        fields.insert(0, 'patient_id')
+    
+    columns = [Patient.id] + [getattr(Patient, field) for field in fields if field not in ('vitals', 'lab_results')]
+    snapshot_fields = [field for field in ('vitals', 'lab_results') if field in fields]
+    if snapshot_fields:
+        columns.append(PatientLatest.patient_db_id.label('snapshot_id'))
+        if 'vitals' in fields:
+            columns.append(PatientLatest.vitals_json)
+        if 'lab_results' in fields:
+            columns.append(PatientLatest.labs_json)
+    
+    statement = db.select(*columns)
+    if snapshot_fields:
+        statement = statement.outerjoin(PatientLatest, PatientLatest.patient_db_id == Patient.id)
+    statement = statement.order_by(Patient.id)
+    after_id = 0
+    if after:
+        after_id = db.session.execute(db.select(Patient.id).where(Patient.patient_id == after)).scalar()
+        if after_id is None:
+            raise ValueError(f"Unknown cursor: no patient {after}")
+    
+    batches = _patient_batches(statement, after_id, limit, batch_size)
+    first = next(batches, [])
+    return (record for rows in itertools.chain([first], batches)
+            for record in _patient_rows_to_dicts(rows, fields, snapshot_fields))
+
+def _patient_batches(statement, after_id, limit, batch_size):
+    """Lists of iter_patients() rows, each read to completion by its own keyset query"""
+    remaining = limit or None
+    while remaining is None or remaining > 0:
+        size = batch_size if remaining is None else min(batch_size, remaining)
+        rows = db.session.execute(statement.where(Patient.id > after_id).limit(size)).all()
+        if rows:
+            yield rows
+        if len(rows) < size:
+            return
+        after_id = rows[-1].id
+        if remaining is not None:
+            remaining -= len(rows)
+
+def _patient_rows_to_dicts(rows, fields, snapshot_fields):
+    """One batch of iter_patients() rows as dicts"""
+    latest_vitals, latest_labs = {}, {}
+    # Patients without a patient_latest snapshot (not backfilled) read their newest rows
+    missing = [row.id for row in rows if snapshot_fields and row.snapshot_id is None]
+    if missing:
+        if 'vitals' in fields:
+            latest_vitals = _latest_rows_by_patient(Vitals, missing)
+        if 'lab_results' in fields:
+            latest_labs = _latest_rows_by_patient(LabResult, missing)
+    
+    for row in rows:
+        record = {}
+        for field in fields:
+            if field == 'vitals':
+                if row.snapshot_id is not None:
+                    record[field] = json.loads(row.vitals_json) if row.vitals_json else {}
+                else:
+                    record[field] = latest_vitals[row.id].to_dict() if row.id in latest_vitals else {}
+            elif field == 'lab_results':
+                if row.snapshot_id is not None:
+                    record[field] = json.loads(row.labs_json) if row.labs_json else {}
+                else:
+                    record[field] = latest_labs[row.id].to_dict() if row.id in latest_labs else {}
+            elif field in ('timestamp', 'updated_at'):
+                value = getattr(row, field)
+                record[field] = value.isoformat() if value else None
+            else:
+                record[field] = getattr(row, field)
+        yield record
+
+PATIENT_LATEST_BACKFILL_BATCH = 500
+
+def _backfill_patient_latest():
+    """
+    Create snapshots for patients that have none (written before patient_latest
+    existed). The SQL status filters and the dashboard counters read only the
+    snapshot, so every patient needs one; returns the number created.
+    """
+    missing = (db.select(Patient.id)
+               .outerjoin(PatientLatest, PatientLatest.patient_db_id == Patient.id)
+               .where(PatientLatest.patient_db_id.is_(None)))
+    missing_ids = [patient_id for (patient_id,) in db.session.execute(missing)]
+    try:
+        for start in range(0, len(missing_ids), PATIENT_LATEST_BACKFILL_BATCH):
+            batch = missing_ids[start:start + PATIENT_LATEST_BACKFILL_BATCH]
+            latest_vitals = _latest_rows_by_patient(Vitals, batch)
+            latest_labs = _latest_rows_by_patient(LabResult, batch)
+            for patient in Patient.query.filter(Patient.id.in_(batch)):
+                patient.latest = PatientLatest(patient_db_id=patient.id)
+                _apply_latest_snapshot(patient, latest_vitals.get(patient.id), latest_labs.get(patient.id))
+            db.session.commit()
+    except IntegrityError:
+        db.session.rollback()  # Another process is backfilling
+        return 0
+    if missing_ids:
+        print(f"Backfilled patient_latest for {len(missing_ids)} patients")
+    return len(missing_ids)
+
+def rebuild_patient_latest():
+    """
+    Rebuild the patient_latest snapshot table from the vitals and lab_results
+    tables. Used to backfill existing databases; returns the number of rows written.
+    """
+    all_ids = db.select(Patient.id)
+    latest_vitals = _latest_rows_by_patient(Vitals, all_ids)
+    latest_labs = _latest_rows_by_patient(LabResult, all_ids)
+    
+    PatientLatest.query.delete()
+    db.session.flush()
+    
+    count = 0
+    for patient in Patient.query.all():
+        patient.latest = PatientLatest(patient_db_id=patient.id)
+        _apply_latest_snapshot(patient, latest_vitals.get(patient.id), latest_labs.get(patient.id))
+        count += 1
+    
+    db.session.commit()
+    # Statuses now come from the rebuilt snapshots
+    _write_dashboard_counters(compute_dashboard_counters())
+    return count
 
 def get_patient_history(patient_id):
     """Get patient historical records"""
@@ -134,7 +602,9 @@ def save_patient_history(patient_id, history_data):
         timestamp=datetime.utcnow()
     )
     db.session.add(history)
+    bump_collection_version('patients')
     db.session.commit()
+    _notify_patient_write(patient.patient_id)
     return history
 
 def get_or_create_chat_session(session_id, patient_id=None):
@@ -156,8 +626,72 @@ def get_or_create_chat_session(session_id, patient_id=None):
         db.session.add(session)
         db.session.commit()
     
+    _remember_chat_session_id(session_id, session.id)
     return session
 
+# Primary keys of recently used chat sessions, so a chat turn skips the session lookup
+CHAT_SESSION_CACHE_SIZE = 4096
+_chat_session_ids = OrderedDict()
+_chat_session_ids_lock = threading.Lock()
+
+def _remember_chat_session_id(session_id, session_db_id):
+    with _chat_session_ids_lock:
+        _chat_session_ids[session_id] = session_db_id
+        _chat_session_ids.move_to_end(session_id)
+        while len(_chat_session_ids) > CHAT_SESSION_CACHE_SIZE:
+            _chat_session_ids.popitem(last=False)
+
+def _resolve_chat_session_id(session_id, patient_id=None):
+    """Primary key of the session, adding it to the current transaction if it does not exist"""
+    with _chat_session_ids_lock:
+        session_db_id = _chat_session_ids.get(session_id)
+    if session_db_id is not None:
+        return session_db_id
+    
+    session_db_id = db.session.query(ChatSession.id).filter_by(session_id=session_id).scalar()
+    if session_db_id is not None:
+        return session_db_id
+    patient_db_id = None
+    if patient_id:
+        patient_db_id = db.session.query(Patient.id).filter_by(patient_id=patient_id.strip().upper()).scalar()
+    session = ChatSession(session_id=session_id, patient_db_id=patient_db_id, patient_id=patient_id)
+    try:
+        with db.session.begin_nested():
+            db.session.add(session)
+    except IntegrityError:
+        # Created concurrently by another request
+        return db.session.query(ChatSession.id).filter_by(session_id=session_id).scalar()
+    return session.id
+
+def save_chat_messages(session_id, messages, patient_id=None, summary=None, summary_through=None):
+    """
+    Append messages ({'role', 'content', optional 'timestamp'}) to a chat session and
+    touch its updated_at in one transaction, creating the session if needed.
+    summary/summary_through advance the session's running summary in the same transaction.
+    """
+    now = datetime.utcnow()
+    values = {'updated_at': now}
+    if summary_through is not None:
+        values.update(summary=summary, summary_through=summary_through)
+    session_db_id = _resolve_chat_session_id(session_id, patient_id)
+    try:
+        db.session.execute(ChatMessage.__table__.insert(), [
+            {'session_db_id': session_db_id, 'role': m['role'], 'content': m['content'],
+             'timestamp': m.get('timestamp') or now}
+            for m in messages
+        ])
+        db.session.execute(ChatSession.__table__.update()
+                           .where(ChatSession.__table__.c.id == session_db_id)
+                           .values(**values))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        with _chat_session_ids_lock:
+            _chat_session_ids.pop(session_id, None)
+        raise
+    # Cached only once committed, so a rolled back insert never leaves a dangling ID
+    _remember_chat_session_id(session_id, session_db_id)
+
 def save_chat_message(session_id, role, content):
     """Save a chat message to a session"""
     session = ChatSession.query.filter_by(session_id=session_id).first()
@@ -179,39 +713,228 @@ def save_chat_message(session_id, role, content):
     
     return message
 
-def get_chat_history(session_id, limit=50):
-    """Get chat history for a session"""
-    session = ChatSession.query.filter_by(session_id=session_id).first()
+def _ensure_bus_event_schema():
+    """
+    Recreate a bus_events table created without AUTOINCREMENT (SQLite), whose ids
+    restart at 1 once the relay prunes it empty. The outbox only holds events for
+    a few minutes, so its rows are dropped rather than copied.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return
+    with db.engine.begin() as conn:
+        sql = conn.execute(db.text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'bus_events'")).scalar()
+    if sql and 'AUTOINCREMENT' not in sql.upper():
+        BusEvent.__table__.drop(db.engine)
+        BusEvent.__table__.create(db.engine)
+
+def _ensure_chat_schema():
+    """
+    Add chat_sessions.summary/summary_through and the (session_db_id, timestamp)
+    message index to databases created before they existed
+    """
+    columns = {column['name'] for column in db.inspect(db.engine).get_columns('chat_sessions')}
+    with db.engine.begin() as conn:
+        if 'summary' not in columns:
+            conn.execute(db.text('ALTER TABLE chat_sessions ADD COLUMN summary TEXT'))
+        if 'summary_through' not in columns:
+            conn.execute(db.text(f"ALTER TABLE chat_sessions ADD COLUMN summary_through "
+                                 f"{db.DateTime().compile(dialect=db.engine.dialect)}"))
+    index = next(index for index in ChatMessage.__table__.indexes
+                 if index.name == 'ix_chat_messages_session_timestamp')
+    index.create(db.engine, checkfirst=True)
+
+def get_chat_history(session_id, limit=50, max_tokens=None):
+    """
+    Get the most recent messages of a session, oldest first.
+    At most `limit` messages are read; with max_tokens, older messages are dropped
+    once the estimated token count of the newer ones would exceed the budget.
+    """
+    rows = db.session.query(ChatMessage.role, ChatMessage.content, ChatMessage.timestamp) \
+        .join(ChatSession, ChatSession.id == ChatMessage.session_db_id) \
+        .filter(ChatSession.session_id == session_id) \
+        .order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc()) \
+        .limit(limit).all()
     
-    if not session:
-        return []
+    history = []
+    tokens = 0
+    for role, content, timestamp in rows:
+        if max_tokens is not None:
+            tokens += estimate_tokens(content)
+            if tokens > max_tokens:
+                break
+        history.append({
+            'role': role,
+            'content': content,
+            'timestamp': timestamp.isoformat() if timestamp else None
+        })
+    history.reverse()
+    return history
+
+def get_chat_context(session_id, limit=50):
+    """
+    The session's running summary and up to `limit` of its newest messages not yet
+    folded into it, oldest first:
+    {'summary': str or None, 'summary_through': datetime or None, 'messages': [...]}
+    """
+    session = db.session.query(ChatSession.id, ChatSession.summary, ChatSession.summary_through) \
+        .filter_by(session_id=session_id).first()
+    if session is None:
+        return {'summary': None, 'summary_through': None, 'messages': []}
     
-    messages = ChatMessage.query.filter_by(session_db_id=session.id).order_by(ChatMessage.timestamp.asc()).limit(limit).all()
-    return [msg.to_dict() for msg in messages]
+    query = db.session.query(ChatMessage.role, ChatMessage.content, ChatMessage.timestamp) \
+        .filter(ChatMessage.session_db_id == session.id)
+    if session.summary_through is not None:
+        query = query.filter(ChatMessage.timestamp > session.summary_through)
+    rows = query.order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc()).limit(limit).all()
+    messages = [{'role': role, 'content': content, 'timestamp': timestamp}
+                for role, content, timestamp in reversed(rows)]
+    return {'summary': session.summary, 'summary_through': session.summary_through, 'messages': messages}
 
-def save_rag_document(doc_type, content, patient_id=None, metadata=None):
-    """Save a document for RAG retrieval"""
+def save_rag_document(doc_type, content, patient_id=None, metadata=None, source_key=None):
+    """
+    Save a document for RAG retrieval. With a source_key the document is upserted:
+    the existing (doc_type, patient, source_key) row is rewritten instead of appending.
+    """
     patient_db_id = None
     if patient_id:
         patient = Patient.query.filter_by(patient_id=patient_id.strip().upper()).first()
         patient_db_id = patient.id if patient else None
     
-    doc = RAGDocument(
-        doc_type=doc_type,
-        patient_db_id=patient_db_id,
-        content=content,
-        metadata_json=json.dumps(metadata) if metadata else None
+    metadata_json = json.dumps(metadata) if metadata else None
+    if source_key is None:
+        doc = RAGDocument(doc_type=doc_type, patient_db_id=patient_db_id, content=content,
+                          metadata_json=metadata_json)
+        _embed_rag_document(doc)
+        db.session.add(doc)
+        db.session.commit()
+        return doc
+    
+    lookup = RAGDocument.query.filter(
+        RAGDocument.doc_type == doc_type,
+        RAGDocument.source_key == source_key,
+        RAGDocument.patient_db_id.is_(None) if patient_db_id is None else RAGDocument.patient_db_id == patient_db_id,
     )
-    db.session.add(doc)
+    doc = lookup.first()
+    if doc is None:
+        try:
+            with db.session.begin_nested():
+                doc = RAGDocument(doc_type=doc_type, patient_db_id=patient_db_id, source_key=source_key,
+                                  content=content, metadata_json=metadata_json)
+                _embed_rag_document(doc)
+                db.session.add(doc)
+        except IntegrityError:
+            doc = lookup.first()  # Inserted concurrently; rewrite that row instead
+    if doc.content != content or doc.metadata_json != metadata_json:
+        content_changed = doc.content != content
+        doc.content = content
+        doc.metadata_json = metadata_json
+        doc.updated_at = datetime.utcnow()
+        if content_changed or doc.embedding is None:
+            _embed_rag_document(doc)
     db.session.commit()
     return doc
 
-def search_rag_documents(query, doc_type=None, patient_id=None, limit=10):
+def _embed_rag_document(doc):
+    """Store the document's embedding from the configured local embedder"""
+    embedder = get_embedder()
+    doc.embedding = pack_embedding(embedder.embed([doc.content])[0])
+    doc.embedding_model = embedder.name
+
+def _semantic_rag_search(query, doc_type, patient_db_ids, limit, nprobe=None):
+    hits = get_rag_vector_index().search(query, limit=limit, doc_type=doc_type, patient_db_ids=patient_db_ids,
+                                         nprobe=nprobe)
+    documents = {doc.id: doc for doc in RAGDocument.query.filter(RAGDocument.id.in_([doc_id for doc_id, _ in hits]))}
+    results = []
+    for doc_id, score in hits:
+        if doc_id in documents:
+            result = documents[doc_id].to_dict()
+            result['score'] = round(score, 4)
+            results.append(result)
+    return results
+
+def get_rag_context(query, patient_id=None, limit=3):
+    """
+    Semantic retrieval for chat context: the patient's own documents plus shared ones
+    (documents not tied to any patient). Never returns other patients' documents.
+    """
+    patient_db_ids = {None}
+    if patient_id:
+        patient = Patient.query.filter_by(patient_id=patient_id.strip().upper()).first()
+        if patient:
+            patient_db_ids.add(patient.id)
+    return _semantic_rag_search(query, None, patient_db_ids, limit)
+
+# ------------------- RAG Full-Text Search -------------------
+# SQLite: FTS5 table kept in sync with rag_documents by triggers, ranked by bm25.
+# PostgreSQL: GIN index on to_tsvector(content), ranked by ts_rank.
+# Other databases, or SQLite builds without FTS5, fall back to a LIKE scan.
+RAG_FTS_LANGUAGE = 'english'
+_rag_fts_backend = None  # 'fts5', 'tsvector' or None
+
+_SQLITE_RAG_FTS_DDL = [
+    """CREATE VIRTUAL TABLE rag_documents_fts USING fts5(
+        content, content='rag_documents', content_rowid='id', tokenize='unicode61')""",
+    """CREATE TRIGGER IF NOT EXISTS rag_documents_fts_ai AFTER INSERT ON rag_documents BEGIN
+        INSERT INTO rag_documents_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS rag_documents_fts_ad AFTER DELETE ON rag_documents BEGIN
+        INSERT INTO rag_documents_fts(rag_documents_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS rag_documents_fts_au AFTER UPDATE OF content ON rag_documents BEGIN
+        INSERT INTO rag_documents_fts(rag_documents_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO rag_documents_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    # Index rows that existed before the FTS table
+    "INSERT INTO rag_documents_fts(rag_documents_fts) VALUES ('rebuild')",
+]
+
+def _ensure_rag_fulltext():
+    """Create the full-text index for rag_documents if the database supports one"""
+    global _rag_fts_backend
+    dialect = db.engine.dialect.name
+    try:
+        if dialect == 'sqlite':
+            with db.engine.begin() as conn:
+                exists = conn.exec_driver_sql(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rag_documents_fts'"
+                ).first()
+                if not exists:
+                    for statement in _SQLITE_RAG_FTS_DDL:
+                        conn.exec_driver_sql(statement)
+            _rag_fts_backend = 'fts5'
+        elif dialect == 'postgresql':
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql(
+                    "CREATE INDEX IF NOT EXISTS ix_rag_documents_content_fts ON rag_documents "
+                    f"USING GIN (to_tsvector('{RAG_FTS_LANGUAGE}', content))"
+                )
+            _rag_fts_backend = 'tsvector'
+    except Exception as e:
+        print(f"Full-text search unavailable, using LIKE search: {e}")
+        _rag_fts_backend = None
+
+def _fts5_match_expression(query):
+    """Turn free text into an FTS5 query: every word must match, as a prefix"""
+    terms = re.findall(r'\w+', query)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def search_rag_documents(query, doc_type=None, patient_id=None, limit=10, mode='text', nprobe=None):
     """
-    Simple text search for RAG documents
-    For production, consider using vector embeddings with pgvector or similar
+    Search RAG documents, best matches first.
+    mode='text': full-text (bm25 on SQLite FTS5, ts_rank on PostgreSQL, substring match elsewhere)
+    mode='semantic': cosine similarity of local embeddings; results include a 'score'.
+    nprobe trades recall for speed once the approximate index is in use (0 = exact).
     """
+    if mode == 'semantic':
+        patient_db_ids = None
+        if patient_id:
+            patient = Patient.query.filter_by(patient_id=patient_id.strip().upper()).first()
+            if patient:
+                patient_db_ids = {patient.id}
+        return _semantic_rag_search(query, doc_type, patient_db_ids, limit, nprobe)
+    
     query_obj = RAGDocument.query
+    filtered = bool(doc_type or patient_id)
     
     if doc_type:
         query_obj = query_obj.filter_by(doc_type=doc_type)
@@ -221,12 +944,176 @@ def search_rag_documents(query, doc_type=None, patient_id=None, limit=10):
         if patient:
             query_obj = query_obj.filter_by(patient_db_id=patient.id)
     
-    # Simple text search (for better results, use full-text search or vector embeddings)
-    query_obj = query_obj.filter(RAGDocument.content.like(f'%{query}%'))
-    
-    documents = query_obj.order_by(RAGDocument.updated_at.desc()).limit(limit).all()
+    match = _fts5_match_expression(query) if _rag_fts_backend == 'fts5' else query.strip()
+    if not match:
+        # Nothing to match on; same as the old '%%' substring filter
+        documents = query_obj.order_by(RAGDocument.updated_at.desc()).limit(limit).all()
+    elif _rag_fts_backend == 'fts5':
+        # Lower bm25 is a better match. Without filters the top-k is taken inside FTS5,
+        # which avoids materializing every match for common terms.
+        sql = ("SELECT rowid AS id, bm25(rag_documents_fts) AS rank "
+               "FROM rag_documents_fts WHERE rag_documents_fts MATCH :match")
+        params = {'match': match}
+        if not filtered:
+            sql += " ORDER BY rank LIMIT :limit"
+            params['limit'] = limit
+        ranked = db.text(sql).bindparams(**params).columns(id=db.Integer, rank=db.Float).subquery('fts')
+        documents = (query_obj.join(ranked, ranked.c.id == RAGDocument.id)
+                     .order_by(ranked.c.rank, RAGDocument.updated_at.desc()).limit(limit).all())
+    elif _rag_fts_backend == 'tsvector':
+        # Language rendered as a literal so the expression matches the GIN index
+        language = db.literal_column(f"'{RAG_FTS_LANGUAGE}'")
+        vector = db.func.to_tsvector(language, RAGDocument.content)
+        ts_query = db.func.plainto_tsquery(language, match)
+        documents = (query_obj.filter(vector.op('@@')(ts_query))
+                     .order_by(db.func.ts_rank(vector, ts_query).desc(), RAGDocument.updated_at.desc())
+                     .limit(limit).all())
+    else:
+        query_obj = query_obj.filter(RAGDocument.content.like(f'%{query}%'))
+        documents = query_obj.order_by(RAGDocument.updated_at.desc()).limit(limit).all()
     return [doc.to_dict() for doc in documents]
 
+# ------------------- Patient Text Search -------------------
+# Substring search over patient_id, name and symptoms for the search UI.
+# SQLite: FTS5 trigram table kept in sync with patients by triggers.
+# PostgreSQL: pg_trgm GIN indexes, used by ILIKE '%term%' and the similarity operators.
+# Other databases, builds without either, and terms shorter than a trigram fall back to a LIKE scan.
+PATIENT_SEARCH_MIN_CHARS = 3
+PATIENT_FUZZY_CANDIDATES = 200  # trigram matches re-ranked by similarity in fuzzy mode
+_patient_search_backend = None  # 'fts5', 'pg_trgm' or None
+_TRIGRAM_SPLIT_RE = re.compile(r'[^\w]+')
+
+_SQLITE_PATIENT_FTS_DDL = [
+    """CREATE VIRTUAL TABLE patients_fts USING fts5(
+        patient_id, name, symptoms, content='patients', content_rowid='id', tokenize='trigram')""",
+    """CREATE TRIGGER IF NOT EXISTS patients_fts_ai AFTER INSERT ON patients BEGIN
+        INSERT INTO patients_fts(rowid, patient_id, name, symptoms)
+        VALUES (new.id, new.patient_id, new.name, new.symptoms);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS patients_fts_ad AFTER DELETE ON patients BEGIN
+        INSERT INTO patients_fts(patients_fts, rowid, patient_id, name, symptoms)
+        VALUES ('delete', old.id, old.patient_id, old.name, old.symptoms);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS patients_fts_au AFTER UPDATE OF patient_id, name, symptoms ON patients BEGIN
+        INSERT INTO patients_fts(patients_fts, rowid, patient_id, name, symptoms)
+        VALUES ('delete', old.id, old.patient_id, old.name, old.symptoms);
+        INSERT INTO patients_fts(rowid, patient_id, name, symptoms)
+        VALUES (new.id, new.patient_id, new.name, new.symptoms);
+    END""",
+    # Index rows that existed before the FTS table
+    "INSERT INTO patients_fts(patients_fts) VALUES ('rebuild')",
+]
+
+_POSTGRES_PATIENT_TRGM_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+] + [
+    f"CREATE INDEX IF NOT EXISTS ix_patients_{column}_trgm ON patients USING GIN ({column} gin_trgm_ops)"
+    for column in ('patient_id', 'name', 'symptoms')
+]
+
+def _ensure_patient_search():
+    """Create the trigram index for patient search if the database supports one"""
+    global _patient_search_backend
+    dialect = db.engine.dialect.name
+    try:
+        if dialect == 'sqlite':
+            with db.engine.begin() as conn:
+                exists = conn.exec_driver_sql(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'patients_fts'"
+                ).first()
+                if not exists:
+                    for statement in _SQLITE_PATIENT_FTS_DDL:
+                        conn.exec_driver_sql(statement)
+            _patient_search_backend = 'fts5'
+        elif dialect == 'postgresql':
+            with db.engine.begin() as conn:
+                for statement in _POSTGRES_PATIENT_TRGM_DDL:
+                    conn.exec_driver_sql(statement)
+            _patient_search_backend = 'pg_trgm'
+    except Exception as e:
+        print(f"Trigram patient search unavailable, using LIKE search: {e}")
+        _patient_search_backend = None
+
+def _fts5_phrase(text):
+    return '"' + text.replace('"', '""') + '"'
+
+_patients_fts = db.table('patients_fts', db.column('rowid', db.Integer))
+
+def patient_text_search(patient_query, query):
+    """
+    Restrict a Patient query to patients whose patient_id, name or symptoms contain
+    query (case-insensitive). Returns (query, key column): ordering by the key keeps
+    SQLite streaming FTS matches in rowid order, so a LIMITed page stops early
+    instead of collecting every match of a common term.
+    """
+    term = query.strip()
+    if _patient_search_backend == 'fts5' and len(term) >= PATIENT_SEARCH_MIN_CHARS:
+        patient_query = (patient_query.join(_patients_fts, _patients_fts.c.rowid == Patient.id)
+                         .filter(db.text("patients_fts MATCH :match").bindparams(match=_fts5_phrase(term))))
+        return patient_query, _patients_fts.c.rowid
+    return patient_query.filter(_patient_like_clause(query)), Patient.id
+
+def _patient_like_clause(query):
+    term = query.strip()
+    if _patient_search_backend == 'pg_trgm':
+        pattern = f"%{term}%"
+        return db.or_(Patient.name.ilike(pattern), Patient.patient_id.ilike(pattern), Patient.symptoms.ilike(pattern))
+    pattern = f"%{query}%"
+    return db.or_(Patient.name.like(pattern), Patient.patient_id.like(pattern), Patient.symptoms.like(pattern))
+
+def _trigrams(text):
+    """pg_trgm-style trigrams: lowercased words padded with two leading spaces and one trailing"""
+    grams = set()
+    for word in _TRIGRAM_SPLIT_RE.split((text or '').lower()):
+        if word:
+            padded = f"  {word} "
+            grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+def trigram_similarity(a, b):
+    """Shared trigrams over all trigrams of a and b (0..1), as pg_trgm's similarity()"""
+    grams_a, grams_b = _trigrams(a), _trigrams(b)
+    if not grams_a or not grams_b:
+        return 0.0
+    return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+def _best_similarity(query, patient_id, name, symptoms):
+    fields = [patient_id, name] + re.split(r'[,;\n]', symptoms or '')
+    return max(trigram_similarity(query, field) for field in fields)
+
+def fuzzy_patient_matches(query, limit=PATIENT_FUZZY_CANDIDATES):
+    """
+    Typo-tolerant patient search: [(patient_id, similarity)] best first.
+    Candidates share trigrams with the query; they are ranked by the best trigram
+    similarity of patient_id, name or one symptom phrase. Without a trigram index
+    this falls back to substring matches.
+    """
+    term = query.strip()
+    if _patient_search_backend == 'pg_trgm':
+        score = db.func.greatest(db.func.similarity(Patient.name, term), db.func.similarity(Patient.patient_id, term),
+                                 db.func.word_similarity(term, Patient.symptoms)).label('score')
+        rows = (db.session.query(Patient.patient_id, score)
+                .filter(db.or_(Patient.name.op('%')(term), Patient.patient_id.op('%')(term),
+                               Patient.symptoms.op('%>')(term)))
+                .order_by(score.desc()).limit(limit).all())
+        return [(patient_id, float(score)) for patient_id, score in rows]
+    
+    # FTS5 trigrams are taken from the raw text, so the start of a field has no
+    # padded trigrams; keep the word-initial " xy" ones, which follow a space
+    grams = sorted(gram.rstrip() for gram in _trigrams(term) if not gram.startswith('  ') and not gram.endswith(' '))
+    if _patient_search_backend == 'fts5' and grams:
+        # Rows sharing the most trigrams rank best under bm25; re-rank the top ones
+        sql = ("SELECT p.patient_id, p.name, p.symptoms FROM patients_fts JOIN patients p ON p.id = patients_fts.rowid "
+               "WHERE patients_fts MATCH :match ORDER BY rank LIMIT :limit")
+        rows = db.session.execute(db.text(sql), {'match': ' OR '.join(_fts5_phrase(gram) for gram in grams),
+                                                 'limit': limit}).all()
+    else:
+        rows = (db.session.query(Patient.patient_id, Patient.name, Patient.symptoms)
+                .filter(_patient_like_clause(term)).limit(limit).all())
+    scored = [(patient_id, _best_similarity(term, patient_id, name, symptoms)) for patient_id, name, symptoms in rows]
+    scored.sort(key=lambda item: -item[1])
+    return scored
+
 def get_patient_comparison_data(patient_id):
     """
     Get current and historical data for patient comparison
@@ -296,4 +1183,247 @@ def index_patient_for_rag(patient_id):
         'indexed_at': datetime.utcnow().isoformat()
     }
     
-    return save_rag_document('patient_data', content, patient.patient_id, metadata)
+    return save_rag_document('patient_data', content, patient.patient_id, metadata,
+                             source_key=PATIENT_RAG_SOURCE_KEY)
+
+# ------------------- RAG Document Maintenance -------------------
+# Source key of the single summary document index_patient_for_rag keeps per patient
+PATIENT_RAG_SOURCE_KEY = 'patient_summary'
+RAG_UNIQUE_INDEXES = ('uq_rag_documents_source', 'uq_rag_documents_global_source')
+
+def _rag_index(name):
+    return next(index for index in RAGDocument.__table__.indexes if index.name == name)
+
+def _ensure_rag_document_schema():
+    """
+    Add rag_documents.source_key, embedding_model and the updated_at index to
+    databases created before they existed, and the unique index once the table
+    holds no duplicates (see compact_rag_documents).
+    """
+    inspector = db.inspect(db.engine)
+    columns = {column['name']: column for column in inspector.get_columns('rag_documents')}
+    with db.engine.begin() as conn:
+        if 'source_key' not in columns:
+            conn.execute(db.text('ALTER TABLE rag_documents ADD COLUMN source_key VARCHAR(100)'))
+        if 'embedding_model' not in columns:
+            conn.execute(db.text('ALTER TABLE rag_documents ADD COLUMN embedding_model VARCHAR(100)'))
+        # embedding used to be an unused TEXT column; SQLite stores blobs in it as is
+        if db.engine.dialect.name == 'postgresql' and not isinstance(columns['embedding']['type'], db.LargeBinary):
+            conn.execute(db.text('ALTER TABLE rag_documents ALTER COLUMN embedding TYPE BYTEA USING NULL'))
+    
+    indexes = {index['name'] for index in inspector.get_indexes('rag_documents')}
+    if 'ix_rag_documents_updated_at' not in indexes:
+        _rag_index('ix_rag_documents_updated_at').create(db.engine)
+    for name in RAG_UNIQUE_INDEXES:
+        if name in indexes:
+            continue
+        try:
+            _rag_index(name).create(db.engine)
+        except IntegrityError:
+            print(f"rag_documents has duplicate documents; run compact_rag_documents.py to add {name}")
+
+def compact_rag_documents():
+    """
+    Deduplicate rag_documents: legacy patient documents get the patient source key,
+    then only the newest row per (doc_type, patient, source_key) is kept and the
+    unique indexes are created. Returns {'keyed': n, 'deleted': n}.
+    """
+    table = RAGDocument.__table__
+    # Legacy patient documents (no source_key) count as the patient summary
+    effective_key = db.func.coalesce(
+        table.c.source_key,
+        db.case((db.and_(table.c.doc_type == 'patient_data', table.c.patient_db_id.isnot(None)),
+                 PATIENT_RAG_SOURCE_KEY))
+    )
+    with db.engine.begin() as conn:
+        ranked = db.select(
+            table.c.id,
+            db.func.row_number().over(
+                partition_by=(table.c.doc_type, table.c.patient_db_id, effective_key),
+                order_by=(table.c.updated_at.desc(), table.c.id.desc())
+            ).label('rn')
+        ).where(effective_key.isnot(None)).subquery()
+        stale_ids = db.select(ranked.c.id).where(ranked.c.rn > 1)
+        deleted = conn.execute(table.delete().where(table.c.id.in_(stale_ids))).rowcount
+        
+        keyed = conn.execute(
+            table.update()
+            .where(table.c.source_key.is_(None), effective_key.isnot(None))
+            .values(source_key=effective_key, updated_at=table.c.updated_at)
+        ).rowcount
+    
+    for name in RAG_UNIQUE_INDEXES:
+        _rag_index(name).create(db.engine, checkfirst=True)
+    return {'keyed': keyed, 'deleted': deleted}
+
+# ------------------- RAG Index Queue -------------------
+# Reindexing runs off the request path (see rag_indexer.py). A patient has at
+# most one job row; enqueueing again only bumps its request counter, and a job
+# that finishes with a newer request pending is run once more.
+RAG_INDEX_MAX_ATTEMPTS = 5
+RAG_INDEX_STALE_SECONDS = int(os.getenv('RAG_INDEX_STALE_SECONDS', '300'))  # reclaim jobs from dead workers
+
+_rag_index_enqueue_listeners = []
+
+def register_rag_index_listener(callback):
+    """Register callback() to run after a reindex job is committed (wakes in-process workers)"""
+    _rag_index_enqueue_listeners.append(callback)
+    return callback
+
+def enqueue_rag_index(patient_id):
+    """Request a reindex for patient_id. Does not commit; runs in the caller's transaction."""
+    table = RAGIndexJob.__table__
+    patient_id = patient_id.strip().upper()
+    update = (
+        table.update()
+        .where(table.c.patient_id == patient_id)
+        .values(requests=table.c.requests + 1,
+                status=db.case((table.c.status == 'failed', 'pending'), else_=table.c.status),
+                attempts=db.case((table.c.status == 'failed', 0), else_=table.c.attempts))
+    )
+    if db.session.execute(update).rowcount:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(RAGIndexJob(patient_id=patient_id, enqueued_at=datetime.utcnow()))
+    except IntegrityError:
+        db.session.execute(update)  # Inserted concurrently by another request
+
+def _notify_rag_index_enqueued():
+    for callback in _rag_index_enqueue_listeners:
+        try:
+            callback()
+        except Exception as e:
+            print(f"RAG index listener failed: {e}")
+
+def claim_rag_index_job():
+    """
+    Atomically take the oldest pending job (or a running one whose worker went away).
+    Returns (job_id, patient_id, requests) or None. Uses its own short transaction.
+    """
+    table = RAGIndexJob.__table__
+    now = datetime.utcnow()
+    claimable = db.or_(
+        table.c.status == 'pending',
+        db.and_(table.c.status == 'running', table.c.started_at < now - timedelta(seconds=RAG_INDEX_STALE_SECONDS))
+    )
+    for _ in range(3):
+        with db.engine.begin() as conn:
+            row = conn.execute(
+                db.select(table.c.id, table.c.patient_id, table.c.requests, table.c.status, table.c.attempts)
+                .where(claimable).order_by(table.c.enqueued_at, table.c.id).limit(1)
+            ).first()
+            if row is None:
+                return None
+            # Compare-and-set on the values just read (attempts changes on every claim),
+            # so two workers never take the same job
+            claimed = conn.execute(
+                table.update()
+                .where(table.c.id == row.id, table.c.status == row.status,
+                       table.c.requests == row.requests, table.c.attempts == row.attempts)
+                .values(status='running', started_at=now, attempts=table.c.attempts + 1)
+            ).rowcount
+            if claimed:
+                return row.id, row.patient_id, row.requests
+    return None
+
+def complete_rag_index_job(job_id, requests):
+    """Drop the job, or put it back to pending if it was enqueued again while running"""
+    table = RAGIndexJob.__table__
+    with db.engine.begin() as conn:
+        deleted = conn.execute(
+            table.delete().where(table.c.id == job_id, table.c.requests == requests)
+        ).rowcount
+        if not deleted:
+            conn.execute(
+                table.update().where(table.c.id == job_id)
+                .values(status='pending', started_at=None, attempts=0, last_error=None)
+            )
+
+def fail_rag_index_job(job_id, error):
+    """Record a failed attempt; the job is retried until RAG_INDEX_MAX_ATTEMPTS"""
+    table = RAGIndexJob.__table__
+    with db.engine.begin() as conn:
+        conn.execute(
+            table.update().where(table.c.id == job_id)
+            .values(status=db.case((table.c.attempts >= RAG_INDEX_MAX_ATTEMPTS, 'failed'), else_='pending'),
+                    started_at=None, last_error=str(error)[:2000])
+        )
+
+def get_rag_index_queue_stats():
+    """Return {status: job count}"""
+    rows = db.session.query(RAGIndexJob.status, db.func.count()).group_by(RAGIndexJob.status).all()
+    return {status: count for status, count in rows}
+
+
+# ------------------- ID Allocation -------------------
+# Prefix -> (model, column holding the string ID). Used to seed a sequence
+# from IDs that already exist when it is first leased.
+ID_SEQUENCES = {
+    'RX': (Prescription, 'prescription_id'),
+    'APT': (Appointment, 'appointment_id'),
+    'MSG': (PharmacyMessage, 'message_id'),
+    'VC': (VideoCallRequest, 'request_id'),
+}
+
+# Numbers reserved per database round trip. Each worker process hands out IDs
+# from its own block, so IDs are unique but not gap-free across workers.
+ID_BLOCK_SIZE = int(os.getenv('ID_BLOCK_SIZE', '20'))
+
+_id_blocks = {}  # prefix -> [next_value, end_value, pid]
+_id_blocks_lock = threading.Lock()
+
+def _max_existing_id_number(prefix):
+    """Highest numeric suffix among existing IDs with this prefix (0 if none)"""
+    model, column_name = ID_SEQUENCES[prefix]
+    column = getattr(model, column_name)
+    highest = 0
+    for (value,) in db.session.query(column).filter(column.like(f'{prefix}%')).all():
+        suffix = value[len(prefix):]
+        if suffix.isdigit():
+            highest = max(highest, int(suffix))
+    return highest
+
+def _lease_id_block(prefix):
+    """
+    Reserve ID_BLOCK_SIZE numbers for this process in one short transaction
+    on a separate connection. Returns (start, end) of the leased range.
+    """
+    table = IdSequence.__table__
+    for _ in range(3):
+        with db.engine.begin() as conn:
+            updated = conn.execute(
+                table.update()
+                .where(table.c.name == prefix)
+                .values(next_value=table.c.next_value + ID_BLOCK_SIZE)
+            ).rowcount
+            if updated:
+                end = conn.execute(db.select(table.c.next_value).where(table.c.name == prefix)).scalar()
+                return end - ID_BLOCK_SIZE, end
+        
+        # First use of this prefix: start after the highest ID already stored
+        start = _max_existing_id_number(prefix) + 1
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(table.insert().values(name=prefix, next_value=start + ID_BLOCK_SIZE))
+            return start, start + ID_BLOCK_SIZE
+        except IntegrityError:
+            continue  # Another process seeded it first; lease from its row
+    
+    raise RuntimeError(f"Could not lease an ID block for {prefix}")
+
+def allocate_id(prefix):
+    """
+    Return the next unique ID for prefix, e.g. allocate_id('RX') -> 'RX0042'.
+    IDs are never reused, even after rows are deleted.
+    """
+    with _id_blocks_lock:
+        block = _id_blocks.get(prefix)
+        # Blocks leased before a fork belong to the parent process
+        if not block or block[0] >= block[1] or block[2] != os.getpid():
+            start, end = _lease_id_block(prefix)
+            block = [start, end, os.getpid()]
+            _id_blocks[prefix] = block
+        value = block[0]
+        block[0] += 1
+    return f"{prefix}{value:04d}"
@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for
+from flask import Flask, request, jsonify, render_template, redirect, url_for, Response, stream_with_context
 import json
 import os
 import pandas as pd
@@ -6,7 +6,12 @@ import matplotlib.pyplot as plt
 import io
 import base64
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 import uuid
+import hashlib
+import heapq
+import threading
+import time
 from datetime import datetime
 from PIL import Image
 from werkzeug.utils import secure_filename
@@ -15,10 +20,22 @@ import re
 
 # Database imports
 from models import db
-from database import (init_db, save_patient_data, get_patient_by_id, get_all_patients,
+from database import (init_db, save_patient_data, get_patient_by_id,
                       get_patient_history, save_patient_history, get_or_create_chat_session,
-                      save_chat_message, get_chat_history, get_patient_comparison_data,
-                      index_patient_for_rag, search_rag_documents)
+                      save_chat_message, save_chat_messages, get_chat_history, get_patient_comparison_data,
+                      search_rag_documents, register_patient_write_listener, get_rag_index_queue_stats,
+                      get_rag_context, get_chat_context)
+from intents import doctor_chat_intents
+from clinical_rules import evaluate_patient
+from chat_context import (CHAT_VERBATIM_MESSAGES, CHAT_SUMMARY_MAX_FOLD, CHAT_PROMPT_TOKENS, estimate_tokens,
+                          compact_patient_json, fold_into_summary, split_history, trim_history)
+from llm_cache import LLMResponseCache, fingerprint
+from llm_executor import get_llm_executor
+from sse import SSE_HEADERS, format_sse, wants_event_stream
+from event_bus import register_event_routes
+from http_cache import conditional_get
+from patient_listing import LISTING_VARY, patient_list_response
+from rag_indexer import start_rag_index_worker
 
 # Load environment variables from .env (development convenience)
 load_dotenv()
@@ -28,6 +45,7 @@ app = Flask(__name__, template_folder="templates", static_folder="frontend/stati
 
 # Initialize database
 init_db(app)
+register_event_routes(app)
 
 # ------------------- Configuration -------------------
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -48,17 +66,20 @@ def allowed_file(filename):
 
 # ------------------- Gemini API Configuration -------------------
 # Load the Gemini API key from environment. Do NOT hardcode secrets in code.
-def _get_gemini_model():
-    """Return a configured Gemini GenerativeModel. Chooses a valid model for generateContent.
+
+# Resolving the model calls list_models() (a network round trip), so the
+# resolved model is cached per process and re-resolved after the TTL or when
+# generation reports the model as not found.
+GEMINI_MODEL_CACHE_TTL = int(os.getenv("GEMINI_MODEL_CACHE_TTL", "3600"))  # seconds
+
+_gemini_model_cache = {"model": None, "name": None, "api_key": None, "expires_at": 0.0}
+_gemini_model_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+_gemini_model_lock = threading.Lock()
+
+def _resolve_gemini_model_name():
+    """Choose a valid model name for generateContent.
     Falls back across known names and consults list_models.
     """
-    api_key = os.getenv("GEMINI_API_KEY", "").strip()
-    if not api_key:
-        raise RuntimeError(
-            "GEMINI_API_KEY is not set. Please set the environment variable to your Gemini API key."
-        )
-    genai.configure(api_key=api_key)
-
     # Candidate short names in order of preference (prefer broadly available first)
     # Include models observed in the user's account via DEBUG list
     candidates = [
@@ -92,19 +113,136 @@ def _get_gemini_model():
         for c in candidates:
             if c in supported:
                 print(f"DEBUG: Using Gemini model: {c}")
-                return genai.GenerativeModel(c)
+                return c
 
         # If none matched supported set, try first candidate directly
         print(f"DEBUG: No match in supported set, trying: {candidates[0]}")
-        try:
-            return genai.GenerativeModel(candidates[0])
-        except Exception as e:
-            print(f"DEBUG: Fallback init failed for {candidates[0]}: {e}. Trying gemini-flash-latest")
-            return genai.GenerativeModel("gemini-flash-latest")
+        return candidates[0]
     except Exception as e:
         # As a last resort, try a broadly available text model
         print(f"DEBUG: Model selection error: {e}. Falling back to gemini-pro")
-        return genai.GenerativeModel("gemini-pro")
+        return "gemini-pro"
+
+def _get_gemini_model():
+    """Return a configured Gemini GenerativeModel, cached per process for GEMINI_MODEL_CACHE_TTL."""
+    api_key = os.getenv("GEMINI_API_KEY", "").strip()
+    if not api_key:
+        raise RuntimeError(
+            "GEMINI_API_KEY is not set. Please set the environment variable to your Gemini API key."
+        )
+
+    with _gemini_model_lock:
+        cache = _gemini_model_cache
+        if cache["model"] is not None and cache["api_key"] == api_key and time.monotonic() < cache["expires_at"]:
+            _gemini_model_stats["hits"] += 1
+            return cache["model"]
+
+        _gemini_model_stats["misses"] += 1
+        genai.configure(api_key=api_key)
+        name = _resolve_gemini_model_name()
+        try:
+            model = genai.GenerativeModel(name)
+        except Exception as e:
+            print(f"DEBUG: Model init failed for {name}: {e}. Trying gemini-flash-latest")
+            name = "gemini-flash-latest"
+            model = genai.GenerativeModel(name)
+
+        cache.update(model=model, name=name, api_key=api_key,
+                     expires_at=time.monotonic() + GEMINI_MODEL_CACHE_TTL)
+        return model
+
+def _invalidate_gemini_model():
+    """Drop the cached model so the next call re-resolves it."""
+    with _gemini_model_lock:
+        _gemini_model_cache.update(model=None, name=None, expires_at=0.0)
+        _gemini_model_stats["invalidations"] += 1
+
+def _is_model_not_found(error) -> bool:
+    if isinstance(error, google_exceptions.NotFound):
+        return True
+    text = str(error).lower()
+    return "model" in text and ("404" in text or "not found" in text)
+
+def _generate_with_model_retry(contents, **kwargs):
+    """Call generate_content on the cached model.
+    If the model is reported missing, invalidate the cache and retry once.
+    """
+    try:
+        return _get_gemini_model().generate_content(contents, **kwargs)
+    except Exception as e:
+        if not _is_model_not_found(e):
+            raise
+        print(f"DEBUG: Cached Gemini model unavailable ({e}); re-resolving")
+        _invalidate_gemini_model()
+        return _get_gemini_model().generate_content(contents, **kwargs)
+
+def _stream_with_model_retry(contents, **kwargs):
+    """Yield generate_content(stream=True) chunks from the cached model.
+    If the model is reported missing before any chunk arrives, invalidate the cache and retry once.
+    """
+    started = False
+    try:
+        for chunk in _get_gemini_model().generate_content(contents, stream=True, **kwargs):
+            started = True
+            yield chunk
+    except Exception as e:
+        if started or not _is_model_not_found(e):
+            raise
+        print(f"DEBUG: Cached Gemini model unavailable ({e}); re-resolving")
+        _invalidate_gemini_model()
+        yield from _get_gemini_model().generate_content(contents, stream=True, **kwargs)
+
+def _gemini_generate(contents, coalesce_key=None, timeout=None, **kwargs):
+    """Run generate_content on the shared LLM executor and wait for the result.
+    Identical in-flight requests share one upstream call; coalesce_key overrides
+    the default key for contents that do not serialize stably (e.g. images).
+    """
+    executor = get_llm_executor()
+    timeout = executor.default_timeout if timeout is None else timeout
+    kwargs.setdefault("request_options", {"timeout": timeout})
+    key = coalesce_key or fingerprint("generate_content", contents, kwargs)
+    return executor.run(key, _generate_with_model_retry, contents, timeout=timeout, **kwargs)
+
+def gemini_model_cache_stats():
+    """Hit/miss counters for the per-process model cache."""
+    with _gemini_model_lock:
+        hits = _gemini_model_stats["hits"]
+        misses = _gemini_model_stats["misses"]
+        lookups = hits + misses
+        return {
+            "model": _gemini_model_cache["name"],
+            "hits": hits,
+            "misses": misses,
+            "invalidations": _gemini_model_stats["invalidations"],
+            "hit_rate": round(hits / lookups, 4) if lookups else None,
+            "ttl_seconds": GEMINI_MODEL_CACHE_TTL,
+        }
+
+def _warm_gemini_model_cache():
+    """Resolve the model in the background at startup so the first request skips list_models()."""
+    def _warm():
+        try:
+            _get_gemini_model()
+        except Exception as e:
+            print(f"DEBUG: Gemini model warm-up failed: {e}")
+    threading.Thread(target=_warm, name="gemini-warmup", daemon=True).start()
+
+# ------------------- LLM Response Cache -------------------
+# Gemini results for the per-patient analysis endpoints, keyed by a fingerprint
+# of the prompt inputs. Entries for a patient are dropped when new data is saved.
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "900"))  # seconds
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "512"))
+llm_response_cache = LLMResponseCache(max_entries=LLM_CACHE_MAX_ENTRIES, ttl_seconds=LLM_CACHE_TTL)
+
+def _llm_cache_key(endpoint, patient_id, current, history):
+    """Fingerprint of the patient snapshot, latest history record and model name."""
+    _get_gemini_model()  # resolves the model name if the cache is cold
+    return fingerprint(endpoint, _normalize_patient_id(patient_id), current, history,
+                       _gemini_model_cache["name"])
+
+register_patient_write_listener(
+    lambda patient_id: llm_response_cache.invalidate_patient(_normalize_patient_id(patient_id))
+)
 
 def _has_gemini() -> bool:
     try:
@@ -171,11 +309,9 @@ def submit_patient():
     if 'patient_id' in data:
         data['patient_id'] = _normalize_patient_id(data['patient_id'])
 
-    # Save to SQL database
+    # Save to SQL database; RAG indexing is queued in the same transaction
     try:
-        patient = save_patient_data(data)
-        # Index for RAG
-        index_patient_for_rag(patient.patient_id)
+        save_patient_data(data, index_for_rag=True)
         return jsonify({"status": "success", "message": "Patient data saved successfully!"})
     except Exception as e:
         return jsonify({"status": "error", "message": f"Failed to save patient data: {str(e)}"}), 500
@@ -225,9 +361,8 @@ def extract_medical_data_from_image(image_path):
     try:
         # Load and prepare the image
         image = Image.open(image_path)
-        
-        # Get Gemini model with vision capabilities (use the helper function)
-        model = _get_gemini_model()
+        with open(image_path, "rb") as f:
+            image_digest = hashlib.sha256(f.read()).hexdigest()
         
         # Create prompt for medical data extraction
         prompt = """
@@ -257,7 +392,8 @@ def extract_medical_data_from_image(image_path):
         """
         
         # Generate content with image
-        response = model.generate_content([prompt, image])
+        response = _gemini_generate([prompt, image],
+                                    coalesce_key=fingerprint("extract_medical_data", prompt, image_digest))
         
         # Parse the response to extract JSON
         response_text = response.text.strip()
@@ -300,10 +436,13 @@ def get_patient_data_route(patient_id):
     return jsonify([patient_data])
 
 @app.route("/get_all_patients")
+@conditional_get('patients', vary=LISTING_VARY)
 def get_all_patients_route():
-    """Get all patients from SQL database"""
-    all_patients = get_all_patients()
-    return jsonify(all_patients)
+    """Get all patients from SQL database (paged, projected or streamed; see patient_listing.py)"""
+    try:
+        return patient_list_response()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
 # ------------------- Patient Comparison Plot -------------------
 @app.route("/patient_compare_plot/<patient_id>")
@@ -403,35 +542,43 @@ def chat_with_ai():
 
         # Retrieve authoritative patient data from JSON if patient_id is provided
         patient_data = client_patient_data or {}
+        authoritative = None
         if patient_id:
             authoritative = get_patient_data_internal(patient_id)
             if authoritative:
                 patient_data = authoritative
 
-        # Get or create chat session and persist user message
-        session = get_or_create_chat_session(session_id, patient_id)
-        save_chat_message(session_id, "user", user_message)
+        # The turn (user + assistant message) is persisted in one transaction once answered
+        received_at = datetime.utcnow()
 
         # JSON Q&A: try to directly answer about fields in the patient's JSON
-        json_qa_text = _json_qa_answer(user_message, patient_data)
+        snapshot = (patient_id, patient_data.get("updated_at")) if patient_data is authoritative else None
+        json_qa_text = _json_qa_answer(user_message, patient_data, snapshot)
 
         # Generate grounded response (text + optional structured insights)
         response_packet = _generate_grounded_packet(user_message, patient_data)
         response_text = json_qa_text or response_packet.get("response", "")
+        use_gemini = _has_gemini() and (general_ai_enabled or _looks_like_open_question(user_message))
+
+        if wants_event_stream(payload):
+            return _stream_chat_response(session_id, patient_id, user_message, received_at, patient_data,
+                                         response_text, response_packet.get("structured"), use_gemini)
 
         # Optional: augment with Gemini for open-ended or explanatory questions
-        if _has_gemini() and (general_ai_enabled or _looks_like_open_question(user_message)):
+        chat_context = None
+        if use_gemini:
             try:
-                # Get chat history from SQL
-                history_messages = get_chat_history(session_id)
-                llm_text = _call_gemini_chat(user_message, patient_data, history_messages)
+                # Running summary + last few messages from SQL
+                chat_context = _load_chat_context(session_id)
+                context_docs = _retrieve_chat_context(user_message, patient_id)
+                llm_text = _call_gemini_chat(user_message, patient_data, chat_context["history"], context_docs,
+                                             chat_context["summary"])
             except Exception as _e:
                 llm_text = None
             if llm_text:
                 response_text = llm_text
 
-    
-        save_chat_message(session_id, "assistant", response_text)
+        _save_chat_turn(session_id, patient_id, user_message, received_at, response_text, chat_context)
 
         return jsonify({
             "response": response_text,
@@ -443,19 +590,64 @@ def chat_with_ai():
         return jsonify({"error": f"chat processing failed: {str(e)}"}), 500
 
 
+def _save_chat_turn(session_id, patient_id, user_message, received_at, response_text, chat_context=None):
+    summary_update = (chat_context or {}).get("summary_update") or {}
+    save_chat_messages(session_id, [
+        {"role": "user", "content": user_message, "timestamp": received_at},
+        {"role": "assistant", "content": response_text},
+    ], patient_id, **summary_update)
+
+def _stream_chat_response(session_id, patient_id, user_message, received_at, patient_data,
+                          grounded_text, structured, use_gemini):
+    """Stream the chat reply as Server-Sent Events.
+    Emits a 'meta' event, 'delta' chunks as Gemini produces them, then 'done' with the
+    full text. The turn is persisted once, after the stream completes; if the client
+    disconnects first, whatever was streamed so far is saved instead.
+    """
+    def generate():
+        parts = []
+        chat_context = None
+        save_attempted = False
+        try:
+            yield format_sse({"sessionId": session_id, "patient_id": patient_id, "structured": structured}, event="meta")
+            if use_gemini:
+                try:
+                    chat_context = _load_chat_context(session_id)
+                    context_docs = _retrieve_chat_context(user_message, patient_id)
+                    for text in _stream_gemini_chat(user_message, patient_data, chat_context["history"], context_docs,
+                                                    chat_context["summary"]):
+                        parts.append(text)
+                        yield format_sse({"delta": text}, event="delta")
+                except Exception as e:
+                    print(f"DEBUG: Gemini streaming failed: {e}")
+                    yield format_sse({"error": str(e)}, event="error")
+            response_text = "".join(parts).strip()
+            if not response_text:
+                response_text = grounded_text
+                yield format_sse({"delta": response_text}, event="delta")
+            # Set before saving: if the save itself fails, finally must not insert the turn again
+            save_attempted = True
+            _save_chat_turn(session_id, patient_id, user_message, received_at, response_text, chat_context)
+            yield format_sse({"response": response_text, "sessionId": session_id}, event="done")
+        finally:
+            if not save_attempted:
+                # Client went away mid-stream (GeneratorExit): keep the partial exchange
+                response_text = "".join(parts).strip() or grounded_text
+                _save_chat_turn(session_id, patient_id, user_message, received_at, response_text, chat_context)
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream", headers=SSE_HEADERS)
+
 def _generate_grounded_reply(message: str, patient: dict) -> str:
     """Heuristic, safe, retrieval-augmented reply grounded in patient JSON."""
-    msg = (message or "").lower()
+    intents = doctor_chat_intents(message or "")
     # Friendly greeting fallback (works even without GEMINI_API_KEY)
-    if any(g in msg for g in ["hi", "hello", "hey", "good morning", "good evening", "good afternoon"]):
+    if "greeting" in intents:
         return (
             "Hello doctor. I can help with patient-specific questions (vitals, labs, symptoms, insights) "
             "and general medical queries. Ask me anything or use the quick action buttons below."
         )
     if not patient:
         # Generic but safe response when no patient context is available
-        if any(k in msg for k in ["hello", "hi", "hey"]):
-            return "Hello doctor. Please load a patient ID to enable data-grounded assistance."
         return (
             "I need the patient's data to provide grounded insights. "
             "Load a patient first, then ask about vitals, symptoms, labs, trends, or recommended tests."
@@ -475,9 +667,10 @@ def _generate_grounded_reply(message: str, patient: dict) -> str:
     ecg = labs.get("ecg")
     troponin = labs.get("troponin")
     cholesterol = labs.get("cholesterol")
+    fired = evaluate_patient(patient)
 
     # Common intents
-    if any(k in msg for k in ["patient info", "patient details", "summary", "overview"]):
+    if "summary" in intents:
         lines = ["Patient summary:"]
         if name: lines.append(f"- Name: {name}")
         if age: lines.append(f"- Age: {age}")
@@ -495,45 +688,33 @@ def _generate_grounded_reply(message: str, patient: dict) -> str:
             if cholesterol: lines.append(f"  • Cholesterol: {cholesterol} mg/dL")
         return "\n".join(lines)
 
-    if any(k in msg for k in ["bp", "blood pressure"]):
+    if "bp" in intents:
         if bp:
-            try:
-                systolic = int(str(bp).split("/")[0])
-            except Exception:
-                systolic = None
             flag = "normal"
-            if systolic and systolic >= 140:
+            if "bp_high" in fired:
                 flag = "high—monitor and evaluate for hypertension"
-            elif systolic and systolic >= 130:
+            elif "bp_elevated" in fired:
                 flag = "elevated—lifestyle counseling and follow-up"
             return f"BP: {bp} mmHg ({flag}). Consider trend and symptoms."
         return "No blood pressure recorded."
 
-    if any(k in msg for k in ["hr", "heart rate", "pulse"]):
+    if "hr" in intents:
         if hr:
-            try:
-                hr_val = int(str(hr))
-            except Exception:
-                hr_val = None
             status = "within expected range"
-            if hr_val and (hr_val > 100 or hr_val < 60):
+            if fired & {"hr_high", "hr_low"}:
                 status = "outside resting range—correlate clinically"
             return f"Heart rate: {hr} bpm ({status})."
         return "No heart rate recorded."
 
-    if "spo2" in msg or "oxygen" in msg:
+    if "spo2" in intents:
         if spo2:
-            try:
-                s = int(str(spo2))
-            except Exception:
-                s = None
             status = "acceptable"
-            if s and s < 95:
+            if "spo2_low" in fired:
                 status = "low—assess respiratory status immediately"
             return f"SpO2: {spo2}% ({status})."
         return "No oxygen saturation recorded."
 
-    if any(k in msg for k in ["diagnose", "analysis", "what's wrong", "assessment"]):
+    if "assessment" in intents:
         # Non-diagnostic advice—safe, grounded summary and next steps
         base = ["Assessment summary (not a diagnosis):"]
         if symptoms: base.append(f"- Reported symptoms: {symptoms}")
@@ -557,9 +738,7 @@ def _generate_grounded_reply(message: str, patient: dict) -> str:
     )
 
 def _looks_like_open_question(message: str) -> bool:
-    msg = (message or "").lower()
-    triggers = ["what", "why", "how", "explain", "interpret", "risk", "prognosis", "could it be", "diagnosis", "differential"]
-    return any(t in msg for t in triggers)
+    return "open_question" in doctor_chat_intents(message or "")
 
 def _flatten_json(obj, parent_key="", sep="."):
     items = {}
@@ -575,30 +754,63 @@ def _flatten_json(obj, parent_key="", sep="."):
         items[parent_key] = obj
     return items
 
-def _json_qa_answer(message: str, patient: dict) -> str:
+_KEY_TOKEN_RE = re.compile(r"[a-zA-Z0-9_]+")
+
+class _PatientKeyIndex:
+    """Flattened patient JSON plus an inverted index from key token to flattened keys."""
+
+    def __init__(self, patient: dict):
+        self.flat = _flatten_json(patient)
+        self.keys_by_token = {}
+        for key in self.flat:
+            for token in set(_KEY_TOKEN_RE.findall(key.lower())):
+                self.keys_by_token.setdefault(token, []).append(key)
+
+# Key indexes are built once per patient snapshot, keyed by patient_id + updated_at
+# (a content fingerprint for unsaved client data), and dropped when the patient is saved.
+JSON_QA_INDEX_CACHE_SIZE = int(os.getenv("JSON_QA_INDEX_CACHE_SIZE", "256"))
+json_qa_index_cache = LLMResponseCache(max_entries=JSON_QA_INDEX_CACHE_SIZE, ttl_seconds=3600)
+
+register_patient_write_listener(
+    lambda patient_id: json_qa_index_cache.invalidate_patient(_normalize_patient_id(patient_id))
+)
+
+def _patient_key_index(patient: dict, snapshot=None) -> _PatientKeyIndex:
+    if snapshot and snapshot[1]:
+        patient_id = _normalize_patient_id(snapshot[0])
+        cache_key = ("snapshot", patient_id, snapshot[1])
+    else:
+        patient_id = None
+        cache_key = ("content", fingerprint(patient))
+    index = json_qa_index_cache.get(cache_key)
+    if index is None:
+        index = _PatientKeyIndex(patient)
+        json_qa_index_cache.set(cache_key, index, patient_id)
+    return index
+
+def _json_qa_answer(message: str, patient: dict, snapshot=None) -> str:
     """Very simple key-based QA over patient JSON. Returns text lines or empty string.
     Looks for key names in the user's message and returns values for matches.
+    snapshot is (patient_id, updated_at) when patient was loaded from the database.
     """
     if not patient:
         return ""
     msg = (message or "").lower()
-    flat = _flatten_json(patient)
     # Extract alphanumeric tokens from the message
-    tokens = [t for t in re.findall(r"[a-zA-Z0-9_]+", msg) if len(t) >= 2]
+    tokens = [t for t in _KEY_TOKEN_RE.findall(msg) if len(t) >= 2]
     if not tokens:
         return ""
-    # Score keys by token overlap
-    scored = []
-    for k in flat.keys():
-        key_tokens = set(re.findall(r"[a-zA-Z0-9_]+", k.lower()))
-        overlap = len([t for t in tokens if t in key_tokens])
-        if overlap > 0:
-            scored.append((overlap, k))
-    scored.sort(reverse=True)
-    if not scored:
+    index = _patient_key_index(patient, snapshot)
+    # Score keys by token overlap, visiting only keys that share a token
+    overlap = {}
+    for t in tokens:
+        for k in index.keys_by_token.get(t, ()):
+            overlap[k] = overlap.get(k, 0) + 1
+    if not overlap:
         return ""
     # Return top few matches
-    top = scored[:5]
+    top = heapq.nlargest(5, ((count, k) for k, count in overlap.items()))
+    flat = index.flat
     lines = ["Relevant patient data:"]
     for _, k in top:
         val = flat.get(k)
@@ -607,28 +819,81 @@ def _json_qa_answer(message: str, patient: dict) -> str:
         lines.append(f"- {nice_k}: {val}")
     return "\n".join(lines)
 
-def _call_gemini_chat(message: str, patient: dict, history: list) -> str:
-    """Call Gemini with patient JSON as context to provide general AI explanation/answer.
-    History is a list of {role, content}.
+# Retrieved RAG documents below this cosine score are not worth the prompt tokens
+RAG_CONTEXT_LIMIT = int(os.getenv("RAG_CONTEXT_LIMIT", "3"))
+RAG_CONTEXT_MIN_SCORE = float(os.getenv("RAG_CONTEXT_MIN_SCORE", "0.15"))
+def _load_chat_context(session_id: str) -> dict:
+    """Running summary and last few messages of the session (the current turn is not saved yet).
+    Messages older than the verbatim window are folded into the summary here; the new summary
+    is persisted with the turn via 'summary_update'.
     """
-    model = _get_gemini_model()
+    stored = get_chat_context(session_id, limit=CHAT_VERBATIM_MESSAGES + CHAT_SUMMARY_MAX_FOLD)
+    fold, recent = split_history(stored["messages"])
+    summary = stored["summary"]
+    summary_update = None
+    if fold:
+        summary = fold_into_summary(summary, fold)
+        summary_update = {"summary": summary, "summary_through": fold[-1]["timestamp"]}
+    return {"summary": summary, "history": recent, "summary_update": summary_update}
+
+def _retrieve_chat_context(message: str, patient_id: str) -> list:
+    """Semantic search over the patient's and shared RAG documents for the chat prompt."""
+    try:
+        docs = get_rag_context(message, patient_id or None, limit=RAG_CONTEXT_LIMIT)
+    except Exception as e:
+        print(f"DEBUG: RAG context retrieval failed: {e}")
+        return []
+    return [d for d in docs if d.get("score", 0) >= RAG_CONTEXT_MIN_SCORE]
+
+def _build_gemini_chat_convo(message: str, patient: dict, history: list, context_docs=None,
+                             summary=None) -> list:
+    """Build the Gemini conversation: system rules, patient JSON context, retrieved records,
+    conversation summary, recent history, message. History is trimmed to CHAT_PROMPT_TOKENS."""
     system_rules = (
         "You are a clinical assistant. Use the provided patient JSON as the primary source. "
         "Be accurate, concise, and avoid definitive diagnoses. Emphasize that outputs are informational, not medical advice."
     )
-    context_json = json.dumps(patient or {}, indent=2)
+    context_json = compact_patient_json(patient)
     convo = [
         {"role": "user", "parts": [system_rules]},
         {"role": "user", "parts": [f"Patient JSON context:\n{context_json}"]},
     ]
-    # Append recent history (limit to last 8 exchanges)
-    for m in history[-16:]:
+    if context_docs:
+        records = "\n---\n".join(d.get("content", "") for d in context_docs)
+        convo.append({"role": "user", "parts": [f"Related records (retrieved, may be partial):\n{records}"]})
+    if summary:
+        convo.append({"role": "user", "parts": [f"Earlier in this conversation (summary):\n{summary}"]})
+    # Append as much recent history as the remaining budget allows
+    used = sum(estimate_tokens(part["parts"][0]) for part in convo) + estimate_tokens(message)
+    for m in trim_history(history, CHAT_PROMPT_TOKENS - used):
         role = "model" if m.get("role") == "assistant" else "user"
         convo.append({"role": role, "parts": [m.get("content", "")]})
     convo.append({"role": "user", "parts": [message]})
-    resp = model.generate_content(convo)
+    return convo
+
+def _call_gemini_chat(message: str, patient: dict, history: list, context_docs=None, summary=None) -> str:
+    """Call Gemini with patient JSON as context to provide general AI explanation/answer.
+    History is a list of {role, content}.
+    """
+    resp = _gemini_generate(_build_gemini_chat_convo(message, patient, history, context_docs, summary))
     return (resp.text or "").strip()
 
+def _stream_gemini_chat(message: str, patient: dict, history: list, context_docs=None, summary=None):
+    """Yield reply text chunks from Gemini as they are generated (stream=True).
+    Holds an LLM executor slot until the stream is exhausted or closed.
+    """
+    convo = _build_gemini_chat_convo(message, patient, history, context_docs, summary)
+    executor = get_llm_executor()
+    with executor.slot():
+        for chunk in _stream_with_model_retry(convo, request_options={"timeout": executor.default_timeout}):
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. safety metadata) carry nothing to show
+                continue
+            if text:
+                yield text
+
 def _generate_grounded_packet(message: str, patient: dict) -> dict:
     """Return {'response': text, 'structured': optional_dict} for rich chat rendering.
     Structured format:
@@ -643,14 +908,9 @@ def _generate_grounded_packet(message: str, patient: dict) -> dict:
     }
     """
     text = _generate_grounded_reply(message, patient)
-    msg = (message or "").lower()
     structured = None
 
-    if patient and any(k in msg for k in [
-        "insight", "diagnose", "analysis", "assessment", "clinical",
-        "disease", "diagnosis", "differential", "condition", "what could it be",
-        "test", "tests", "recommended tests", "precaution", "precautions", "red flags", "redflags"
-    ]):
+    if patient and "insights" in doctor_chat_intents(message or ""):
         vitals = patient.get("vitals") or {}
         labs = patient.get("lab_results") or {}
         symptoms = (patient.get("symptoms") or "").strip()
@@ -661,15 +921,11 @@ def _generate_grounded_packet(message: str, patient: dict) -> dict:
         precautions = []
         red_flags = []
         diagnoses = []
+        fired = evaluate_patient(patient)
 
         # BP
         bp = vitals.get("bp")
-        try:
-            systolic = int(str(bp).split("/")[0]) if bp else None
-            diastolic = int(str(bp).split("/")[1]) if bp else None
-        except Exception:
-            systolic = diastolic = None
-        if systolic and (systolic >= 140 or (diastolic and diastolic >= 90)):
+        if "bp_high" in fired:
             insights_notes.append("Elevated blood pressure; assess for hypertension and end-organ risk.")
             tests.append({"test": "Repeat BP and basic metabolic panel", "reason": "Confirm elevation and assess impact", "urgency": "Within 24-48 hours"})
             precautions.append("Limit sodium intake, ensure medication adherence, and monitor BP at home.")
@@ -682,11 +938,7 @@ def _generate_grounded_packet(message: str, patient: dict) -> dict:
 
         # HR
         hr = vitals.get("hr")
-        try:
-            hr_val = int(str(hr)) if hr is not None else None
-        except Exception:
-            hr_val = None
-        if hr_val and (hr_val > 100 or hr_val < 60):
+        if fired & {"hr_high", "hr_low"}:
             insights_notes.append("Abnormal resting heart rate; correlate with symptoms and ECG.")
             tests.append({"test": "12‑lead ECG", "reason": "Evaluate rhythm or ischemia", "urgency": "Within 24h"})
             diagnoses.append({
@@ -697,11 +949,7 @@ def _generate_grounded_packet(message: str, patient: dict) -> dict:
 
         # SpO2
         spo2 = vitals.get("spo2")
-        try:
-            spo2_val = int(str(spo2)) if spo2 is not None else None
-        except Exception:
-            spo2_val = None
-        if spo2_val and spo2_val < 95:
+        if "spo2_low" in fired:
             insights_notes.append("Low oxygen saturation; assess respiratory status.")
             tests.append({"test": "Chest X‑ray / ABG as indicated", "reason": "Investigate hypoxemia cause", "urgency": "Immediate"})
             red_flags.append("SpO2 < 92% or worsening dyspnea—urgent evaluation.")
@@ -719,13 +967,7 @@ def _generate_grounded_packet(message: str, patient: dict) -> dict:
             red_flags.append("Chest pain with diaphoresis, radiation, or dyspnea—call emergency services.")
             # Heuristic differential based on available labs
             ecg = labs.get("ecg")
-            troponin = labs.get("troponin")
-            troponin_high = False
-            try:
-                troponin_high = float(str(troponin)) > 0.04 if troponin is not None else False
-            except Exception:
-                troponin_high = False
-            if troponin_high or (ecg and any(k in str(ecg).lower() for k in ["st", "ischemia", "t-wave"])):
+            if "troponin_high" in fired or (ecg and any(k in str(ecg).lower() for k in ["st", "ischemia", "t-wave"])):
                 diagnoses.append({
                     "condition": "Acute Coronary Syndrome (rule out)",
                     "confidence": "Medium",
@@ -741,19 +983,14 @@ def _generate_grounded_packet(message: str, patient: dict) -> dict:
         # Labs
         troponin = labs.get("troponin")
         cholesterol = labs.get("cholesterol")
-        if cholesterol:
-            try:
-                chol_val = float(str(cholesterol))
-            except Exception:
-                chol_val = None
-            if chol_val and chol_val > 200:
-                insights_notes.append("Elevated cholesterol; optimize lipid-lowering therapy and lifestyle.")
-                precautions.append("Adopt heart‑healthy diet and regular moderate exercise as tolerated.")
-                diagnoses.append({
-                    "condition": "Hyperlipidemia (likely)",
-                    "confidence": "High",
-                    "reasoning": f"Cholesterol {cholesterol} mg/dL above target."
-                })
+        if "cholesterol_high" in fired:
+            insights_notes.append("Elevated cholesterol; optimize lipid-lowering therapy and lifestyle.")
+            precautions.append("Adopt heart‑healthy diet and regular moderate exercise as tolerated.")
+            diagnoses.append({
+                "condition": "Hyperlipidemia (likely)",
+                "confidence": "High",
+                "reasoning": f"Cholesterol {cholesterol} mg/dL above target."
+            })
 
         # Fever + headache heuristic
         if any(k in symptoms.lower() for k in ["fever"]) and any(k in symptoms.lower() for k in ["headache"]):
@@ -888,9 +1125,14 @@ Focus on clinical relevance and actionable recommendations. Be concise but thoro
 """
 
     try:
+        cache_key = _llm_cache_key("clinical_insights", patient_id, current, history)
+        cached = llm_response_cache.get(cache_key)
+        if cached is not None:
+            print("DEBUG: Returning cached AI analysis")
+            return jsonify(cached)
+
         print("DEBUG: Calling Gemini API...")
-        model = _get_gemini_model()
-        response = model.generate_content(prompt)
+        response = _gemini_generate(prompt)
         ai_text = response.text
         print(f"DEBUG: Gemini response length: {len(ai_text)}")
         print(f"DEBUG: Gemini response preview: {ai_text[:200]}...")
@@ -898,6 +1140,8 @@ Focus on clinical relevance and actionable recommendations. Be concise but thoro
         try:
             ai_json = json.loads(ai_text)
             print("DEBUG: Successfully parsed JSON from Gemini")
+            # Only parsed model output is cached; the fallback below is rebuilt on every call
+            llm_response_cache.set(cache_key, ai_json, patient_id=_normalize_patient_id(patient_id))
         except json.JSONDecodeError as e:
             print(f"DEBUG: JSON parsing failed: {e}")
             print(f"DEBUG: Raw AI text: {ai_text}")
@@ -1086,9 +1330,14 @@ RESPONSE FORMAT (JSON only):
 Focus on practical, actionable medical advice. Be specific about the conditions based on the presented symptoms and vitals.
 """
 
+        cache_key = _llm_cache_key("ai_consultation", patient_id, current, history)
+        cached = llm_response_cache.get(cache_key)
+        if cached is not None:
+            print("DEBUG: Returning cached medical diagnosis")
+            return jsonify(cached)
+
         # Call Gemini AI
-        model = _get_gemini_model()
-        response = model.generate_content(prompt)
+        response = _gemini_generate(prompt)
         ai_text = response.text.strip()
         
         print(f"DEBUG: AI response: {ai_text[:200]}...")
@@ -1101,6 +1350,7 @@ Focus on practical, actionable medical advice. Be specific about the conditions
                 json_str = json_match.group()
                 ai_diagnosis = json.loads(json_str)
                 print("DEBUG: Successfully parsed medical diagnosis JSON")
+                llm_response_cache.set(cache_key, ai_diagnosis, patient_id=_normalize_patient_id(patient_id))
                 return jsonify(ai_diagnosis)
             else:
                 raise ValueError("No JSON found in response")
@@ -1160,6 +1410,7 @@ Focus on practical, actionable medical advice. Be specific about the conditions
                 ],
                 "raw_ai_response": ai_text
             }
+            # Not cached: the next request retries Gemini instead of replaying the fallback
             return jsonify(fallback_diagnosis)
             
     except Exception as e:
@@ -1233,7 +1484,6 @@ def api_patient_inference():
             }), 500
         
         try:
-            model = _get_gemini_model()
             # Simple prompt for patient-facing chat
             prompt = f"""
 You are a helpful medical assistant for patients. Answer the patient's question clearly and compassionately.
@@ -1243,7 +1493,7 @@ Patient's question: {user_message}
 
 Provide a helpful, clear answer.
 """
-            response = model.generate_content(prompt)
+            response = _gemini_generate(prompt)
             result_text = (response.text or "").strip()
             
             return jsonify({
@@ -1263,8 +1513,7 @@ Provide a helpful, clear answer.
 @app.route("/test_gemini")
 def test_gemini():
     try:
-        model = _get_gemini_model()
-        response = model.generate_content("Say 'Gemini API works' in exactly 3 words.")
+        response = _gemini_generate("Say 'Gemini API works' in exactly 3 words.")
         return jsonify({"status": "success", "response": response.text})
     except Exception as e:
         # Include available models to aid debugging
@@ -1285,6 +1534,34 @@ def test_gemini():
             "available_models": models_info
         }), 500
 
+@app.route("/api/gemini_stats")
+def gemini_stats():
+    """Per-process Gemini model cache, response cache and executor statistics"""
+    return jsonify({
+        "model_cache": gemini_model_cache_stats(),
+        "response_cache": llm_response_cache.stats(),
+        "executor": get_llm_executor().stats(),
+    })
+
+@app.route("/api/rag_index_stats")
+def rag_index_stats():
+    """Background RAG indexing queue depth and this process's worker counters"""
+    try:
+        return jsonify({
+            "status": "success",
+            "queue": get_rag_index_queue_stats(),
+            "worker": rag_index_worker.stats(),
+        })
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+# Resolve the Gemini model once per process at startup
+if _has_gemini():
+    _warm_gemini_model_cache()
+
+# Drain the RAG index queue in the background so submissions don't wait on it
+rag_index_worker = start_rag_index_worker(app)
+
 # ------------------- Run Flask App -------------------
 if __name__ == "__main__":
     app.run(debug=True, port=5001)
@@ -0,0 +1,78 @@
+"""
+Local text embedders for RAG retrieval
+Embedders run offline (no network) and return L2-normalized float32 vectors.
+Another embedder can be plugged in with set_embedder() or RAG_EMBEDDER=module:attribute
+"""
+import importlib
+import math
+import os
+import re
+import zlib
+from collections import Counter
+import numpy as np
+
+RAG_EMBEDDING_DIM = int(os.getenv("RAG_EMBEDDING_DIM", "512"))
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+class HashingEmbedder:
+    """
+    Hashing-trick term-frequency vectors: words and word bigrams are hashed into
+    `dim` signed buckets with sublinear (1 + log tf) weighting. Needs no vocabulary
+    or training, so vectors stay comparable as documents are added.
+    """
+
+    def __init__(self, dim=RAG_EMBEDDING_DIM):
+        self.dim = dim
+        self.name = f"hashing-tf-{dim}"
+
+    def _features(self, text):
+        tokens = _TOKEN_RE.findall((text or "").lower())
+        return tokens + [f"{a}_{b}" for a, b in zip(tokens, tokens[1:])]
+
+    def embed(self, texts):
+        """Return an (len(texts), dim) float32 matrix with unit-length rows"""
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, count in Counter(self._features(text)).items():
+                # crc32 is stable across processes, unlike hash()
+                h = zlib.crc32(feature.encode("utf-8"))
+                sign = 1.0 if h & 0x80000000 else -1.0
+                matrix[row, h % self.dim] += sign * (1.0 + math.log(count))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+
+def pack_embedding(vector):
+    """Serialize a vector as little-endian float32 bytes"""
+    return np.asarray(vector, dtype="<f4").tobytes()
+
+
+def unpack_embedding(blob):
+    return np.frombuffer(blob, dtype="<f4")
+
+
+_embedder = None
+
+
+def set_embedder(embedder):
+    """Replace the process-wide embedder (needs .name, .dim and .embed(texts))"""
+    global _embedder
+    _embedder = embedder
+    return embedder
+
+
+def get_embedder():
+    global _embedder
+    if _embedder is None:
+        spec = os.getenv("RAG_EMBEDDER", "").strip()
+        if spec:
+            module_name, _, attribute = spec.partition(":")
+            factory = getattr(importlib.import_module(module_name), attribute)
+            # Accept a class or factory function as well as a ready instance
+            _embedder = factory() if isinstance(factory, type) or not hasattr(factory, "embed") else factory
+        else:
+            _embedder = HashingEmbedder()
+    return _embedder
@@ -0,0 +1,196 @@
+"""
+Event bus with a Server-Sent Events endpoint
+Write routes publish small deltas to topics; pharmacy, doctor and dashboard pages
+subscribe per role instead of polling the list endpoints every 30 seconds.
+Published events go through the bus_events table, so subscribers on every
+gunicorn worker see them: while a process has subscribers, one relay thread polls
+for new rows and fans them out, whatever the number of open streams.
+Streams hold a connection open, so run gunicorn with a threaded worker class
+(see Procfile): a sync worker serves nothing else while a tab is subscribed.
+"""
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import Response, jsonify
+from sse import SSE_HEADERS, format_sse
+from models import db, BusEvent
+from database import register_patient_write_listener
+
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "25"))
+# Streams are closed after this long; EventSource reconnects on its own, which
+# returns the worker thread and lets load balancers rebalance long-lived tabs
+SSE_MAX_STREAM_SECONDS = float(os.getenv("SSE_MAX_STREAM_SECONDS", "300"))
+SSE_SUBSCRIBER_QUEUE_SIZE = 100
+EVENT_POLL_SECONDS = float(os.getenv("EVENT_POLL_SECONDS", "1"))
+EVENT_RETENTION_SECONDS = 600  # outbox rows older than this are pruned by the relay
+
+# Topics each page subscribes to
+ROLE_TOPICS = {
+    "pharmacy": {"prescriptions", "pharmacy_messages"},
+    "doctor": {"video_calls"},
+    "dashboard": {"patients"},
+}
+
+
+class EventBus:
+    """Fan-out of published events to subscriber queues, keyed by topic"""
+
+    def __init__(self):
+        self._subscribers = {}  # topic -> set of queues
+        self._lock = threading.Lock()
+        self._published = 0
+        self._dropped = 0
+        self._app = None
+        self._relay_running = False
+        self._last_event_id = 0
+
+    def attach(self, app):
+        """Use app's database for the cross-process outbox"""
+        self._app = app
+
+    def subscribe(self, topics):
+        q = queue.Queue(maxsize=SSE_SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            for topic in topics:
+                self._subscribers.setdefault(topic, set()).add(q)
+            start_relay = self._app is not None and not self._relay_running
+            self._relay_running = self._relay_running or start_relay
+        if start_relay:
+            # Relay from the current end of the outbox; older events predate this subscriber
+            with self._app.app_context():
+                self._last_event_id = db.session.query(db.func.max(BusEvent.id)).scalar() or 0
+            threading.Thread(target=self._run_relay, name="event-bus-relay", daemon=True).start()
+        return q
+
+    def unsubscribe(self, q, topics):
+        with self._lock:
+            for topic in topics:
+                subscribers = self._subscribers.get(topic)
+                if subscribers:
+                    subscribers.discard(q)
+                    if not subscribers:
+                        del self._subscribers[topic]
+
+    def publish(self, topic, event, data):
+        """
+        Record an event in the outbox for the relays of every process. Call after the
+        write has committed: the outbox row is committed on the same session.
+        Without an attached app (or if the insert fails) it is delivered in-process only.
+        """
+        with self._lock:
+            self._published += 1
+        if self._app is not None:
+            try:
+                with self._app.app_context():
+                    db.session.add(BusEvent(topic=topic, event=event, data=json.dumps(data, default=str)))
+                    db.session.commit()
+                return
+            except Exception as e:
+                print(f"Could not record event {topic}/{event}, delivering locally: {e}")
+        self._deliver({"topic": topic, "event": event, "data": data})
+
+    def _run_relay(self):
+        """Poll the outbox for new events while this process has subscribers"""
+        last_prune = 0.0
+        while True:
+            time.sleep(EVENT_POLL_SECONDS)
+            with self._lock:
+                if not self._subscribers:
+                    self._relay_running = False
+                    return
+            try:
+                with self._app.app_context():
+                    newest = db.session.query(db.func.max(BusEvent.id)).scalar() or 0
+                    if newest < self._last_event_id:
+                        # Ids went backwards (outbox recreated): everything left in it is new
+                        self._last_event_id = 0
+                    rows = (db.session.query(BusEvent.id, BusEvent.topic, BusEvent.event, BusEvent.data)
+                            .filter(BusEvent.id > self._last_event_id).order_by(BusEvent.id).all())
+                    if time.monotonic() - last_prune > EVENT_RETENTION_SECONDS / 10:
+                        cutoff = datetime.utcnow() - timedelta(seconds=EVENT_RETENTION_SECONDS)
+                        BusEvent.query.filter(BusEvent.created_at < cutoff).delete()
+                        db.session.commit()
+                        last_prune = time.monotonic()
+            except Exception as e:
+                print(f"Event relay poll failed: {e}")
+                continue
+            for row in rows:
+                self._last_event_id = row.id
+                self._deliver({"topic": row.topic, "event": row.event,
+                               "data": json.loads(row.data) if row.data else None})
+
+    def _deliver(self, message):
+        """Queue a message for every local subscriber of its topic"""
+        with self._lock:
+            subscribers = list(self._subscribers.get(message["topic"], ()))
+        for q in subscribers:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                # A stalled client should not block writers; it resyncs on reconnect
+                with self._lock:
+                    self._dropped += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "topics": {topic: len(subs) for topic, subs in self._subscribers.items()},
+                "published": self._published,
+                "dropped": self._dropped,
+                "relay_running": self._relay_running,
+                "last_event_id": self._last_event_id,
+            }
+
+
+event_bus = EventBus()
+
+
+def publish(topic, event, data):
+    event_bus.publish(topic, event, data)
+
+
+def event_stream(topics):
+    """Yield SSE messages for topics until the stream's lifetime runs out"""
+    q = event_bus.subscribe(topics)
+    try:
+        yield "retry: 3000\n\n"
+        yield format_sse({"topics": sorted(topics)}, event="ready")
+        deadline = time.monotonic() + SSE_MAX_STREAM_SECONDS
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                message = q.get(timeout=min(SSE_HEARTBEAT_SECONDS, remaining))
+            except queue.Empty:
+                # Comment line keeps proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+                continue
+            yield format_sse(message, event=message["event"])
+    finally:
+        event_bus.unsubscribe(q, topics)
+
+
+def register_event_routes(app):
+    """Register the SSE subscription endpoint"""
+    event_bus.attach(app)
+
+    @app.route("/api/events/<role>")
+    def api_events(role):
+        topics = ROLE_TOPICS.get(role)
+        if topics is None:
+            return jsonify({"status": "error", "message": f"Unknown role: {role}"}), 404
+        # No stream_with_context: the stream never touches the DB, so it holds no session
+        return Response(event_stream(topics), mimetype="text/event-stream", headers=SSE_HEADERS)
+
+    @app.route("/api/events_stats")
+    def api_events_stats():
+        return jsonify({"status": "success", "event_bus": event_bus.stats()})
+
+
+register_patient_write_listener(
+    lambda patient_id: publish("patients", "patient_updated", {"patient_id": patient_id})
+)
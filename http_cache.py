@@ -0,0 +1,55 @@
+"""
+Conditional GET support for list endpoints
+ETags are derived from per-collection version counters, so an unchanged
+collection is answered with 304 before any rows are loaded or serialized
+"""
+import hashlib
+from functools import wraps
+from flask import request, make_response
+from database import get_collection_versions
+
+
+def collection_etag(*collections, vary=()):
+    """
+    ETag value covering the collections' versions, the request's query string and
+    the request headers named in vary (those that select the representation)
+    """
+    versions = get_collection_versions(*collections)
+    tag = "-".join(f"{name}.{versions.get(name, 0)}" for name in collections)
+    selectors = request.query_string + b"".join(
+        b"\n" + request.headers.get(header, "").encode() for header in vary)
+    if selectors:
+        tag += "-" + hashlib.md5(selectors).hexdigest()[:8]
+    return tag
+
+
+def conditional_get(*collections, vary=()):
+    """
+    Decorator: answer 304 when If-None-Match matches, otherwise tag the 200 response.
+    vary names request headers that change the response body (e.g. Accept); they
+    are folded into the ETag and listed in the Vary header
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                etag = collection_etag(*collections, vary=vary)
+            except Exception as e:
+                print(f"Could not compute ETag for {request.path}: {e}")
+                return view(*args, **kwargs)
+            
+            if request.if_none_match.contains_weak(etag):
+                response = make_response("", 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            # Weak: the body is equivalent, not byte-identical (jsonify key order, compression)
+            response.set_etag(etag, weak=True)
+            for header in vary:
+                response.vary.add(header)
+            # Browsers must revalidate every time, which is what makes the 304 path useful
+            response.headers["Cache-Control"] = "no-cache"
+            return response
+        return wrapper
+    return decorator
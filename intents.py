@@ -0,0 +1,201 @@
+"""
+Keyword intent detection for the rule-based chat replies
+Each intent table maps an intent name to its trigger phrases. A table is compiled
+into one regex (the phrases factored into a character trie), so a message is
+scanned once for every intent. Matches are whole words, so short triggers no
+longer fire inside other words ("hi" in "history").
+A trailing * makes a phrase a prefix ("insight*" also matches "insights").
+
+Benchmark against the previous chained substring scans (it also checks that the
+matcher agrees with each phrase matched as its own regex):
+    python intents.py --repeat 2000
+"""
+import argparse
+import re
+import time
+from functools import lru_cache
+
+# Doctor chat in dpp.py (_generate_grounded_reply / _generate_grounded_packet)
+DOCTOR_CHAT_INTENTS = {
+    "greeting": ["hi", "hello", "hey", "good morning", "good evening", "good afternoon"],
+    "summary": ["patient info*", "patient details", "summary", "overview"],
+    "bp": ["bp", "blood pressure"],
+    "hr": ["hr", "heart rate", "pulse"],
+    "spo2": ["spo2", "oxygen"],
+    "assessment": ["diagnose", "analysis", "what's wrong", "assessment"],
+    "insights": ["insight*", "diagnose", "analysis", "assessment", "clinical", "disease*", "diagnosis",
+                 "differential", "condition*", "what could it be", "test*", "recommended tests",
+                 "precaution*", "red flags", "redflags"],
+    "open_question": ["what", "why", "how", "explain*", "interpret*", "risk*", "prognosis", "could it be",
+                      "diagnosis", "differential"],
+}
+
+# Patient chat fallback in app.py (generate_patient_health_response)
+PATIENT_HEALTH_INTENTS = {
+    "health_tips": ["health tips", "healthy", "wellness", "general health"],
+    "symptoms": ["symptom*", "feeling sick", "not well", "pain*"],
+    "see_doctor": ["see a doctor", "doctor*", "medical help", "appointment*"],
+    "medication": ["medication*", "medicine*", "pill*", "drug*"],
+    "diet": ["diet*", "nutrition", "food*", "eating"],
+    "exercise": ["exercis*", "workout*", "fitness", "physical activity"],
+    "mental_health": ["stress*", "anxiety", "depress*", "mental health", "mood*"],
+}
+
+# Doctor assistant in app.py (generate_ai_response)
+ASSISTANT_INTENTS = {
+    "greeting": ["hello", "hi", "hey"],
+    "patient_info": ["patient info*", "patient details", "patient data"],
+    "assessment": ["diagnose", "what's wrong", "analysis"],
+}
+
+
+def _phrase_pattern(phrase):
+    if phrase.endswith("*"):
+        return r"\b" + re.escape(phrase[:-1]) + r"\w*"
+    return r"\b" + re.escape(phrase) + r"\b"
+
+
+def _trie_pattern(phrases):
+    """
+    Alternation of phrases factored into a character trie, so the regex tests about
+    one branch per character instead of trying every phrase in turn. An exact phrase
+    ends in \\b and a prefix phrase in \\w*, inside its own branch, so when a longer
+    phrase runs into more word characters the match backtracks to a shorter phrase
+    ("see a doctors" falls back to "doctor*"). Longer branches are tried first.
+    """
+    trie = {}
+    for phrase in phrases:
+        node = trie
+        for ch in phrase.rstrip("*"):
+            node = node.setdefault(ch, {})
+        node["*" if phrase.endswith("*") else ""] = None
+
+    def build(node):
+        alternatives = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if child is not None]
+        if "*" in node:
+            alternatives.append(r"\w*")
+        elif "" in node:
+            alternatives.append(r"\b")
+        return alternatives[0] if len(alternatives) == 1 else "(?:" + "|".join(alternatives) + ")"
+
+    return build(trie)
+
+
+class IntentMatcher:
+    """All intents of a table that a message triggers, found in one regex pass"""
+
+    def __init__(self, table):
+        self.table = table
+        phrases = {phrase for triggers in table.values() for phrase in triggers}
+        self._triggers = [(intent, re.compile(_phrase_pattern(trigger)))
+                          for intent, triggers in table.items() for trigger in triggers]
+        # The lookahead yields the longest phrase starting at every word, overlapping
+        # matches included. Every other phrase found at that word lies inside it, so
+        # the match's intents are those of the phrases it contains ("recommended tests"
+        # also triggers "test*"); they are cached per matched text
+        self._regex = re.compile(r"\b(?=(" + _trie_pattern(phrases) + "))")
+        self._intents = lru_cache(maxsize=4096)(self._contained_intents)
+
+    def _contained_intents(self, matched):
+        return frozenset(intent for intent, pattern in self._triggers if pattern.search(matched))
+
+    def match(self, message):
+        text = (message or "").lower().replace("’", "'")
+        found = set()
+        for matched in self._regex.findall(text):
+            found |= self._intents(matched)
+        return frozenset(found)
+
+
+doctor_chat_matcher = IntentMatcher(DOCTOR_CHAT_INTENTS)
+patient_health_matcher = IntentMatcher(PATIENT_HEALTH_INTENTS)
+assistant_matcher = IntentMatcher(ASSISTANT_INTENTS)
+
+
+@lru_cache(maxsize=256)
+def doctor_chat_intents(message):
+    """Intents of a doctor chat message; cached because one turn asks several times"""
+    return doctor_chat_matcher.match(message)
+
+
+# ----- benchmark -----
+
+BENCHMARK_PROMPTS = [
+    "hi", "Hello doctor", "good morning, can you give me a summary of this patient?",
+    "What is the patient's blood pressure trend?", "show me the BP", "heart rate?",
+    "Is the pulse within range for this history of arrhythmia?", "spo2 and oxygen levels please",
+    "what's wrong with this patient", "Give me a clinical assessment and recommended tests",
+    "any red flags or precautions for this patient?", "explain the troponin result",
+    "Why is the cholesterol so high and what is the risk of MI?", "differential diagnosis for chest pain with fever",
+    "interpret the ECG findings: ST elevation in leads II, III, aVF", "could it be pneumonia?",
+    "what could it be given the symptoms and vitals", "list the lab results",
+    "patient details and overview of the previous visits", "How should we adjust the medication dose?",
+    "Summarize the history of present illness for this 64 year old male with hypertension and diabetes "
+    "who presented with three days of progressive dyspnea, orthopnea and bilateral leg swelling",
+    "what's the prognosis if we start beta blockers now and titrate over the next four weeks?",
+    "thanks", "ok", "this patient has a history of asthma, what tests would you recommend?",
+    "I have been feeling stressed and not well lately, which foods help?",
+]
+
+
+def _legacy_match(table, message):
+    """The previous approach: one any(substring) scan per intent"""
+    text = message.lower()
+    return frozenset(intent for intent, triggers in table.items()
+                     if any(trigger.rstrip("*") in text for trigger in triggers))
+
+
+def _reference_match(table, message):
+    """Each phrase as its own regex; what the compiled matcher must agree with"""
+    text = (message or "").lower().replace("’", "'")
+    return frozenset(intent for intent, triggers in table.items()
+                     if any(re.search(_phrase_pattern(trigger), text) for trigger in triggers))
+
+
+def _probe_messages(table):
+    """Phrases run into word characters, suffixes and each other, to catch lost fallbacks"""
+    texts = sorted({phrase.rstrip("*") for triggers in table.values() for phrase in triggers})
+    probes = []
+    for text in texts:
+        probes += [text, text + "s", text + "'s", "x" + text, f"see {text}s now"]
+        for other in texts:
+            probes += [f"{text} {other}", f"{text}{other}", f"{text}s {other}", f"{text} {other}s"]
+    return probes
+
+
+def benchmark(repeat=2000):
+    """Per-message cost of chained substring scans vs the compiled matcher"""
+    corpus = BENCHMARK_PROMPTS * repeat
+    tables = [("doctor_chat", DOCTOR_CHAT_INTENTS, doctor_chat_matcher),
+              ("patient_health", PATIENT_HEALTH_INTENTS, patient_health_matcher)]
+    for name, table, matcher in tables:
+        started = time.perf_counter()
+        for message in corpus:
+            _legacy_match(table, message)
+        legacy_us = (time.perf_counter() - started) / len(corpus) * 1e6
+        started = time.perf_counter()
+        for message in corpus:
+            matcher.match(message)
+        compiled_us = (time.perf_counter() - started) / len(corpus) * 1e6
+        print(f"{name:>15}: substring scans {legacy_us:.2f} us/msg, compiled {compiled_us:.2f} us/msg "
+              f"({legacy_us / compiled_us:.1f}x)")
+    for name, table, matcher in tables:
+        probes = BENCHMARK_PROMPTS + _probe_messages(table)
+        differ = [m for m in probes if matcher.match(m) != _reference_match(table, m)]
+        print(f"{name:>15}: {len(differ)}/{len(probes)} probes differ from per-phrase regexes")
+        for message in differ[:5]:
+            print(f"  {message!r}: {sorted(matcher.match(message))} vs {sorted(_reference_match(table, message))}")
+    misfires = [m for m in BENCHMARK_PROMPTS
+                if _legacy_match(DOCTOR_CHAT_INTENTS, m) != doctor_chat_matcher.match(m)]
+    print(f"prompts whose intents changed (substring misfires removed): {len(misfires)}/{len(BENCHMARK_PROMPTS)}")
+    for message in misfires:
+        legacy = _legacy_match(DOCTOR_CHAT_INTENTS, message)
+        current = doctor_chat_matcher.match(message)
+        print(f"  {message[:60]!r}: dropped {sorted(legacy - current)}, added {sorted(current - legacy)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the compiled intent matcher")
+    parser.add_argument("--repeat", type=int, default=2000, help="passes over the prompt corpus")
+    args = parser.parse_args()
+    benchmark(args.repeat)
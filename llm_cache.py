@@ -0,0 +1,97 @@
+"""
+In-process cache for Gemini responses
+Entries are keyed by a fingerprint of the prompt inputs, expire after a TTL,
+and are evicted least-recently-used once the size cap is reached
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def fingerprint(*parts):
+    """Stable SHA-256 of JSON-serializable prompt inputs"""
+    payload = json.dumps(parts, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LLMResponseCache:
+    """Thread-safe LRU cache with per-entry TTL and per-patient invalidation"""
+
+    def __init__(self, max_entries=512, ttl_seconds=900):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (expires_at, patient_id, value)
+        self._keys_by_patient = {}  # patient_id -> set of keys
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def get(self, key):
+        """Return the cached value or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            if entry[0] <= time.monotonic():
+                self._remove(key)
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[2]
+
+    def set(self, key, value, patient_id=None):
+        """Store value, evicting the least recently used entries past max_entries"""
+        if self.max_entries <= 0 or self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, patient_id, value)
+            if patient_id:
+                self._keys_by_patient.setdefault(patient_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._evictions += 1
+
+    def invalidate_patient(self, patient_id):
+        """Drop every entry stored for patient_id"""
+        with self._lock:
+            keys = self._keys_by_patient.pop(patient_id, set())
+            for key in keys:
+                self._entries.pop(key, None)
+            self._invalidations += len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_patient.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'invalidations': self._invalidations,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else None,
+            }
+
+    def _remove(self, key):
+        _, patient_id, _ = self._entries.pop(key)
+        if patient_id:
+            keys = self._keys_by_patient.get(patient_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_patient[patient_id]
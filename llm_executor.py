@@ -0,0 +1,112 @@
+"""
+Bounded thread pool for Gemini calls
+Caps concurrent upstream requests per process, applies a deadline to each call,
+and coalesces identical in-flight requests into a single upstream call
+"""
+import os
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_CALL_TIMEOUT = float(os.getenv("LLM_CALL_TIMEOUT", "60"))  # seconds
+
+
+class LLMTimeoutError(TimeoutError):
+    """Raised when a Gemini call does not finish before its deadline"""
+
+
+class LLMExecutor:
+    """Runs LLM calls on a fixed-size pool; callers wait on a future"""
+
+    def __init__(self, max_workers=LLM_MAX_CONCURRENCY, default_timeout=LLM_CALL_TIMEOUT):
+        self.max_workers = max_workers
+        self.default_timeout = default_timeout
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+        # Upstream slots shared by pooled calls and streams, so both count against the cap
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self._inflight = {}  # coalescing key -> Future
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._coalesced = 0
+        self._timeouts = 0
+        self._streaming = 0
+
+    def submit(self, key, fn, *args, **kwargs):
+        """Schedule fn(*args, **kwargs), or join the in-flight call with the same key"""
+        with self._lock:
+            if key is not None:
+                future = self._inflight.get(key)
+                if future is not None:
+                    self._coalesced += 1
+                    return future
+            future = self._pool.submit(self._run_in_slot, fn, *args, **kwargs)
+            self._submitted += 1
+            if key is not None:
+                self._inflight[key] = future
+        if key is not None:
+            # Registered outside the lock: the callback runs inline if the call already finished
+            future.add_done_callback(lambda f, k=key: self._forget(k, f))
+        return future
+
+    def run(self, key, fn, *args, timeout=None, **kwargs):
+        """Submit and wait for the result, raising LLMTimeoutError after the deadline"""
+        timeout = self.default_timeout if timeout is None else timeout
+        future = self.submit(key, fn, *args, **kwargs)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self._timeouts += 1
+            raise LLMTimeoutError(f"LLM call exceeded {timeout:g}s deadline")
+
+    @contextmanager
+    def slot(self, timeout=None):
+        """Hold an upstream slot for the duration of a call made outside the pool (e.g. a stream)"""
+        timeout = self.default_timeout if timeout is None else timeout
+        if not self._slots.acquire(timeout=timeout):
+            with self._lock:
+                self._timeouts += 1
+            raise LLMTimeoutError(f"No LLM slot free within {timeout:g}s")
+        with self._lock:
+            self._streaming += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._streaming -= 1
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "default_timeout": self.default_timeout,
+                "in_flight": len(self._inflight),
+                "streaming": self._streaming,
+                "submitted": self._submitted,
+                "coalesced": self._coalesced,
+                "timeouts": self._timeouts,
+            }
+
+    def _run_in_slot(self, fn, *args, **kwargs):
+        with self._slots:
+            return fn(*args, **kwargs)
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_llm_executor():
+    """Process-wide executor, created on first use so forked workers get their own pool"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = LLMExecutor()
+        return _executor
@@ -1,14 +1,151 @@
 """
 Migration script to convert JSON data to SQL database
-Run this once to migrate existing patients.json, patients_history.json, and chat_sessions.json to SQL
+Run this once to migrate existing patients.json, patients_history.json, chat_sessions.json
+and the appointment, prescription, video call, pharmacy message, user and emergency alert files to SQL
 """
 import json
 import os
 from flask import Flask
-from models import db
-from database import init_db, save_patient_data, save_patient_history, get_or_create_chat_session, save_chat_message
+from models import db, Appointment, Prescription, VideoCallRequest, PharmacyMessage, User, EmergencyAlert
+from database import (init_db, save_patient_data, save_patient_history, get_or_create_chat_session, save_chat_message,
+                      bump_collection_version, COLLECTIONS)
 from datetime import datetime
 
+def _parse_datetime(value):
+    """Parse an ISO timestamp from the JSON files; None if missing or invalid"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+def _appointment_from_json(record):
+    return Appointment(
+        appointment_id=record['id'],
+        patient_id=record.get('patient_id'),
+        patient_name=record.get('patient_name'),
+        doctor_name=record.get('doctor_name'),
+        appointment_date=record.get('appointment_date'),
+        appointment_time=record.get('appointment_time'),
+        duration=str(record['duration']) if record.get('duration') is not None else None,
+        notes=record.get('notes'),
+        status=record.get('status') or 'scheduled',
+        patient_notified=bool(record.get('patient_notified', False)),
+        reassigned=bool(record.get('reassigned', False)),
+        reassigned_at=_parse_datetime(record.get('reassigned_at')),
+        created_at=_parse_datetime(record.get('created_at')) or datetime.now(),
+        updated_at=_parse_datetime(record.get('updated_at'))
+    )
+
+def _prescription_from_json(record):
+    return Prescription(
+        prescription_id=record['id'],
+        patient_id=record.get('patient_id'),
+        patient_name=record.get('patient_name'),
+        doctor_name=record.get('doctor_name'),
+        medicines_json=json.dumps(record.get('medicines', [])),
+        notes=record.get('notes'),
+        priority=record.get('priority') or 'normal',
+        status=record.get('status') or 'pending',
+        pharmacist_name=record.get('pharmacist_name'),
+        created_at=_parse_datetime(record.get('created_at')) or datetime.now(),
+        updated_at=_parse_datetime(record.get('updated_at')),
+        preparing_at=_parse_datetime(record.get('preparing_at')),
+        prepared_at=_parse_datetime(record.get('prepared_at')),
+        delivered_at=_parse_datetime(record.get('delivered_at'))
+    )
+
+def _video_call_from_json(record):
+    return VideoCallRequest(
+        request_id=record['id'],
+        patient_id=record.get('patient_id'),
+        patient_name=record.get('patient_name'),
+        reason=record.get('reason'),
+        status=record.get('status') or 'pending',
+        read=bool(record.get('read', False)),
+        created_at=_parse_datetime(record.get('requested_at')) or datetime.now()
+    )
+
+def _pharmacy_message_from_json(record):
+    return PharmacyMessage(
+        message_id=record['id'],
+        from_name=record.get('from_name'),
+        message=record.get('message') or '',
+        prescription_id=record.get('prescription_id'),
+        read=bool(record.get('read', False)),
+        created_at=_parse_datetime(record.get('created_at')) or datetime.now()
+    )
+
+def _user_from_json(record):
+    return User(
+        account_id=record['id'],
+        user_id=record.get('user_id'),
+        name=record.get('name'),
+        email=record.get('email'),
+        phone=record.get('phone'),
+        role=record.get('role'),
+        specialization=record.get('specialization'),
+        status=record.get('status') or 'active',
+        registered_at=_parse_datetime(record.get('registered_at')) or datetime.now(),
+        last_login=_parse_datetime(record.get('last_login')),
+        updated_at=_parse_datetime(record.get('updated_at'))
+    )
+
+def _emergency_alert_from_json(record):
+    return EmergencyAlert(
+        alert_id=record['id'],
+        patient_id=record.get('patient_id'),
+        patient_name=record.get('patient_name'),
+        alert_type=record.get('alert_type'),
+        condition=record.get('condition'),
+        vitals_json=json.dumps(record.get('vitals') or {}),
+        symptoms=record.get('symptoms'),
+        ai_assessment=record.get('ai_assessment'),
+        severity=record.get('severity') or 'low',
+        status=record.get('status') or 'pending',
+        forwarded_to_hospital=bool(record.get('forwarded_to_hospital', False)),
+        hospital_name=record.get('hospital_name'),
+        forwarded_at=_parse_datetime(record.get('forwarded_at')),
+        resolved_at=_parse_datetime(record.get('resolved_at')),
+        created_at=_parse_datetime(record.get('created_at')) or datetime.now()
+    )
+
+# (file name, model, external ID column, row builder) for the flat-file stores
+RECORD_FILES = [
+    ('appointments.json', Appointment, 'appointment_id', _appointment_from_json),
+    ('prescriptions.json', Prescription, 'prescription_id', _prescription_from_json),
+    ('video_calls.json', VideoCallRequest, 'request_id', _video_call_from_json),
+    ('pharmacy_messages.json', PharmacyMessage, 'message_id', _pharmacy_message_from_json),
+    ('users.json', User, 'account_id', _user_from_json),
+    ('emergency_alerts.json', EmergencyAlert, 'alert_id', _emergency_alert_from_json),
+]
+
+def migrate_records_file(file_path, model, id_column, build_row, stats):
+    """Import one JSON list file into its table, skipping IDs that already exist"""
+    with open(file_path, 'r') as f:
+        records = json.load(f)
+    
+    if isinstance(records, dict):
+        records = [records]
+    
+    existing = {row[0] for row in db.session.query(getattr(model, id_column)).all()}
+    migrated = 0
+    for record in records:
+        try:
+            if not record.get('id') or record['id'] in existing:
+                continue
+            db.session.add(build_row(record))
+            existing.add(record['id'])
+            migrated += 1
+        except Exception as e:
+            error_msg = f"Error migrating {os.path.basename(file_path)} record {record.get('id', 'unknown')}: {str(e)}"
+            print(f"  ✗ {error_msg}")
+            stats['errors'].append(error_msg)
+    
+    db.session.commit()
+    return migrated
+
 def migrate_json_to_sql():
     """Migrate all JSON data to SQL database"""
     
@@ -24,6 +161,7 @@ def migrate_json_to_sql():
         'history_records': 0,
         'chat_sessions': 0,
         'chat_messages': 0,
+        'records': {},
         'errors': []
     }
     
@@ -35,7 +173,7 @@ def migrate_json_to_sql():
         # 1. Migrate patients.json
         patients_file = os.path.join(base_dir, 'patients.json')
         if os.path.exists(patients_file):
-            print("\n[1/3] Migrating patients.json...")
+            print("\n[1/9] Migrating patients.json...")
             try:
                 with open(patients_file, 'r') as f:
                     patients_data = json.load(f)
@@ -62,12 +200,12 @@ def migrate_json_to_sql():
                 print(f"  ✗ {error_msg}")
                 stats['errors'].append(error_msg)
         else:
-            print("\n[1/3] patients.json not found - skipping")
+            print("\n[1/9] patients.json not found - skipping")
         
         # 2. Migrate patients_history.json
         history_file = os.path.join(base_dir, 'patients_history.json')
         if os.path.exists(history_file):
-            print("\n[2/3] Migrating patients_history.json...")
+            print("\n[2/9] Migrating patients_history.json...")
             try:
                 with open(history_file, 'r') as f:
                     history_data = json.load(f)
@@ -94,12 +232,12 @@ def migrate_json_to_sql():
                 print(f"  ✗ {error_msg}")
                 stats['errors'].append(error_msg)
         else:
-            print("\n[2/3] patients_history.json not found - skipping")
+            print("\n[2/9] patients_history.json not found - skipping")
         
         # 3. Migrate chat_sessions.json
         chat_file = os.path.join(base_dir, 'chat_sessions.json')
         if os.path.exists(chat_file):
-            print("\n[3/3] Migrating chat_sessions.json...")
+            print("\n[3/9] Migrating chat_sessions.json...")
             try:
                 with open(chat_file, 'r') as f:
                     chat_sessions = json.load(f)
@@ -138,7 +276,29 @@ def migrate_json_to_sql():
                 print(f"  ✗ {error_msg}")
                 stats['errors'].append(error_msg)
         else:
-            print("\n[3/3] chat_sessions.json not found - skipping")
+            print("\n[3/9] chat_sessions.json not found - skipping")
+        
+        # 4-9. Migrate appointment, prescription, video call, pharmacy message, user and alert files
+        for step, (filename, model, id_column, build_row) in enumerate(RECORD_FILES, start=4):
+            file_path = os.path.join(base_dir, filename)
+            if not os.path.exists(file_path):
+                print(f"\n[{step}/9] {filename} not found - skipping")
+                continue
+            
+            print(f"\n[{step}/9] Migrating {filename}...")
+            try:
+                migrated = migrate_records_file(file_path, model, id_column, build_row, stats)
+                stats['records'][filename] = migrated
+                print(f"  Total records migrated: {migrated}")
+            except Exception as e:
+                db.session.rollback()
+                error_msg = f"Error reading {filename}: {str(e)}"
+                print(f"  ✗ {error_msg}")
+                stats['errors'].append(error_msg)
+        
+        # Invalidate ETags held by clients of the list endpoints
+        bump_collection_version(*COLLECTIONS)
+        db.session.commit()
         
         # Print summary
         print("\n" + "=" * 60)
@@ -148,6 +308,8 @@ def migrate_json_to_sql():
         print(f"History records migrated: {stats['history_records']}")
         print(f"Chat sessions migrated:   {stats['chat_sessions']}")
         print(f"Chat messages migrated:   {stats['chat_messages']}")
+        for filename, migrated in stats['records'].items():
+            print(f"{filename + ' migrated:':<26}{migrated}")
         print(f"Errors encountered:       {len(stats['errors'])}")
         
         if stats['errors']:
@@ -27,11 +27,24 @@ class Patient(db.Model):
     lab_results = db.relationship('LabResult', backref='patient', lazy='dynamic', cascade='all, delete-orphan')
     history_records = db.relationship('PatientHistory', backref='patient', lazy='dynamic', cascade='all, delete-orphan')
     chat_sessions = db.relationship('ChatSession', backref='patient', lazy='dynamic', cascade='all, delete-orphan')
+    latest = db.relationship('PatientLatest', backref='patient', uselist=False, lazy='joined', cascade='all, delete-orphan')
     
-    def to_dict(self):
-        """Convert patient record to dictionary"""
-        latest_vitals = self.vitals.order_by(Vitals.timestamp.desc()).first()
-        latest_labs = self.lab_results.order_by(LabResult.timestamp.desc()).first()
+    def to_dict(self, latest_vitals=None, latest_labs=None, preloaded=False):
+        """Convert patient record to dictionary
+        
+        Uses the patient_latest snapshot when present. Bulk loaders pass the
+        newest Vitals/LabResult rows with preloaded=True so no per-patient
+        queries are issued.
+        """
+        if self.latest is not None:
+            vitals = self.latest.vitals_dict()
+            labs = self.latest.labs_dict()
+        else:
+            if not preloaded:
+                latest_vitals = self.vitals.order_by(Vitals.timestamp.desc()).first()
+                latest_labs = self.lab_results.order_by(LabResult.timestamp.desc()).first()
+            vitals = latest_vitals.to_dict() if latest_vitals else {}
+            labs = latest_labs.to_dict() if latest_labs else {}
         
         return {
             'patient_id': self.patient_id,
@@ -39,9 +52,10 @@ class Patient(db.Model):
             'age': self.age,
             'gender': self.gender,
             'symptoms': self.symptoms,
-            'vitals': latest_vitals.to_dict() if latest_vitals else {},
-            'lab_results': latest_labs.to_dict() if latest_labs else {},
-            'timestamp': self.timestamp.isoformat() if self.timestamp else None
+            'vitals': vitals,
+            'lab_results': labs,
+            'timestamp': self.timestamp.isoformat() if self.timestamp else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
     
     def __repr__(self):
@@ -122,6 +136,36 @@ class LabResult(db.Model):
         return f'<LabResult {self.id} for Patient {self.patient_db_id}>'
 
 
+class PatientLatest(db.Model):
+    """Denormalized latest vitals and labs per patient, maintained on write"""
+    __tablename__ = 'patient_latest'
+    
+    patient_db_id = db.Column(db.Integer, db.ForeignKey('patients.id'), primary_key=True)
+    vitals_json = db.Column(db.Text)  # JSON string of latest Vitals.to_dict()
+    labs_json = db.Column(db.Text)  # JSON string of latest LabResult.to_dict()
+    # Pre-parsed numeric values for threshold checks
+    systolic = db.Column(db.Float)
+    diastolic = db.Column(db.Float)
+    hr = db.Column(db.Float)
+    spo2 = db.Column(db.Float)
+    troponin = db.Column(db.Float)
+    cholesterol = db.Column(db.Float)
+    vitals_timestamp = db.Column(db.DateTime)
+    labs_timestamp = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    
+    def vitals_dict(self):
+        """Latest vitals in Vitals.to_dict() format"""
+        return json.loads(self.vitals_json) if self.vitals_json else {}
+    
+    def labs_dict(self):
+        """Latest lab results in LabResult.to_dict() format"""
+        return json.loads(self.labs_json) if self.labs_json else {}
+    
+    def __repr__(self):
+        return f'<PatientLatest for Patient {self.patient_db_id}>'
+
+
 class PatientHistory(db.Model):
     """Patient historical records"""
     __tablename__ = 'patient_history'
@@ -160,6 +204,8 @@ class ChatSession(db.Model):
     session_id = db.Column(db.String(100), unique=True, nullable=False, index=True)
     patient_db_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=True, index=True)
     patient_id = db.Column(db.String(50), index=True)  # External patient ID
+    summary = db.Column(db.Text)  # Running summary of messages up to summary_through (see chat_context.py)
+    summary_through = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     
@@ -185,9 +231,13 @@ class ChatSession(db.Model):
 class ChatMessage(db.Model):
     """Individual chat messages within a session"""
     __tablename__ = 'chat_messages'
+    __table_args__ = (
+        # Serves "latest N messages of a session" from the index (see get_chat_history)
+        db.Index('ix_chat_messages_session_timestamp', 'session_db_id', 'timestamp'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    session_db_id = db.Column(db.Integer, db.ForeignKey('chat_sessions.id'), nullable=False, index=True)
+    session_db_id = db.Column(db.Integer, db.ForeignKey('chat_sessions.id'), nullable=False)
     role = db.Column(db.String(20), nullable=False)  # 'user' or 'assistant'
     content = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
@@ -207,15 +257,25 @@ class ChatMessage(db.Model):
 class RAGDocument(db.Model):
     """Store documents for RAG (Retrieval-Augmented Generation)"""
     __tablename__ = 'rag_documents'
+    __table_args__ = (
+        # One current document per (type, patient, source); rows without a source_key are not deduplicated
+        db.Index('uq_rag_documents_source', 'doc_type', 'patient_db_id', 'source_key', unique=True),
+        # NULLs never collide in the index above, so documents without a patient need their own
+        db.Index('uq_rag_documents_global_source', 'doc_type', 'source_key', unique=True,
+                 sqlite_where=db.text('patient_db_id IS NULL'),
+                 postgresql_where=db.text('patient_db_id IS NULL')),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     doc_type = db.Column(db.String(50), nullable=False, index=True)  # 'patient_data', 'medical_knowledge', etc.
     patient_db_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=True, index=True)
+    source_key = db.Column(db.String(100))  # e.g. 'patient_summary'; set for documents that are upserted
     content = db.Column(db.Text, nullable=False)
     metadata_json = db.Column(db.Text)  # JSON string for additional metadata
-    embedding = db.Column(db.Text)  # Store embeddings as JSON array for vector search (optional)
+    embedding = db.Column(db.LargeBinary)  # Packed float32 vector (see embeddings.py)
+    embedding_model = db.Column(db.String(100))  # Embedder that produced the vector
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False, index=True)
     
     def to_dict(self):
         """Convert RAG document to dictionary"""
@@ -223,6 +283,7 @@ class RAGDocument(db.Model):
             'id': self.id,
             'doc_type': self.doc_type,
             'patient_db_id': self.patient_db_id,
+            'source_key': self.source_key,
             'content': self.content,
             'metadata': json.loads(self.metadata_json) if self.metadata_json else {},
             'created_at': self.created_at.isoformat() if self.created_at else None,
@@ -231,3 +292,296 @@ class RAGDocument(db.Model):
     
     def __repr__(self):
         return f'<RAGDocument {self.id} type={self.doc_type}>'
+
+
+class RAGIndexJob(db.Model):
+    """Pending RAG reindex for one patient; repeated submissions share a single row"""
+    __tablename__ = 'rag_index_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    patient_id = db.Column(db.String(50), unique=True, nullable=False)
+    status = db.Column(db.String(20), default='pending', nullable=False, index=True)  # pending, running, failed
+    requests = db.Column(db.Integer, default=1, nullable=False)  # bumped on each enqueue, checked on completion
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    last_error = db.Column(db.Text)
+    enqueued_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<RAGIndexJob {self.patient_id} {self.status}>'
+
+
+class IdSequence(db.Model):
+    """Next free number per ID prefix (RX, APT, MSG, VC), leased out in blocks"""
+    __tablename__ = 'id_sequences'
+    
+    name = db.Column(db.String(20), primary_key=True)
+    next_value = db.Column(db.Integer, nullable=False)
+    
+    def __repr__(self):
+        return f'<IdSequence {self.name}={self.next_value}>'
+
+
+class CollectionVersion(db.Model):
+    """Change counter per collection, bumped in the same transaction as each write"""
+    __tablename__ = 'collection_versions'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+    
+    def __repr__(self):
+        return f'<CollectionVersion {self.name}={self.version}>'
+
+
+class BusEvent(db.Model):
+    """Outbox of published events; every process's event bus relays new rows to its subscribers"""
+    __tablename__ = 'bus_events'
+    # Relays track the last id they delivered, so ids must never be reused once the
+    # outbox is pruned empty (SQLite reuses rowids without AUTOINCREMENT)
+    __table_args__ = {'sqlite_autoincrement': True}
+    
+    id = db.Column(db.Integer, primary_key=True)
+    topic = db.Column(db.String(50), nullable=False)
+    event = db.Column(db.String(50), nullable=False)
+    data = db.Column(db.Text)  # JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f'<BusEvent {self.id} {self.topic}/{self.event}>'
+
+
+class DashboardCounter(db.Model):
+    """Running /api/dashboard aggregate, adjusted in the same transaction as each patient write"""
+    __tablename__ = 'dashboard_counters'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<DashboardCounter {self.name}={self.value}>'
+
+
+class Appointment(db.Model):
+    """Doctor-patient appointments"""
+    __tablename__ = 'appointments'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    appointment_id = db.Column(db.String(20), unique=True, nullable=False, index=True)  # e.g., "APT0001"
+    patient_id = db.Column(db.String(50), index=True)  # External patient ID
+    patient_name = db.Column(db.String(100))
+    doctor_name = db.Column(db.String(100))
+    appointment_date = db.Column(db.String(10), index=True)  # "YYYY-MM-DD"
+    appointment_time = db.Column(db.String(10))  # "HH:MM"
+    duration = db.Column(db.String(10))  # minutes
+    notes = db.Column(db.Text)
+    status = db.Column(db.String(20), default='scheduled', nullable=False, index=True)  # scheduled, completed, cancelled
+    patient_notified = db.Column(db.Boolean, default=False, nullable=False)
+    reassigned = db.Column(db.Boolean, default=False, nullable=False)
+    reassigned_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    updated_at = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        """Convert appointment to dictionary"""
+        return {
+            'id': self.appointment_id,
+            'patient_id': self.patient_id,
+            'patient_name': self.patient_name,
+            'doctor_name': self.doctor_name,
+            'appointment_date': self.appointment_date,
+            'appointment_time': self.appointment_time,
+            'duration': self.duration,
+            'notes': self.notes,
+            'status': self.status,
+            'patient_notified': self.patient_notified,
+            'reassigned': self.reassigned,
+            'reassigned_at': self.reassigned_at.isoformat() if self.reassigned_at else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+    
+    def __repr__(self):
+        return f'<Appointment {self.appointment_id}>'
+
+
+class Prescription(db.Model):
+    """Prescriptions sent from doctors to the pharmacy"""
+    __tablename__ = 'prescriptions'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    prescription_id = db.Column(db.String(20), unique=True, nullable=False, index=True)  # e.g., "RX0001"
+    patient_id = db.Column(db.String(50), index=True)  # External patient ID
+    patient_name = db.Column(db.String(100))
+    doctor_name = db.Column(db.String(100))
+    medicines_json = db.Column(db.Text)  # JSON array of {name, dosage, frequency, duration, instructions}
+    notes = db.Column(db.Text)
+    priority = db.Column(db.String(20), default='normal', nullable=False)  # urgent, high, normal, low
+    status = db.Column(db.String(20), default='pending', nullable=False, index=True)  # pending, preparing, ready, delivered
+    pharmacist_name = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    updated_at = db.Column(db.DateTime)
+    preparing_at = db.Column(db.DateTime)
+    prepared_at = db.Column(db.DateTime)
+    delivered_at = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        """Convert prescription to dictionary"""
+        return {
+            'id': self.prescription_id,
+            'patient_id': self.patient_id,
+            'patient_name': self.patient_name,
+            'doctor_name': self.doctor_name,
+            'medicines': json.loads(self.medicines_json) if self.medicines_json else [],
+            'notes': self.notes,
+            'priority': self.priority,
+            'status': self.status,
+            'pharmacist_name': self.pharmacist_name,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'preparing_at': self.preparing_at.isoformat() if self.preparing_at else None,
+            'prepared_at': self.prepared_at.isoformat() if self.prepared_at else None,
+            'delivered_at': self.delivered_at.isoformat() if self.delivered_at else None
+        }
+    
+    def __repr__(self):
+        return f'<Prescription {self.prescription_id}>'
+
+
+class VideoCallRequest(db.Model):
+    """Patient requests for a video call with a doctor"""
+    __tablename__ = 'video_calls'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    request_id = db.Column(db.String(20), unique=True, nullable=False, index=True)  # e.g., "VC0001"
+    patient_id = db.Column(db.String(50), index=True)  # External patient ID
+    patient_name = db.Column(db.String(100))
+    reason = db.Column(db.Text)
+    status = db.Column(db.String(20), default='pending', nullable=False, index=True)
+    read = db.Column(db.Boolean, default=False, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    
+    def to_dict(self):
+        """Convert video call request to dictionary"""
+        return {
+            'id': self.request_id,
+            'patient_id': self.patient_id,
+            'patient_name': self.patient_name,
+            'reason': self.reason,
+            'status': self.status,
+            'requested_at': self.created_at.isoformat() if self.created_at else None,
+            'read': self.read
+        }
+    
+    def __repr__(self):
+        return f'<VideoCallRequest {self.request_id}>'
+
+
+class PharmacyMessage(db.Model):
+    """Messages from doctors to the pharmacy"""
+    __tablename__ = 'pharmacy_messages'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    message_id = db.Column(db.String(20), unique=True, nullable=False, index=True)  # e.g., "MSG0001"
+    from_name = db.Column(db.String(100))
+    message = db.Column(db.Text, nullable=False)
+    prescription_id = db.Column(db.String(20), index=True)  # Related prescription, if any
+    read = db.Column(db.Boolean, default=False, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    
+    def to_dict(self):
+        """Convert pharmacy message to dictionary"""
+        return {
+            'id': self.message_id,
+            'from_name': self.from_name,
+            'message': self.message,
+            'prescription_id': self.prescription_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'read': self.read
+        }
+    
+    def __repr__(self):
+        return f'<PharmacyMessage {self.message_id}>'
+
+
+class User(db.Model):
+    """Registered platform users (patients, doctors, pharmacists)"""
+    __tablename__ = 'users'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.String(20), unique=True, nullable=False, index=True)  # e.g., "U0001"
+    user_id = db.Column(db.String(50), index=True)  # Role-specific ID, e.g. patient or doctor ID
+    name = db.Column(db.String(100))
+    email = db.Column(db.String(120))
+    phone = db.Column(db.String(30))
+    role = db.Column(db.String(20), index=True)  # patient, doctor, pharmacist
+    specialization = db.Column(db.String(100))
+    status = db.Column(db.String(20), default='active', nullable=False, index=True)
+    registered_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    last_login = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        """Convert user to dictionary"""
+        result = {
+            'id': self.account_id,
+            'user_id': self.user_id,
+            'name': self.name,
+            'email': self.email,
+            'phone': self.phone,
+            'role': self.role,
+            'status': self.status,
+            'registered_at': self.registered_at.isoformat() if self.registered_at else None,
+            'last_login': self.last_login.isoformat() if self.last_login else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+        if self.specialization:
+            result['specialization'] = self.specialization
+        return result
+    
+    def __repr__(self):
+        return f'<User {self.account_id} role={self.role}>'
+
+
+class EmergencyAlert(db.Model):
+    """Emergency alerts raised for patients and escalated by admins"""
+    __tablename__ = 'emergency_alerts'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    alert_id = db.Column(db.String(20), unique=True, nullable=False, index=True)  # e.g., "ALERT0001"
+    patient_id = db.Column(db.String(50), index=True)  # External patient ID
+    patient_name = db.Column(db.String(100))
+    alert_type = db.Column(db.String(20))
+    condition = db.Column(db.String(200))
+    vitals_json = db.Column(db.Text)  # JSON string of vitals at alert time
+    symptoms = db.Column(db.Text)
+    ai_assessment = db.Column(db.Text)
+    severity = db.Column(db.String(20), default='low', nullable=False)  # critical, high, medium, low
+    status = db.Column(db.String(20), default='pending', nullable=False, index=True)  # pending, forwarded, resolved
+    forwarded_to_hospital = db.Column(db.Boolean, default=False, nullable=False)
+    hospital_name = db.Column(db.String(100))
+    forwarded_at = db.Column(db.DateTime)
+    resolved_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    
+    def to_dict(self):
+        """Convert emergency alert to dictionary"""
+        return {
+            'id': self.alert_id,
+            'patient_id': self.patient_id,
+            'patient_name': self.patient_name,
+            'alert_type': self.alert_type,
+            'condition': self.condition,
+            'vitals': json.loads(self.vitals_json) if self.vitals_json else {},
+            'symptoms': self.symptoms,
+            'ai_assessment': self.ai_assessment,
+            'severity': self.severity,
+            'status': self.status,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'forwarded_to_hospital': self.forwarded_to_hospital,
+            'hospital_name': self.hospital_name,
+            'forwarded_at': self.forwarded_at.isoformat() if self.forwarded_at else None,
+            'resolved_at': self.resolved_at.isoformat() if self.resolved_at else None
+        }
+    
+    def __repr__(self):
+        return f'<EmergencyAlert {self.alert_id}>'
@@ -0,0 +1,62 @@
+"""
+/get_all_patients response shared by dpp.py and app.py
+Patients are read through database.iter_patients(), so only the requested fields
+are selected and rows are serialized while they are fetched:
+- fields=patient_id,name,age  projection (patient_id is always included)
+- limit=N&after=<patient_id>  cursor page; the next cursor is in X-Next-After / Link
+- format=ndjson (or Accept: application/x-ndjson)  one JSON object per line
+Without limit the JSON array is streamed as well, so memory stays flat for the
+whole census. The representation depends on Accept, so routes pass
+conditional_get(..., vary=LISTING_VARY).
+"""
+import json
+from urllib.parse import urlencode
+from flask import Response, jsonify, request, stream_with_context
+from database import iter_patients
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+PATIENT_PAGE_MAX = 1000
+LISTING_VARY = ("Accept",)
+
+
+def wants_ndjson():
+    """True if the client asked for newline-delimited JSON via ?format=ndjson or the Accept header"""
+    return request.args.get("format") == "ndjson" or request.accept_mimetypes.best == NDJSON_MIMETYPE
+
+
+def _json_array(rows):
+    yield "["
+    for i, row in enumerate(rows):
+        yield ("," if i else "") + json.dumps(row)
+    yield "]"
+
+
+def _ndjson(rows):
+    for row in rows:
+        yield json.dumps(row) + "\n"
+
+
+def patient_list_response():
+    """Build the /get_all_patients response from the request's query string"""
+    fields = [field.strip() for field in request.args.get("fields", "").split(",") if field.strip()]
+    after = request.args.get("after")
+    limit = request.args.get("limit", type=int)
+    
+    if wants_ndjson():
+        rows = iter_patients(fields, after=after, limit=limit)
+        return Response(stream_with_context(_ndjson(rows)), mimetype=NDJSON_MIMETYPE)
+    
+    if limit:
+        # A page is bounded, so it is built in full to know the next cursor
+        limit = max(1, min(limit, PATIENT_PAGE_MAX))
+        rows = list(iter_patients(fields, after=after, limit=limit))
+        response = jsonify(rows)
+        if len(rows) == limit:
+            next_after = rows[-1]["patient_id"]
+            response.headers["X-Next-After"] = next_after
+            query = urlencode({**request.args.to_dict(), "after": next_after})
+            response.headers["Link"] = f'<{request.path}?{query}>; rel="next"'
+        return response
+    
+    rows = iter_patients(fields, after=after)
+    return Response(stream_with_context(_json_array(rows)), mimetype="application/json")
@@ -0,0 +1,111 @@
+"""
+Background worker for the RAG index queue (rag_index_jobs)
+Runs as a daemon thread inside the web process, or standalone:
+    python rag_indexer.py            # drain the queue and exit
+    python rag_indexer.py --watch    # keep running
+"""
+import os
+import sys
+import threading
+from database import (claim_rag_index_job, complete_rag_index_job, fail_rag_index_job,
+                      index_patient_for_rag, register_rag_index_listener)
+from models import db
+
+# Idle workers also poll, to pick up jobs queued by other processes
+RAG_INDEX_POLL_SECONDS = float(os.getenv("RAG_INDEX_POLL_SECONDS", "5"))
+
+
+class RAGIndexWorker:
+    """Drains rag_index_jobs one job at a time within the given app's context"""
+
+    def __init__(self, app, poll_seconds=RAG_INDEX_POLL_SECONDS):
+        self.app = app
+        self.poll_seconds = poll_seconds
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.processed = 0
+        self.failed = 0
+
+    def wake(self):
+        self._wake.set()
+
+    def run_once(self):
+        """Process one job; returns False when the queue is empty"""
+        with self.app.app_context():
+            job = claim_rag_index_job()
+            if job is None:
+                return False
+            job_id, patient_id, requests = job
+            try:
+                index_patient_for_rag(patient_id)
+                complete_rag_index_job(job_id, requests)
+                self.processed += 1
+            except Exception as e:
+                db.session.rollback()
+                print(f"RAG indexing failed for {patient_id}: {e}")
+                fail_rag_index_job(job_id, e)
+                self.failed += 1
+            finally:
+                db.session.remove()
+            return True
+
+    def drain(self):
+        while not self._stop.is_set() and self.run_once():
+            pass
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.drain()
+            except Exception as e:
+                print(f"RAG index worker error: {e}")
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._loop, name="rag-indexer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def stats(self):
+        return {
+            "running": bool(self._thread and self._thread.is_alive()),
+            "processed": self.processed,
+            "failed": self.failed,
+        }
+
+
+_worker = None
+
+
+def start_rag_index_worker(app):
+    """Start the in-process worker once; new jobs wake it immediately"""
+    global _worker
+    if _worker is None:
+        _worker = RAGIndexWorker(app)
+        register_rag_index_listener(_worker.wake)
+    return _worker.start()
+
+
+if __name__ == "__main__":
+    from flask import Flask
+    from database import init_db
+
+    app = Flask(__name__)
+    init_db(app)
+    worker = RAGIndexWorker(app)
+    if "--watch" in sys.argv:
+        print("Watching rag_index_jobs (Ctrl+C to stop)...")
+        try:
+            worker._loop()
+        except KeyboardInterrupt:
+            pass
+    else:
+        worker.drain()
+    print(f"Jobs processed: {worker.processed}, failed: {worker.failed}")
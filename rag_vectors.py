@@ -0,0 +1,351 @@
+"""
+In-memory vector index over rag_documents.embedding
+Embeddings are loaded once into a NumPy matrix and kept current by reloading
+only rows whose updated_at moved; search is one matrix-vector product, or an
+IVF probe (rag_ann.py) once the index is large.
+
+With RAG_VECTOR_DIR set, the matrix lives in a memory-mapped file and the
+index state is saved there, so a restart resumes from the saved watermark
+instead of reading every embedding back from the database.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from datetime import datetime
+import numpy as np
+from models import db, RAGDocument
+from embeddings import get_embedder, pack_embedding, unpack_embedding
+from rag_ann import IVFIndex, RAG_ANN_MIN_DOCS, RAG_ANN_NPROBE
+
+EMBED_BATCH_SIZE = 500  # documents embedded and written back per transaction
+RAG_VECTOR_DIR = os.getenv("RAG_VECTOR_DIR", "").strip()
+RAG_VECTOR_SAVE_SECONDS = float(os.getenv("RAG_VECTOR_SAVE_SECONDS", "30"))
+# Filters matching fewer rows than this are scored exactly instead of through the ANN index
+EXACT_FILTER_MAX_ROWS = 5000
+# Rebuild once this share of rows are tombstones
+MAX_DEAD_FRACTION = 0.25
+
+
+class RAGVectorIndex:
+    """Per-process cosine top-k index; rows are unit vectors, so dot product = cosine"""
+
+    def __init__(self, directory=None):
+        self._lock = threading.Lock()
+        self._directory = directory
+        self._last_save = 0.0
+        self._dirty = False
+        self._dim = 0
+        self._matrix = None
+        self._reset(None, 0)
+
+    def _reset(self, model, dim):
+        self._model = model
+        self._dim = dim
+        self._matrix = self._open_matrix(0)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._patient_db_ids = np.zeros(0, dtype=np.int64)  # -1 for shared documents
+        self._doc_types = np.zeros(0, dtype=object)
+        self._alive = np.zeros(0, dtype=bool)
+        self._positions = {}  # document id -> row
+        self._size = 0  # rows used, including deleted ones
+        self._watermark = None  # newest updated_at loaded
+        self._row_count = 0  # table row count at last refresh
+        self._ann = None
+
+    # ----- storage -----
+
+    def _matrix_path(self):
+        return os.path.join(self._directory, "vectors.f32")
+
+    def _open_matrix(self, capacity, keep=0):
+        """Allocate the vector matrix, file-backed when a directory is configured"""
+        if not self._directory or capacity == 0:
+            matrix = np.zeros((capacity, self._dim), dtype=np.float32)
+            if keep:
+                matrix[:keep] = self._matrix[:keep]
+            return matrix
+        path = self._matrix_path()
+        if isinstance(self._matrix, np.memmap):
+            self._matrix.flush()
+        elif keep:
+            # Moving from the empty in-memory matrix to the file
+            np.asarray(self._matrix[:keep]).tofile(path)
+        mode = "r+b" if os.path.exists(path) else "w+b"
+        with open(path, mode) as f:
+            f.truncate(capacity * self._dim * 4)
+        return np.memmap(path, dtype=np.float32, mode="r+", shape=(capacity, self._dim))
+
+    def _grow(self, needed):
+        capacity = len(self._ids)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 64)
+        self._matrix = self._open_matrix(capacity, keep=self._size)
+        for name in ("_ids", "_patient_db_ids", "_doc_types", "_alive"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def _save(self, force=False):
+        """Persist the index state (throttled); the matrix file itself is already on disk"""
+        if not self._directory or not self._dirty:
+            return
+        if not force and time.monotonic() - self._last_save < RAG_VECTOR_SAVE_SECONDS:
+            return
+        if isinstance(self._matrix, np.memmap):
+            self._matrix.flush()
+        size = self._size
+        np.savez(os.path.join(self._directory, "rows.npz"), ids=self._ids[:size],
+                 patient_db_ids=self._patient_db_ids[:size], alive=self._alive[:size],
+                 doc_types=self._doc_types[:size].astype(str))
+        if self._ann is not None:
+            self._ann.save(self._directory)
+        state = {
+            "model": self._model, "dim": self._dim, "size": size, "capacity": len(self._ids),
+            "row_count": self._row_count, "ann": self._ann is not None,
+            "watermark": self._watermark.isoformat() if self._watermark else None,
+        }
+        # Written last and atomically: a crash mid-save leaves the previous consistent state
+        tmp_path = os.path.join(self._directory, "state.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, os.path.join(self._directory, "state.json"))
+        self._last_save = time.monotonic()
+        self._dirty = False
+
+    def _load(self, embedder):
+        """Restore a saved index for the current embedder; False if there is none"""
+        if not os.path.exists(os.path.join(self._directory, "state.json")):
+            return False
+        try:
+            with open(os.path.join(self._directory, "state.json")) as f:
+                state = json.load(f)
+            if state["model"] != embedder.name or state["dim"] != embedder.dim:
+                return False
+            rows = np.load(os.path.join(self._directory, "rows.npz"))
+            size, capacity = state["size"], state["capacity"]
+            self._matrix = np.memmap(self._matrix_path(), dtype=np.float32, mode="r+", shape=(capacity, self._dim))
+            self._ids = np.zeros(capacity, dtype=np.int64)
+            self._patient_db_ids = np.zeros(capacity, dtype=np.int64)
+            self._doc_types = np.zeros(capacity, dtype=object)
+            self._alive = np.zeros(capacity, dtype=bool)
+            self._ids[:size] = rows["ids"]
+            self._patient_db_ids[:size] = rows["patient_db_ids"]
+            self._doc_types[:size] = rows["doc_types"].astype(object)
+            self._alive[:size] = rows["alive"]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"RAG vector index state not loaded: {e}")
+            self._reset(embedder.name, embedder.dim)
+            return False
+        self._size = size
+        self._row_count = state["row_count"]
+        self._watermark = datetime.fromisoformat(state["watermark"]) if state["watermark"] else None
+        self._positions = {doc_id: position for position, doc_id in enumerate(self._ids[:size].tolist())
+                           if self._alive[position]}
+        self._ann = IVFIndex.load(self._directory) if state["ann"] else None
+        return True
+
+    # ----- refresh -----
+
+    def _embed_missing(self, rows, embedder):
+        """Embed documents stored without a vector from the current embedder and save them"""
+        computed = {}
+        table = RAGDocument.__table__
+        for start in range(0, len(rows), EMBED_BATCH_SIZE):
+            ids = [row.id for row in rows[start:start + EMBED_BATCH_SIZE]]
+            contents = dict(db.session.query(RAGDocument.id, RAGDocument.content)
+                            .filter(RAGDocument.id.in_(ids)).all())
+            vectors = embedder.embed([contents.get(doc_id, "") for doc_id in ids])
+            with db.engine.begin() as conn:
+                conn.execute(
+                    table.update()
+                    .where(table.c.id == db.bindparam("doc_id"))
+                    # Keep updated_at: the content did not change
+                    .values(embedding=db.bindparam("vector"), embedding_model=embedder.name,
+                            updated_at=table.c.updated_at),
+                    [{"doc_id": doc_id, "vector": pack_embedding(vector)} for doc_id, vector in zip(ids, vectors)]
+                )
+            computed.update(zip(ids, vectors))
+        return computed
+
+    def refresh(self):
+        """Load documents added or changed since the last refresh and drop deleted ones"""
+        embedder = get_embedder()
+        with self._lock:
+            if self._model != embedder.name:
+                self._reset(embedder.name, embedder.dim)
+                if self._directory:
+                    self._load(embedder)
+            self._load_changes(embedder)
+            if self._size and self._size - len(self._positions) > MAX_DEAD_FRACTION * self._size:
+                self._reset(embedder.name, embedder.dim)
+                self._load_changes(embedder)
+            self._maybe_build_ann()
+            self._save()
+
+    def _row_query(self):
+        return db.session.query(RAGDocument.id, RAGDocument.doc_type, RAGDocument.patient_db_id,
+                                RAGDocument.embedding, RAGDocument.embedding_model, RAGDocument.updated_at)
+
+    def _load_changes(self, embedder):
+        # Two queries: each is answered from an index, together they would scan the table
+        row_count = db.session.query(db.func.count()).select_from(RAGDocument).scalar()
+        newest = db.session.query(db.func.max(RAGDocument.updated_at)).scalar()
+        if row_count == self._row_count and newest == self._watermark:
+            return
+
+        query = self._row_query()
+        if self._watermark is not None:
+            query = query.filter(RAGDocument.updated_at >= self._watermark)
+        self._merge_rows(query.all(), embedder)
+
+        if len(self._positions) != row_count:
+            self._reconcile(embedder)
+        self._row_count = row_count
+        self._dirty = True
+
+    def _merge_rows(self, rows, embedder):
+        """Write rows into the matrix, appending documents not seen before"""
+        missing = [row for row in rows if row.embedding is None or row.embedding_model != embedder.name]
+        computed = self._embed_missing(missing, embedder) if missing else {}
+
+        self._grow(self._size + len(rows))
+        changed = []
+        for row in rows:
+            position = self._positions.get(row.id)
+            if position is None:
+                position = self._size
+                self._positions[row.id] = position
+                self._size += 1
+            vector = computed.get(row.id)
+            self._matrix[position] = vector if vector is not None else unpack_embedding(row.embedding)
+            self._ids[position] = row.id
+            self._patient_db_ids[position] = row.patient_db_id if row.patient_db_id is not None else -1
+            self._doc_types[position] = row.doc_type
+            self._alive[position] = True
+            changed.append(position)
+            if self._watermark is None or row.updated_at > self._watermark:
+                self._watermark = row.updated_at
+        if self._ann is not None and changed:
+            self._ann.assign_rows(changed, self._matrix)
+
+    def _reconcile(self, embedder):
+        """
+        Compare document IDs with the table: tombstone deleted documents and load
+        ones written with an updated_at older than the watermark
+        """
+        existing = np.array([doc_id for (doc_id,) in db.session.query(RAGDocument.id).all()], dtype=np.int64)
+        live = np.flatnonzero(self._alive[:self._size])
+        gone = live[~np.isin(self._ids[live], existing)]
+        if len(gone):
+            self._alive[gone] = False
+            for doc_id in self._ids[gone].tolist():
+                self._positions.pop(doc_id, None)
+            if self._ann is not None:
+                self._ann.remove_rows(gone)
+
+        unseen = existing[~np.isin(existing, self._ids[np.flatnonzero(self._alive[:self._size])])].tolist()
+        for start in range(0, len(unseen), EMBED_BATCH_SIZE):
+            batch = unseen[start:start + EMBED_BATCH_SIZE]
+            self._merge_rows(self._row_query().filter(RAGDocument.id.in_(batch)).all(), embedder)
+
+    def _maybe_build_ann(self):
+        """Train the IVF index once the collection is large, and retrain when it has doubled"""
+        live = len(self._positions)
+        if live < RAG_ANN_MIN_DOCS:
+            return
+        if self._ann is not None and live <= 2 * self._ann.trained_size:
+            return
+        self._ann = IVFIndex.train(self._matrix, self._size)
+        self._ann.remove_rows(np.flatnonzero(~self._alive[:self._size]))
+        self._ann.rebuild_lists()
+        self._dirty = True
+
+    # ----- search -----
+
+    def search(self, query, limit=10, doc_type=None, patient_db_ids=None, nprobe=None):
+        """
+        Return [(document id, cosine score)] best first, for documents with a positive score.
+        patient_db_ids restricts results; include None in it to allow shared documents.
+        nprobe sets how many IVF clusters are searched (more = better recall); 0 forces exact search.
+        """
+        self.refresh()
+        query_vector = get_embedder().embed([query])[0]
+        nprobe = RAG_ANN_NPROBE if nprobe is None else nprobe
+        with self._lock:
+            size = self._size
+            if not size:
+                return []
+            mask = self._alive[:size].copy()
+            if doc_type:
+                mask &= self._doc_types[:size] == doc_type
+            if patient_db_ids is not None:
+                allowed = [-1 if value is None else value for value in patient_db_ids]
+                mask &= np.isin(self._patient_db_ids[:size], allowed)
+            filtered = doc_type or patient_db_ids is not None
+            if self._ann is not None and nprobe > 0 and not (filtered and mask.sum() <= EXACT_FILTER_MAX_ROWS):
+                candidates = self._ann.candidates(query_vector, nprobe)
+                candidates = candidates[mask[candidates]]
+            else:
+                candidates = np.flatnonzero(mask)
+            if not len(candidates):
+                return []
+            scores = np.asarray(self._matrix[candidates]) @ query_vector
+            keep = scores > 0
+            candidates, scores = candidates[keep], scores[keep]
+            if not len(candidates):
+                return []
+            k = min(limit, len(candidates))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            return [(int(self._ids[candidates[i]]), float(scores[i])) for i in top]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "model": self._model,
+                "documents": len(self._positions),
+                "deleted_rows": self._size - len(self._positions),
+                "ann_lists": self._ann.nlist if self._ann is not None else 0,
+                "persistent": bool(self._directory),
+                "watermark": self._watermark.isoformat() if self._watermark else None,
+            }
+
+    def close(self):
+        with self._lock:
+            self._save(force=True)
+
+
+def _claim_directory(directory):
+    """Take an exclusive lock on the index directory; other processes keep an in-memory index"""
+    os.makedirs(directory, exist_ok=True)
+    try:
+        import fcntl
+    except ImportError:
+        return directory
+    lock_file = open(os.path.join(directory, ".lock"), "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        print(f"RAG vector directory {directory} is in use by another process; using an in-memory index")
+        return None
+    _claim_directory.lock_file = lock_file  # held for the life of the process
+    return directory
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_rag_vector_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            directory = _claim_directory(RAG_VECTOR_DIR) if RAG_VECTOR_DIR else None
+            _index = RAGVectorIndex(directory)
+            atexit.register(_index.close)
+        return _index
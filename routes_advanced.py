@@ -3,6 +3,7 @@ Flask Routes for Advanced Features
 Add these to your dpp.py or import this module
 """
 from flask import jsonify, request, send_file
+from http_cache import conditional_get
 from advanced_features import (
     get_patient_dashboard,
     get_patient_trends,
@@ -10,7 +11,9 @@ from advanced_features import (
     get_patient_alerts,
     generate_patient_report_pdf,
     get_upcoming_appointments,
-    get_patient_medications
+    get_patient_medications,
+    SEARCH_PAGE_SIZE,
+    SEARCH_MAX_PAGE_SIZE
 )
 
 # ==================== DASHBOARD ROUTE ====================
@@ -19,6 +22,7 @@ def register_advanced_routes(app):
     """Register all advanced feature routes"""
     
     @app.route("/api/dashboard")
+    @conditional_get('patients')
     def api_dashboard():
         """Real-time patient dashboard with statistics"""
         try:
@@ -49,9 +53,12 @@ def register_advanced_routes(app):
         """Advanced patient search with filters"""
         try:
             if request.method == "POST":
-                data = request.get_json()
+                data = request.get_json(silent=True) or {}
                 query = data.get('query', '')
                 filters = data.get('filters', {})
+                after = data.get('after')
+                limit = data.get('limit')
+                fuzzy = bool(data.get('fuzzy'))
             else:
                 query = request.args.get('q', '')
                 filters = {
@@ -59,19 +66,33 @@ def register_advanced_routes(app):
                     'max_age': request.args.get('max_age'),
                     'gender': request.args.get('gender'),
                     'status': request.args.get('status'),
+                    'alert': request.args.get('alert'),
                     'start_date': request.args.get('start_date'),
                     'end_date': request.args.get('end_date')
                 }
                 # Remove None values
                 filters = {k: v for k, v in filters.items() if v is not None}
+                after = request.args.get('after')
+                limit = request.args.get('limit')
+                fuzzy = request.args.get('fuzzy', '').lower() in ('1', 'true', 'yes')
             
-            results = advanced_patient_search(query, filters)
+            try:
+                limit = int(limit or SEARCH_PAGE_SIZE)
+            except (TypeError, ValueError):
+                raise ValueError(f"limit must be an integer, got {limit!r}")
+            limit = max(1, min(limit, SEARCH_MAX_PAGE_SIZE))
+            results = advanced_patient_search(query, filters, after=after, limit=limit, fuzzy=fuzzy)
             return jsonify({
                 "results": results,
                 "count": len(results),
                 "query": query,
-                "filters": filters
+                "filters": filters,
+                # Cursor for the next page; None once the last page is reached
+                "next_after": results[-1]['patient_id'] if len(results) == limit and not fuzzy else None
             })
+        except ValueError as e:
+            # Bad limit, cursor, alert rule, age or date
+            return jsonify({"error": str(e)}), 400
         except Exception as e:
             return jsonify({"error": str(e)}), 500
     
@@ -0,0 +1,27 @@
+"""
+Server-Sent Events helpers shared by the streaming endpoints
+"""
+import json
+from flask import request
+
+# Disable proxy buffering (nginx) and caching so events reach the browser immediately
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
+
+
+def format_sse(data, event=None):
+    """Encode one SSE message; data is serialized as JSON"""
+    lines = []
+    if event:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def wants_event_stream(payload=None):
+    """True if the client asked for a streamed response via {"stream": true} or the Accept header"""
+    if payload and payload.get("stream"):
+        return True
+    return request.accept_mimetypes.best == "text/event-stream"